@@ -27,6 +27,11 @@ SECRET_KEY = 'django-insecure-=!yl^s2ugm7jz3*taxnr0zic3ygwf=d3tt4-ge$wxzqyz2hh@e
 
 # SECURITY WARNING: don't run with debug turned on in production!
 # DEBUG = True
+
+AUTHENTICATION_BACKENDS = [
+    'setup.access.BitsetModelBackend',
+]
+
 LOGIN_URL = 'login'  # Set this to your login URL
 # ALLOWED_HOSTS = []
 
@@ -55,6 +60,9 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'setup.middleware.AuditUserMiddleware',
+    'setup.middleware.ScopeMiddleware',
+    'setup.middleware.LocationContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     
@@ -88,9 +96,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file-backed test database lets the concurrency tests use
+        # several connections at once.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Cache version counters and the invalidation bus (setup/bus.py) must be
+# shared by every worker process, so a per-process local-memory cache is
+# refused by a system check. Redis when REDIS_URL is set (needs the redis
+# package), otherwise a database table that `migrate` creates (setup 0061).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,3 +164,55 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Outbound SMS gateways (see setup/sms.py). Messages are sent by
+# `python manage.py send_sms`, never inside a web request.
+SMS_GATEWAYS = {
+    'default': {
+        'BACKEND': 'setup.sms.FileGateway',
+        'OPTIONS': {'path': BASE_DIR / 'sms_outbox.log'},
+        'RATE_LIMIT': 10,  # messages per second
+        'BATCH_SIZE': 50,
+        'MAX_ATTEMPTS': 5,
+    },
+}
+
+# Daily sequence counters older than this are folded into monthly archives
+# by `python manage.py compact_sequences` (run it daily from cron).
+SEQUENCE_DAILY_RETENTION_DAYS = 7
+
+# Audit rows are written in one batch per transaction on commit. Set
+# AUDIT_ASYNC to hand them to a background writer thread instead.
+AUDIT_ASYNC = False
+AUDIT_ASYNC_BATCH_SIZE = 500
+AUDIT_ASYNC_FLUSH_INTERVAL = 1.0  # seconds
+
+# Audit rows older than AUDIT_ARCHIVE_AFTER_DAYS are moved to monthly
+# compressed files by `python manage.py archive_audit` (gzip, or zstd when
+# the zstandard package is installed).
+AUDIT_ARCHIVE_DIR = BASE_DIR / 'audit_archive'
+AUDIT_ARCHIVE_AFTER_DAYS = 365
+AUDIT_ARCHIVE_COMPRESSION = 'gzip'
+
+# A CompanyLocation snapshot is taken after this many audited changes, which
+# bounds the number of audit rows a point-in-time reconstruction replays.
+LOCATION_SNAPSHOT_INTERVAL = 50
+
+# Company logo uploads are checked while streaming (setup.uploads)
+FILE_UPLOAD_HANDLERS = [
+    'setup.uploads.LogoUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Threads that build logo thumbnails off the request; 0 builds them inline on commit
+LOGO_DERIVATIVE_WORKERS = 2
+
+# Cached company hierarchy documents (setup.hierarchy) are replaced as soon
+# as anything in the tree changes; this only bounds how long unused ones stay.
+HIERARCHY_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Terminals name their branch by CompanyLocation.code in an X-Location-Code
+# header, the session, or a subdomain of this domain (e.g. 'pos.example.com'
+# makes col01.pos.example.com resolve location COL01). None disables subdomains.
+LOCATION_SUBDOMAIN_BASE = None
@@ -0,0 +1,238 @@
+# access.py
+"""
+Precomputed permissions and location scope as bitsets.
+
+Every ``Permission`` is a bit (its primary key) and every location and
+company is a bit (its primary key as well), so a user's effective
+permissions and scope are three or four Python ints. They are built once,
+cached under the user's permission and scope versions, warmed at login, and
+make ``has_perm``/``has_module_perms``/location checks single bit tests.
+
+``BitsetModelBackend`` serves ``user.has_perm()`` from these bitsets. The
+versions are bumped by ``signals.py`` whenever permissions, groups,
+``is_active``/``is_superuser`` or ``UserCompany``/``UserLocation`` change,
+and after ``migrate`` (which creates permissions without signals).
+
+The global permission version is read once per request, with the user's
+versions, and kept on ``UserAccess``; permission checks themselves make no
+cache round trips, and an unknown permission name is a miss in the index,
+not a reload.
+"""
+import threading
+from dataclasses import dataclass
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import caching
+from .scope import load_user_scope, scope_version_name
+
+ACCESS_CACHE_TIMEOUT = 60 * 60
+GLOBAL_PERMISSIONS_VERSION = 'permissions'
+
+
+def user_permissions_version_name(user_id):
+    return f'user-permissions:{user_id}'
+
+
+def bits_from_ids(ids):
+    bits = 0
+    for pk in ids:
+        bits |= 1 << pk
+    return bits
+
+
+def ids_from_bits(bits):
+    ids = []
+    while bits:
+        lowest = bits & -bits
+        ids.append(lowest.bit_length() - 1)
+        bits ^= lowest
+    return ids
+
+
+def _has_bit(bits, pk):
+    return pk is not None and pk >= 0 and (bits >> pk) & 1 == 1
+
+
+class PermissionIndex:
+    """``'app_label.codename'`` <-> permission bit, and one mask per app"""
+
+    def __init__(self, rows):
+        self.bits = {}
+        self.names = {}
+        self.app_masks = {}
+        for pk, app_label, codename in rows:
+            name = f'{app_label}.{codename}'
+            self.bits[name] = pk
+            self.names[pk] = name
+            self.app_masks[app_label] = self.app_masks.get(app_label, 0) | (1 << pk)
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def permission_index(version=None):
+    """
+    The per-process permission index, rebuilt when permissions change.
+    ``version`` is the global permission version if the caller already has it.
+    """
+    global _index, _index_version
+    if version is None:
+        version = caching.get_version(GLOBAL_PERMISSIONS_VERSION)
+    if _index is None or _index_version != version:
+        rows = Permission.objects.values_list('pk', 'content_type__app_label', 'codename')
+        with _index_lock:
+            _index, _index_version = PermissionIndex(rows), version
+    return _index
+
+
+def permission_bit(name, version=None):
+    return permission_index(version).bits.get(name)
+
+
+@dataclass(frozen=True)
+class UserAccess:
+    user_id: int = None
+    is_active: bool = False
+    is_superuser: bool = False
+    permission_bits: int = 0
+    company_bits: int = 0
+    location_bits: int = 0
+    # Companies granted as a whole through UserCompany
+    full_company_bits: int = 0
+    # Global permission version the bits were built against
+    permissions_version: str = None
+
+    def has_perm(self, name):
+        if not self.is_active:
+            return False
+        return self.is_superuser or _has_bit(self.permission_bits, permission_bit(name, self.permissions_version))
+
+    def has_module_perms(self, app_label):
+        if not self.is_active:
+            return False
+        app_masks = permission_index(self.permissions_version).app_masks
+        return self.is_superuser or bool(self.permission_bits & app_masks.get(app_label, 0))
+
+    def permission_names(self):
+        names = permission_index(self.permissions_version).names
+        return {names[pk] for pk in ids_from_bits(self.permission_bits) if pk in names}
+
+    def has_company(self, company):
+        return self.is_superuser or _has_bit(self.company_bits, getattr(company, 'pk', company))
+
+    def has_location(self, location):
+        """``location`` is an instance or pk; only instances can match a whole-company grant"""
+        if self.is_superuser or _has_bit(self.location_bits, getattr(location, 'pk', location)):
+            return True
+        return _has_bit(self.full_company_bits, getattr(location, 'company_id', None))
+
+    def location_mask(self, queryset, field='pk'):
+        """Bits of the locations referenced by ``queryset`` that this user may see"""
+        mask = bits_from_ids(queryset.values_list(field, flat=True).distinct())
+        if self.is_superuser:
+            return mask
+        company_field = 'company' if field == 'pk' else f'{field}__company'
+        full = bits_from_ids(
+            queryset.filter(**{f'{company_field}__in': ids_from_bits(self.full_company_bits)})
+            .values_list(field, flat=True).distinct()
+        ) if self.full_company_bits else 0
+        return mask & (self.location_bits | full)
+
+    def filter_locations(self, queryset, field='pk'):
+        """Intersect ``queryset`` with the allowed locations"""
+        if self.is_superuser:
+            return queryset
+        company_field = 'company' if field == 'pk' else f'{field}__company'
+        return queryset.filter(
+            Q(**{f'{field}__in': ids_from_bits(self.location_bits)})
+            | Q(**{f'{company_field}__in': ids_from_bits(self.full_company_bits)})
+        )
+
+    def filter_companies(self, queryset, field='pk'):
+        if self.is_superuser:
+            return queryset
+        return queryset.filter(**{f'{field}__in': ids_from_bits(self.company_bits)})
+
+
+NO_ACCESS = UserAccess()
+
+
+def build_user_access(user, permissions_version=None):
+    permission_ids = (
+        Permission.objects
+        .filter(Q(user=user) | Q(group__user=user))
+        .values_list('pk', flat=True).distinct()
+    )
+    scope = load_user_scope(user.pk)
+    return UserAccess(
+        user_id=user.pk,
+        is_active=user.is_active,
+        is_superuser=user.is_superuser,
+        permission_bits=bits_from_ids(permission_ids),
+        company_bits=bits_from_ids(scope.company_ids),
+        location_bits=bits_from_ids(scope.location_ids),
+        full_company_bits=bits_from_ids(scope.full_company_ids),
+        permissions_version=permissions_version,
+    )
+
+
+def _versions(user_id):
+    """``(cache key, global permission version)`` with one cache round trip"""
+    versions = caching.get_versions(
+        user_permissions_version_name(user_id), scope_version_name(user_id), GLOBAL_PERMISSIONS_VERSION,
+    )
+    return f'access:{user_id}:' + ':'.join(f'v{version}' for version in versions), versions[-1]
+
+
+def get_user_access(user, rebuild=False):
+    """
+    The cached ``UserAccess`` of ``user``. Like ``ModelBackend``'s permission
+    cache it is memoised on the user object, i.e. for one request.
+    """
+    if user is None or not user.is_authenticated:
+        return NO_ACCESS
+    if not rebuild and hasattr(user, '_bitset_access'):
+        return user._bitset_access
+    key, permissions_version = _versions(user.pk)
+    access = None if rebuild else cache.get(key)
+    if access is None:
+        access = build_user_access(user, permissions_version)
+        cache.set(key, access, ACCESS_CACHE_TIMEOUT)
+    user._bitset_access = access
+    return access
+
+
+def invalidate_user_permissions(user_id):
+    caching.bump_version(user_permissions_version_name(user_id))
+
+
+def invalidate_all_permissions():
+    caching.bump_version(GLOBAL_PERMISSIONS_VERSION)
+
+
+class BitsetModelBackend(ModelBackend):
+    """``ModelBackend`` with permission checks answered from ``UserAccess``"""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        access = get_user_access(user_obj)
+        if access.is_superuser:
+            return set(permission_index(access.permissions_version).bits)
+        return access.permission_names()
+
+    def has_perm(self, user_obj, perm, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return False
+        return get_user_access(user_obj).has_perm(perm)
+
+    def has_module_perms(self, user_obj, app_label):
+        if not user_obj.is_active or user_obj.is_anonymous:
+            return False
+        return get_user_access(user_obj).has_module_perms(app_label)
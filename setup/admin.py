@@ -1,12 +1,47 @@
 # admin.py
 from django.contrib import admin
+from django.db import models
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
+from .forms import LogoImageField
 from .models import Company
 from .models import Department
+from .scope import scope_filter
+
+
+class ScopedAdminMixin:
+    """
+    Limit rows and FK/M2M choices to the user's UserCompany/UserLocation scope.
+
+    ``scope_company_field``/``scope_location_field`` are lookup paths from
+    the model to its company and location; ``None`` leaves rows unscoped.
+    Choices for a related model are scoped by that model's own admin.
+    """
+    scope_company_field = 'company'
+    scope_location_field = None
+
+    def scope_queryset(self, queryset, request):
+        return scope_filter(queryset, request.user, self.scope_company_field, self.scope_location_field)
+
+    def get_queryset(self, request):
+        return self.scope_queryset(super().get_queryset(request), request)
+
+    def get_field_queryset(self, db, db_field, request):
+        queryset = super().get_field_queryset(db, db_field, request)
+        related_admin = self.admin_site._registry.get(db_field.remote_field.model)
+        if isinstance(related_admin, ScopedAdminMixin):
+            if queryset is None:
+                queryset = db_field.remote_field.model._default_manager.using(db).all()
+            queryset = related_admin.scope_queryset(queryset, request)
+        return queryset
+
 
 @admin.register(Company)
-class CompanyAdmin(admin.ModelAdmin):
+class CompanyAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = 'pk'
+    formfield_overrides = {
+        models.ImageField: {'form_class': LogoImageField},
+    }
     list_display = [
         'logo_preview',
         'name', 
@@ -96,23 +131,26 @@ class CompanyAdmin(admin.ModelAdmin):
     list_editable = ['is_active']
     save_on_top = True
     
+    def _logo_picture(self, obj, variant, style):
+        webp = obj.logo_url(variant, 'webp')
+        if webp and webp != obj.logo.url:
+            return format_html(
+                '<picture><source srcset="{}" type="image/webp"/><img src="{}" style="{}" loading="lazy"/></picture>',
+                webp, obj.logo_url(variant), style
+            )
+        return format_html('<img src="{}" style="{}" loading="lazy"/>', obj.logo.url, style)
+
     def logo_preview(self, obj):
         """Small logo preview for list display"""
         if obj.logo:
-            return format_html(
-                '<img src="{}" style="width: 30px; height: 30px; object-fit: contain;"/>',
-                obj.logo.url
-            )
+            return self._logo_picture(obj, 'thumb', 'width: 30px; height: 30px; object-fit: contain;')
         return "-"
     logo_preview.short_description = _('Logo')
     
     def logo_preview_large(self, obj):
         """Larger logo preview for detail view"""
         if obj.logo:
-            return format_html(
-                '<img src="{}" style="max-width: 200px; max-height: 200px;"/>',
-                obj.logo.url
-            )
+            return self._logo_picture(obj, 'preview', 'max-width: 200px; max-height: 200px;')
         return _("No logo uploaded")
     logo_preview_large.short_description = _('Logo Preview')
     
@@ -139,10 +177,18 @@ class CompanyAdmin(admin.ModelAdmin):
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
+from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from django.urls import path, reverse
+from django.utils.html import format_html_join
 from .models import LocationType, CompanyLocation, LocationAuditLog
+from .pagination import decode_timestamp_cursor, keyset_page
+from . import audit, location_history
 
 @admin.register(LocationType)
-class LocationTypeAdmin(admin.ModelAdmin):
+class LocationTypeAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = None
     list_display = ['name', 'is_internal', 'is_active', 'created_by', 'created_at']
     list_filter = ['is_internal', 'is_active']
     search_fields = ['name', 'description']
@@ -154,17 +200,13 @@ class LocationTypeAdmin(admin.ModelAdmin):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
 
-class LocationAuditLogInline(admin.TabularInline):
-    model = LocationAuditLog
-    readonly_fields = ['action', 'field_name', 'old_value', 'new_value', 'timestamp', 'user', 'ip_address']
-    extra = 0
-    can_delete = False
-    
-    def has_add_permission(self, request, obj=None):
-        return False
+# Audit rows shown on the location change page; older pages load on demand
+AUDIT_TIMELINE_PAGE_SIZE = 10
 
 @admin.register(CompanyLocation)
-class CompanyLocationAdmin(admin.ModelAdmin):
+class CompanyLocationAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = None
+    scope_location_field = 'pk'
     list_display = [
         'name',
         'company',
@@ -199,6 +241,7 @@ class CompanyLocationAdmin(admin.ModelAdmin):
         'created_at',
         'updated_by',
         'updated_at',
+        'audit_timeline',
     ]
     
     fieldsets = [
@@ -241,9 +284,81 @@ class CompanyLocationAdmin(admin.ModelAdmin):
                 ('updated_by', 'updated_at'),
             )
         }),
+        (_('Audit History'), {
+            'fields': (
+                'audit_timeline',
+            )
+        }),
     ]
-    
-    inlines = [LocationAuditLogInline]
+
+    class Media:
+        js = ('setup/admin/audit_timeline.js',)
+
+    def audit_timeline_page(self, location, before=None):
+        queryset = LocationAuditLog.objects.timeline(location, before).select_related('user')
+        return keyset_page(queryset, AUDIT_TIMELINE_PAGE_SIZE, lambda log: (log.timestamp, log.pk))
+
+    def audit_timeline(self, obj):
+        """Latest audit rows with a button that loads older pages"""
+        if not obj or not obj.pk:
+            return "-"
+        logs, next_cursor = self.audit_timeline_page(obj)
+        rows = format_html_join(
+            '',
+            '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>',
+            (
+                (log.timestamp, log.user, log.action, log.field_name, log.old_value, log.new_value)
+                for log in logs
+            ),
+        )
+        more = ''
+        if next_cursor:
+            more = format_html(
+                '<button type="button" class="button audit-timeline-more" data-url="{}" data-cursor="{}">{}</button>',
+                reverse('admin:setup_companylocation_audit_timeline', args=[obj.pk]),
+                next_cursor,
+                _('Load older entries'),
+            )
+        return format_html(
+            '<table class="audit-timeline"><thead><tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th>'
+            '<th>{}</th><th>{}</th></tr></thead><tbody>{}</tbody></table>{}',
+            _('Time'), _('User'), _('Action'), _('Field'), _('Old value'), _('New value'),
+            rows,
+            more,
+        )
+    audit_timeline.short_description = _('Recent changes')
+
+    def get_urls(self):
+        return [
+            path(
+                '<path:object_id>/audit-timeline/',
+                self.admin_site.admin_view(self.audit_timeline_view),
+                name='setup_companylocation_audit_timeline',
+            ),
+        ] + super().get_urls()
+
+    def audit_timeline_view(self, request, object_id):
+        """JSON page of older audit rows for the change page"""
+        location = self.get_object(request, unquote(object_id))
+        if location is None:
+            raise Http404
+        if not self.has_view_or_change_permission(request, location):
+            raise PermissionDenied
+        logs, next_cursor = self.audit_timeline_page(location, decode_timestamp_cursor(request.GET.get('before')))
+        return JsonResponse({
+            'results': [
+                {
+                    'timestamp': log.timestamp,
+                    'user': str(log.user),
+                    'action': log.action,
+                    'field_name': log.field_name,
+                    'old_value': log.old_value,
+                    'new_value': log.new_value,
+                }
+                for log in logs
+            ],
+            'next': next_cursor,
+        })
     
     def save_model(self, request, obj, form, change):
         if not change:
@@ -251,28 +366,32 @@ class CompanyLocationAdmin(admin.ModelAdmin):
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
         
-        # Create audit log
+        # Create audit log (written in one batch when the transaction commits)
+        meta = audit.request_meta(request)
         if change:
             changed_fields = form.changed_data
-            for field_name in changed_fields:
-                LocationAuditLog.objects.create(
+            audit.record(*[
+                LocationAuditLog(
                     location=obj,
                     action='update',
                     field_name=field_name,
                     old_value=str(form.initial.get(field_name, '')),
                     new_value=str(getattr(obj, field_name)),
+                    old_value_json=form.initial.get(field_name),
+                    new_value_json=obj._meta.get_field(field_name).value_from_object(obj),
                     user=request.user,
-                    ip_address=request.META.get('REMOTE_ADDR'),
-                    user_agent=request.META.get('HTTP_USER_AGENT', '')
+                    **meta
                 )
+                for field_name in changed_fields
+            ])
         else:
-            LocationAuditLog.objects.create(
+            audit.record(LocationAuditLog(
                 location=obj,
                 action='create',
                 user=request.user,
-                ip_address=request.META.get('REMOTE_ADDR'),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
+                **meta
+            ))
+        location_history.maybe_snapshot(obj, created=not change)
 
     def delete_model(self, request, obj):
         LocationAuditLog.objects.create(
@@ -285,7 +404,9 @@ class CompanyLocationAdmin(admin.ModelAdmin):
         super().delete_model(request, obj)
 
 @admin.register(LocationAuditLog)
-class LocationAuditLogAdmin(admin.ModelAdmin):
+class LocationAuditLogAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = 'location__company'
+    scope_location_field = 'location'
     list_display = ['location', 'action', 'field_name', 'user', 'timestamp']
     list_filter = ['action', 'timestamp', 'user']
     search_fields = ['location__name', 'field_name', 'user__username']
@@ -301,7 +422,7 @@ class LocationAuditLogAdmin(admin.ModelAdmin):
 
 
 @admin.register(Department)
-class DepartmentAdmin(admin.ModelAdmin):
+class DepartmentAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['Code','name', 'company', 'is_main_department', 'is_ipd', 'is_laboratory', 'is_active']
     list_filter = ['is_main_department', 'is_ipd', 'is_active', 'is_laboratory', 'company']
     search_fields = ['name', 'responsible_person', 'income_account', 'expense_account']
@@ -321,7 +442,7 @@ class DepartmentAdmin(admin.ModelAdmin):
         }),
         ('Invoice and Sequence Options', {
             'fields': ('modify_invoice_number', 'issue_sequence_number', 'issue_sequence_auto',
-                       'department_wise_sequence', 'department_sequence_per_day')
+                       'department_wise_sequence', 'department_sequence_per_day', 'sequence_block_size')
         }),
         ('Status and Audit', {
             'fields': ('is_active', 'created_by', 'created_at', 'updated_by', 'updated_at')
@@ -338,7 +459,8 @@ class DepartmentAdmin(admin.ModelAdmin):
 from .models import ClassDetail
 
 @admin.register(ClassDetail)
-class ClassDetailAdmin(admin.ModelAdmin):
+class ClassDetailAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = 'departments__company'
     list_display = ['class_code', 'name', 'accounting_enabled', 'is_active']
     list_filter = ['accounting_enabled', 'is_active']
     search_fields = ['class_code', 'name', 'management_account_id']
@@ -369,7 +491,8 @@ class ClassDetailAdmin(admin.ModelAdmin):
 from .models import ClarificationDetail
 
 @admin.register(ClarificationDetail)
-class ClarificationDetailAdmin(admin.ModelAdmin):
+class ClarificationDetailAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = 'departments__company'
     list_display = ['code', 'name', 'is_income', 'is_expense', 'is_active', 'requires_approval']
     list_filter = ['is_income', 'is_expense', 'is_adjustment', 'requires_approval', 'is_active']
     search_fields = ['code', 'name', 'description']
@@ -401,13 +524,14 @@ class ClarificationDetailAdmin(admin.ModelAdmin):
 from .models import  UserCompany, UserLocation
 
 @admin.register(UserCompany)
-class UserCompanyAdmin(admin.ModelAdmin):
+class UserCompanyAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['user', 'company']
     search_fields = ['user__username', 'company__name']
     list_filter = ['company']
 
 @admin.register(UserLocation)
-class UserLocationAdmin(admin.ModelAdmin):
+class UserLocationAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_location_field = 'location'
     list_display = ['user', 'company','location']
     search_fields = ['user__username', 'location__name']
     list_filter = ['company','location']
@@ -415,7 +539,7 @@ class UserLocationAdmin(admin.ModelAdmin):
 from .models import LaboratoryDepartment
 
 @admin.register(LaboratoryDepartment)
-class LaboratoryDepartmentAdmin(admin.ModelAdmin):
+class LaboratoryDepartmentAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['Code','name', 'company', 'is_main_department', 'is_active']
     list_filter = ['is_main_department',  'is_active', 'company']
     search_fields = ['name', 'responsible_person', ]
@@ -438,7 +562,7 @@ class LaboratoryDepartmentAdmin(admin.ModelAdmin):
 from .models import TaxCode
 
 @admin.register(TaxCode)
-class TaxCodeAdmin(admin.ModelAdmin):
+class TaxCodeAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['code','rate','name', 'sequence','company',  'is_active',]
     list_filter = ['name',  'is_active', 'company']
     search_fields = ['name', 'rate', ]
@@ -462,7 +586,7 @@ class TaxCodeAdmin(admin.ModelAdmin):
 from .models import Service
 
 @admin.register(Service)
-class ServiceAdmin(admin.ModelAdmin):
+class ServiceAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['service_code','service_name','rate', 'cost_price','minimum_price','departments','company',  'is_active',]
     list_filter = ['service_code','service_name',  'is_active','departments', 'company']
     search_fields = ['service_name','service_code', 'departments', ]
@@ -498,7 +622,7 @@ class ServiceAdmin(admin.ModelAdmin):
 from .models import ServiceTax
 
 @admin.register(ServiceTax)
-class ServiceTaxAdmin(admin.ModelAdmin):
+class ServiceTaxAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['service_code', 'company', 'is_active', 'include_tax']
     list_filter = ['company', 'is_active', 'include_tax']
     search_fields = ['service_code__name', 'company__name']  # Adjust based on field names
@@ -528,7 +652,8 @@ from .models import ServiceLocationPrice
 
 
 @admin.register(ServiceLocationPrice)
-class ServiceLocationPriceAdmin(admin.ModelAdmin):
+class ServiceLocationPriceAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_location_field = 'locations'
     # Display fields in the list view
     list_display = ['locations','service_code', 'rate', 'cost_price', 'minimum_price', 'company', 'is_active']
     list_filter = ['service_code', 'is_active', 'company']
@@ -578,7 +703,7 @@ class ServiceLocationPriceAdmin(admin.ModelAdmin):
 from .models import ConsultationSupplierType
 
 @admin.register(ConsultationSupplierType)
-class ConsultationSupplierTypeAdmin(admin.ModelAdmin):
+class ConsultationSupplierTypeAdmin(ScopedAdminMixin, admin.ModelAdmin):
     list_display = ['Code','Description','company', 'is_active',]
     list_filter = ['Code',  'Description', 'company']
     search_fields = ['Code', 'Description', ]
@@ -604,7 +729,8 @@ from .models import SupplierRegistration
 
 
 @admin.register(SupplierRegistration)
-class SupplierRegistrationAdmin(admin.ModelAdmin):
+class SupplierRegistrationAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_location_field = 'locations'
     list_display = [
         'sup_user_code', 'sup_name', 'company', 'sup_type_sys_code', 'is_active',
     ]
@@ -672,7 +798,8 @@ from .models import SupplierDepartmentDetails
 
 
 @admin.register(SupplierDepartmentDetails)
-class SupplierDepartmentDetailsAdmin(admin.ModelAdmin):
+class SupplierDepartmentDetailsAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_location_field = 'locations'
     # Fields to display in the admin list view
     list_display = (
         'company', 
@@ -768,7 +895,8 @@ from django.contrib import admin
 from .models import SupplierReferralFeeDetails
 
 @admin.register(SupplierReferralFeeDetails)
-class SupplierReferralFeeDetailsAdmin(admin.ModelAdmin):
+class SupplierReferralFeeDetailsAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_location_field = 'locations'
     list_display = ['supplier', 'departments', 'services_code', 'ReferralFee', 'ReferralFeePre', 'is_active']
     list_filter = ['supplier', 'departments', 'is_active']
     search_fields = ['supplier__name', 'departments__name', 'services_code__name']
@@ -779,3 +907,64 @@ class SupplierReferralFeeDetailsAdmin(admin.ModelAdmin):
             obj.created_by = request.user
         obj.updated_by = request.user
         super().save_model(request, obj, form, change)
+
+
+from django.utils import timezone
+from .models import SMSMessage
+
+
+@admin.register(SMSMessage)
+class SMSMessageAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    scope_company_field = 'supplier__company'
+    scope_location_field = 'supplier__locations'
+    list_display = ['phone', 'recipient_name', 'gateway', 'status', 'attempts', 'created_at', 'sent_at', 'delivered_at']
+    list_filter = ['status', 'gateway', 'created_at']
+    search_fields = ['phone', 'recipient_name', 'provider_message_id', 'supplier__sup_name']
+    readonly_fields = [
+        'supplier', 'recipient_name', 'phone', 'body', 'gateway', 'status', 'attempts',
+        'next_attempt_at', 'provider_message_id', 'last_error', 'sent_at', 'delivered_at',
+        'created_by', 'created_at',
+    ]
+    actions = ['retry_messages']
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('supplier', 'created_by')
+
+    @admin.action(description=_('Retry selected failed messages'))
+    def retry_messages(self, request, queryset):
+        count = queryset.filter(status=SMSMessage.Status.FAILED).update(
+            status=SMSMessage.Status.PENDING,
+            attempts=0,
+            next_attempt_at=timezone.now(),
+        )
+        self.message_user(request, _('%d message(s) queued for retry.') % count)
+
+
+from .models import AuditEntry
+
+
+@admin.register(AuditEntry)
+class AuditEntryAdmin(ScopedAdminMixin, admin.ModelAdmin):
+    list_display = ['object_repr', 'content_type', 'action', 'user', 'timestamp']
+    list_filter = ['action', 'content_type', 'timestamp']
+    search_fields = ['object_repr', 'user__username']
+    readonly_fields = ['content_type', 'object_id', 'object_repr', 'action', 'changes', 'user', 'timestamp']
+    date_hierarchy = 'timestamp'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def scope_queryset(self, queryset, request):
+        # Entries point at arbitrary models; only superusers see other users' changes
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(user=request.user)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('content_type', 'user')
@@ -0,0 +1,224 @@
+# audit.py
+"""
+Buffered audit log writing.
+
+``record()`` collects unsaved audit rows (``LocationAuditLog`` and friends)
+for the current transaction and writes them with one ``bulk_create`` per
+model when the transaction commits. Rows recorded inside a savepoint that
+is rolled back are dropped with it. Outside a transaction rows are
+written immediately.
+
+With ``settings.AUDIT_ASYNC = True`` committed rows are handed to a
+background thread that writes them in larger batches. The thread is
+drained on clean interpreter shutdown, so queued rows are not lost.
+
+``collector()`` lets callers coalesce many small changes (e.g. M2M
+``add``/``remove`` signals) into a few rows that are built at commit.
+
+Rows are credited to the acting user: ``request.user`` for the duration
+of a request (``AuditUserMiddleware``), or whoever ``acting_as()`` names
+in commands and scripts.
+"""
+import atexit
+import contextvars
+import logging
+import queue
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+BULK_BATCH_SIZE = 500
+
+_local = threading.local()
+_acting_user = contextvars.ContextVar('audit_acting_user', default=None)
+
+
+@contextmanager
+def acting_as(user):
+    """Credit audit rows recorded inside the block to ``user`` (instance or id)"""
+    token = _acting_user.set(user)
+    try:
+        yield
+    finally:
+        _acting_user.reset(token)
+
+
+def acting_user_id():
+    """Id of the acting user, or ``None`` outside a request and ``acting_as()``"""
+    user = _acting_user.get()
+    if user is None or isinstance(user, int):
+        return user
+    return user.pk if user.is_authenticated else None
+
+
+def request_meta(request):
+    """Client details stored with every audit row"""
+    return {
+        'ip_address': request.META.get('REMOTE_ADDR'),
+        'user_agent': request.META.get('HTTP_USER_AGENT', '')[:255],
+    }
+
+
+def write_entries(entries, using=DEFAULT_DB_ALIAS):
+    """Insert ``entries`` with one bulk_create per model"""
+    by_model = defaultdict(list)
+    for entry in entries:
+        by_model[type(entry)].append(entry)
+    for model, rows in by_model.items():
+        model.objects.using(using).bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+
+
+class _Buffer:
+    """Rows recorded at one savepoint level of one transaction"""
+
+    def __init__(self, using):
+        self.using = using
+        self.entries = []
+        self.collectors = {}
+        self.flushed = False
+
+    def flush(self):
+        self.flushed = True
+        entries, self.entries = self.entries, []
+        collectors, self.collectors = self.collectors, {}
+        for pending in collectors.values():
+            entries.extend(pending.entries())
+        if entries:
+            _dispatch(entries, self.using)
+
+
+def _buffers():
+    if not hasattr(_local, 'buffers'):
+        _local.buffers = {}
+    return _local.buffers
+
+
+def _pending(connection, buffer):
+    return not buffer.flushed and any(func == buffer.flush for _, func, *_ in connection.run_on_commit)
+
+
+def _current_buffer(connection, using):
+    # atomic(savepoint=False) blocks push None; they share the enclosing level
+    key = (using, tuple(sid for sid in connection.savepoint_ids if sid))
+    buffers = _buffers()
+    buffer = buffers.get(key)
+    if buffer is None or not _pending(connection, buffer):
+        if len(buffers) > 64:
+            # Forget buffers of finished or rolled back transactions
+            for stale_key in [k for k, b in buffers.items() if not _pending(connection, b)]:
+                del buffers[stale_key]
+        buffer = buffers[key] = _Buffer(using)
+        transaction.on_commit(buffer.flush, using=using)
+    return buffer
+
+
+def record(*entries, using=DEFAULT_DB_ALIAS):
+    """Queue unsaved audit model instances for writing on commit"""
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        _dispatch(list(entries), using)
+        return
+    _current_buffer(connection, using).entries.extend(entries)
+
+
+def collector(name, factory, using=DEFAULT_DB_ALIAS):
+    """
+    Per-transaction object that coalesces changes before they become audit
+    rows. ``factory()`` builds it on first use; its ``entries()`` method is
+    called once on commit. Returns ``None`` outside a transaction.
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        return None
+    buffer = _current_buffer(connection, using)
+    if name not in buffer.collectors:
+        buffer.collectors[name] = factory()
+    return buffer.collectors[name]
+
+
+class AsyncAuditWriter:
+    """Background thread that drains committed audit rows in batches"""
+
+    def __init__(self, batch_size=BULK_BATCH_SIZE, flush_interval=1.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='audit-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, entries, using):
+        for entry in entries:
+            self.queue.put((using, entry))
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = self._drain(item)
+            if None in batch:
+                stopping = True
+                batch = [item for item in batch if item is not None]
+            by_alias = defaultdict(list)
+            for using, entry in batch:
+                by_alias[using].append(entry)
+            close_old_connections()
+            for using, entries in by_alias.items():
+                try:
+                    write_entries(entries, using)
+                except Exception:
+                    logger.exception('Failed to write %d audit row(s)', len(entries))
+        close_old_connections()
+
+    def stop(self, timeout=30):
+        """Write everything queued so far and stop the thread"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+
+_async_writer = None
+_async_lock = threading.Lock()
+
+
+def _get_async_writer():
+    global _async_writer
+    with _async_lock:
+        if _async_writer is None:
+            _async_writer = AsyncAuditWriter(
+                batch_size=getattr(settings, 'AUDIT_ASYNC_BATCH_SIZE', BULK_BATCH_SIZE),
+                flush_interval=getattr(settings, 'AUDIT_ASYNC_FLUSH_INTERVAL', 1.0),
+            )
+        return _async_writer
+
+
+def _dispatch(entries, using):
+    if getattr(settings, 'AUDIT_ASYNC', False):
+        _get_async_writer().put(entries, using)
+    else:
+        write_entries(entries, using)
+
+
+@atexit.register
+def shutdown():
+    """Flush the asynchronous writer, if one was started"""
+    global _async_writer
+    with _async_lock:
+        writer, _async_writer = _async_writer, None
+    if writer is not None:
+        writer.stop()
@@ -0,0 +1,256 @@
+# audit_archive.py
+"""
+Cold storage for old audit rows.
+
+``archive()`` moves rows older than a cutoff out of the hot audit tables
+into one compressed NDJSON file per month::
+
+    AUDIT_ARCHIVE_DIR/<source>/2025-01.ndjson.gz
+    AUDIT_ARCHIVE_DIR/<source>/index.json
+
+``index.json`` records, per month, the file name, row count, first/last
+timestamp and the size of the file up to its last complete chunk.
+``iter_archive()`` streams rows back for a time range and only opens the
+months that overlap it. Timestamps are stored with full microseconds.
+
+Each chunk is archived exactly once, even across a crash. The file is
+appended and synced, then the index is replaced atomically with the new
+size and the chunk's ids as ``pending_ids``, then the rows are deleted. A
+later run cuts any file tail beyond the indexed size (a crash before the
+index was written; the rows are still live and are archived again) and
+deletes still-live ``pending_ids`` (a crash before the delete committed).
+
+Files are gzip by default; ``zstd`` is used when requested and the
+``zstandard`` package is installed. Both formats allow appending a new
+compressed member to an existing month file.
+"""
+import gzip
+import io
+import json
+import os
+from datetime import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AuditEntry, LocationAuditLog
+from .pagination import CursorEncoder
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+SOURCES = {
+    'location_audit_log': LocationAuditLog,
+    'audit_entry': AuditEntry,
+}
+
+EXTENSIONS = {
+    'gzip': '.ndjson.gz',
+    'zstd': '.ndjson.zst',
+}
+
+CHUNK_SIZE = 5000
+
+
+def archive_root():
+    return os.fspath(getattr(settings, 'AUDIT_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'audit_archive')))
+
+
+def source_dir(source):
+    return os.path.join(archive_root(), source)
+
+
+def load_index(source):
+    path = os.path.join(source_dir(source), 'index.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def save_index(source, index):
+    path = os.path.join(source_dir(source), 'index.json')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(index, fh, indent=1, sort_keys=True)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def _compress(data, compression):
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return gzip.compress(data)
+
+
+class _BoundedReader(io.RawIOBase):
+    """The first ``limit`` bytes of ``fh``"""
+
+    def __init__(self, fh, limit):
+        self.fh = fh
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.remaining <= 0:
+            return 0
+        count = self.fh.readinto(memoryview(buffer)[:self.remaining])
+        self.remaining -= count
+        return count
+
+    def close(self):
+        self.fh.close()
+        super().close()
+
+
+def _open_lines(path, compression, size=None):
+    fh = open(path, 'rb')
+    if size is not None:
+        # Ignore a tail left by a crashed run
+        fh = io.BufferedReader(_BoundedReader(fh, size))
+    if compression == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return io.TextIOWrapper(gzip.GzipFile(fileobj=fh, mode='rb'), encoding='utf-8')
+
+
+def _truncate_to_index(path, entry):
+    """Cut bytes appended after the last index write"""
+    size = entry.get('bytes')
+    if size is not None and os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as fh:
+            fh.truncate(size)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+def _recover(source, model, index):
+    """Delete rows a crashed run archived but did not get to delete"""
+    pending = [pk for entry in index.values() for pk in entry.get('pending_ids', ())]
+    if not pending:
+        return
+    with transaction.atomic():
+        for start in range(0, len(pending), CHUNK_SIZE):
+            model.objects.filter(pk__in=pending[start:start + CHUNK_SIZE]).delete()
+    _clear_pending(source, index)
+
+
+def _clear_pending(source, index):
+    for entry in index.values():
+        entry.pop('pending_ids', None)
+    save_index(source, index)
+
+
+def _check_compression(compression):
+    if compression not in EXTENSIONS:
+        raise ValueError(f'Unknown compression {compression!r}')
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError('zstd compression requires the zstandard package')
+
+
+def _fields(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+def archive(source, before, compression='gzip', chunk_size=CHUNK_SIZE):
+    """
+    Move rows of ``source`` with ``timestamp < before`` into monthly
+    archive files. Returns the number of rows archived.
+
+    Each chunk is deleted inside a transaction that only commits after the
+    chunk has been written and synced to disk.
+    """
+    _check_compression(compression)
+    model = SOURCES[source]
+    fields = _fields(model)
+    os.makedirs(source_dir(source), exist_ok=True)
+    index = load_index(source)
+    _recover(source, model, index)
+    archived = 0
+
+    while True:
+        with transaction.atomic():
+            rows = list(
+                model.objects
+                .filter(timestamp__lt=before)
+                .order_by('timestamp', 'pk')
+                .values(*fields)[:chunk_size]
+            )
+            if not rows:
+                break
+
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(timezone.localtime(row['timestamp']).strftime('%Y-%m'), []).append(row)
+
+            for month, month_rows in by_month.items():
+                entry = index.get(month)
+                if entry is None:
+                    entry = index[month] = {
+                        'file': f'{month}{EXTENSIONS[compression]}',
+                        'compression': compression,
+                        'rows': 0,
+                        'first': month_rows[0]['timestamp'].isoformat(),
+                        'last': month_rows[-1]['timestamp'].isoformat(),
+                    }
+                payload = ''.join(
+                    json.dumps(row, cls=CursorEncoder, separators=(',', ':')) + '\n'
+                    for row in month_rows
+                ).encode('utf-8')
+                path = os.path.join(source_dir(source), entry['file'])
+                _truncate_to_index(path, entry)
+                with open(path, 'ab') as fh:
+                    fh.write(_compress(payload, entry['compression']))
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    entry['bytes'] = fh.tell()
+                entry['pending_ids'] = [row['id'] for row in month_rows]
+                entry['rows'] += len(month_rows)
+                entry['first'] = min(entry['first'], month_rows[0]['timestamp'].isoformat())
+                entry['last'] = max(entry['last'], month_rows[-1]['timestamp'].isoformat())
+
+            save_index(source, index)
+            model.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        _clear_pending(source, index)
+        archived += len(rows)
+    return archived
+
+
+def _month_key(value):
+    return timezone.localtime(value).strftime('%Y-%m') if value else None
+
+
+def iter_archive(source, start=None, end=None, **filters):
+    """
+    Stream archived rows of ``source`` with ``start <= timestamp < end``.
+
+    ``filters`` are exact matches on stored columns, e.g.
+    ``iter_archive('location_audit_log', start, end, location_id=5)``.
+    Rows are yielded as dicts with ``timestamp`` parsed back to datetime.
+    """
+    index = load_index(source)
+    first_month, last_month = _month_key(start), _month_key(end)
+    for month in sorted(index):
+        if first_month and month < first_month:
+            continue
+        if last_month and month > last_month:
+            break
+        entry = index[month]
+        path = os.path.join(source_dir(source), entry['file'])
+        with _open_lines(path, entry.get('compression', 'gzip'), entry.get('bytes')) as lines:
+            for line in lines:
+                row = json.loads(line)
+                if any(row.get(key) != value for key, value in filters.items()):
+                    continue
+                row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+                if start and row['timestamp'] < start:
+                    continue
+                if end and row['timestamp'] >= end:
+                    continue
+                yield row
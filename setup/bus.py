@@ -0,0 +1,116 @@
+# bus.py
+"""
+Cache invalidation bus.
+
+Signal handlers ``publish()`` what changed as a topic plus keys (ids).
+Inside a transaction events are collected and delivered once, when it
+commits; events of a rolled back transaction are dropped. Delivery bumps
+one generation counter per topic in the shared cache and then calls every
+handler ``subscribe()``d to those topics, once, with the union of the keys.
+
+Per-process caches (the geo and hours indexes, the location context) key
+on ``generation(*topics)`` and rebuild when it moves, so a change committed
+by one worker is seen by every other worker at its next cache check. That
+needs a cache shared by the workers; the ``setup.E001`` system check
+refuses a local-memory one.
+Caches that already live in the shared cache subscribe a handler instead.
+
+Queryset ``update()`` and bulk operations bypass model signals; callers
+publish for them.
+"""
+import logging
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import caching
+
+logger = logging.getLogger(__name__)
+
+# A company row; keys are company ids
+COMPANY = 'company'
+# Anything listed in a company's catalog (locations, departments,
+# laboratory departments, tax codes, services and their links); keys are company ids
+CATALOG = 'catalog'
+# A location row; keys are location ids
+LOCATION = 'location'
+# A location was created, deleted or changed status
+LOCATION_STATUS = 'location-status'
+# A location's coordinates or company changed
+LOCATION_POSITION = 'location-position'
+# A location's operating hours changed
+LOCATION_HOURS = 'location-hours'
+# A user's company or location grants; keys are user ids
+USER_SCOPE = 'user-scope'
+
+_subscribers = {}
+_local = threading.local()
+
+
+def generation_name(topic):
+    return f'bus:{topic}'
+
+
+def generation(*topics):
+    """Current generation of ``topics`` as a tuple, with one cache round trip"""
+    return tuple(caching.get_versions(*map(generation_name, topics)))
+
+
+def subscribe(*topics):
+    """Register ``handler(keys)`` for ``topics``; usable as a decorator"""
+    def register(handler):
+        for topic in topics:
+            handlers = _subscribers.setdefault(topic, [])
+            if handler not in handlers:
+                handlers.append(handler)
+        return handler
+    return register
+
+
+def deliver(events):
+    """Bump the generation of every topic in ``events`` ({topic: keys}) and run its handlers"""
+    calls = {}
+    for topic, keys in events.items():
+        caching.bump_version(generation_name(topic))
+        for handler in _subscribers.get(topic, ()):
+            calls.setdefault(handler, set()).update(keys)
+    for handler, keys in calls.items():
+        try:
+            handler(keys)
+        except Exception:
+            logger.exception('Invalidation handler %r failed', handler)
+
+
+class _Pending:
+    """Events published in one transaction"""
+
+    def __init__(self):
+        self.events = {}
+        self.flushed = False
+
+    def flush(self):
+        events, self.events = self.events, {}
+        self.flushed = True
+        deliver(events)
+
+
+def _pending(connection, using):
+    if not hasattr(_local, 'pending'):
+        _local.pending = {}
+    pending = _local.pending.get(using)
+    # Done once it ran; gone from run_on_commit once its savepoint was rolled back
+    if pending is None or pending.flushed or not any(
+        func == pending.flush for _, func, *_ in connection.run_on_commit
+    ):
+        pending = _local.pending[using] = _Pending()
+        transaction.on_commit(pending.flush, using=using)
+    return pending
+
+
+def publish(topic, *keys, using=DEFAULT_DB_ALIAS):
+    """Announce a change to ``topic``; delivered on commit, or now outside a transaction"""
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        deliver({topic: set(keys)})
+        return
+    _pending(connection, using).events.setdefault(topic, set()).update(keys)
@@ -0,0 +1,68 @@
+# caching.py
+"""
+Version counters for cache invalidation.
+
+Cached values embed the current version of whatever they were built from
+in their key. Bumping the version makes every old key unreachable at once,
+so nothing has to be found and deleted. Counters live in the default cache
+and never expire. The cache must be shared by all worker processes (Redis,
+Memcached, database); the ``setup.E001`` system check refuses a
+local-memory cache.
+
+A version is a random token, not a number. A bump is a plain ``set`` of a
+new token, which is atomic on every backend (``DatabaseCache.incr()`` is a
+read followed by a write), so concurrent bumps never collapse into one
+value. A version lost to culling or eviction comes back as a new token, so
+entries keyed on an old one can never look fresh again.
+"""
+from uuid import uuid4
+
+from django.core.cache import cache
+
+
+def _key(name):
+    return f'version:{name}'
+
+
+def _new_version():
+    return uuid4().hex
+
+
+def get_version(name):
+    version = cache.get(_key(name))
+    if version is None:
+        # Missing (never set, or culled/evicted): start from a fresh token,
+        # never from a value that entries may already be keyed on
+        cache.add(_key(name), _new_version(), timeout=None)
+        version = cache.get(_key(name))
+        if version is None:
+            version = _new_version()
+    return version
+
+
+def peek_version(name):
+    """Current version, or ``None`` if there is none; never creates one"""
+    return cache.get(_key(name))
+
+
+def get_versions(*names):
+    """Current versions of several counters with one cache round trip"""
+    keys = [_key(name) for name in names]
+    found = cache.get_many(keys)
+    versions = []
+    for name, key in zip(names, keys):
+        versions.append(found[key] if key in found else get_version(name))
+    return versions
+
+
+def bump_version(name):
+    # A plain set of a new token: atomic on every backend, unlike incr()
+    # on DatabaseCache, so concurrent bumps can never land on the same value
+    version = _new_version()
+    cache.set(_key(name), version, timeout=None)
+    return version
+
+
+def versioned_key(prefix, name, *parts):
+    """``prefix:<parts>:v<version of name>``"""
+    return ':'.join([prefix, *map(str, parts), f'v{get_version(name)}'])
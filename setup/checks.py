@@ -0,0 +1,40 @@
+# checks.py
+"""System checks for settings the caching layer and the SMS queue depend on."""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose values are private to one process
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        f'The default cache ({backend}) is not shared between worker processes.',
+        hint=(
+            'Cache versions and the invalidation bus (setup.bus) need a shared cache: '
+            'set REDIS_URL, or use DatabaseCache (its table is created by migrate).'
+        ),
+        id='setup.E001',
+    )]
+
+
+@register()
+def check_sms_gateways(app_configs, **kwargs):
+    gateways = getattr(settings, 'SMS_GATEWAYS', {})
+    if 'default' not in gateways:
+        return [Error(
+            "SMS_GATEWAYS has no 'default' gateway.",
+            hint="Queued messages are sent through it; configure e.g. setup.sms.FileGateway.",
+            id='setup.E002',
+        )]
+    return [
+        Error(f"SMS gateway '{name}' has no BACKEND.", obj='SMS_GATEWAYS', id='setup.E003')
+        for name, config in gateways.items() if not config.get('BACKEND')
+    ]
@@ -0,0 +1,61 @@
+# conditional.py
+"""
+Conditional GET for read views.
+
+``conditional(state_func)`` wraps a view with Django's ``condition``
+decorator. ``state_func(request, *args, **kwargs)`` returns
+``(last_modified, *etag_parts)`` for what the page would show, or ``None``
+to always render. The state is computed once per request. The ETag also
+covers the user, because pages carry per-user chrome. A matching
+``If-None-Match``/``If-Modified-Since`` gets a 304 before the view runs.
+
+Requests with queued ``django.contrib.messages`` always render, so a flash
+message is never swallowed by a cached page.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+
+
+def queryset_state(queryset, field='updated_at'):
+    """``(latest field value, row count)`` in one aggregate query"""
+    state = queryset.order_by().aggregate(latest=Max(field), count=Count('pk'))
+    return state['latest'], state['count']
+
+
+def _has_pending_messages(request):
+    # len() does not mark the messages as read
+    return hasattr(request, '_messages') and len(messages.get_messages(request)) > 0
+
+
+def conditional(state_func, last_modified=True):
+    """
+    ``last_modified=False`` sends only an ETag, for pages where rows can
+    disappear without moving the latest timestamp (lists).
+    """
+    def decorator(view):
+        def get_state(request, *args, **kwargs):
+            if not hasattr(request, '_conditional_state'):
+                state = None
+                if request.method in ('GET', 'HEAD') and not _has_pending_messages(request):
+                    state = state_func(request, *args, **kwargs)
+                request._conditional_state = state
+            return request._conditional_state
+
+        def etag_func(request, *args, **kwargs):
+            state = get_state(request, *args, **kwargs)
+            return None if state is None else make_etag(request.user.pk, *state)
+
+        def last_modified_func(request, *args, **kwargs):
+            state = get_state(request, *args, **kwargs)
+            return state[0] if state is not None and last_modified else None
+
+        return wraps(view)(condition(etag_func=etag_func, last_modified_func=last_modified_func)(view))
+    return decorator
@@ -1,13 +1,33 @@
 # forms.py
 from django import forms
+from django.core.exceptions import ValidationError
+from PIL import Image
 from .models import Company
 from .models import Department
 from .models import LaboratoryDepartment
+from .uploads import LogoUpload
+
+
+class LogoImageField(forms.ImageField):
+    """ImageField that relies on the header checks made by uploads.LogoUploadHandler"""
+
+    def to_python(self, data):
+        if not isinstance(data, LogoUpload):
+            return super().to_python(data)
+        if data.upload_error:
+            raise ValidationError(data.upload_error, code='invalid_image')
+        # Format and dimensions are already known; skip Pillow's full verify pass
+        f = forms.FileField.to_python(self, data)
+        if f is not None:
+            f.content_type = Image.MIME.get(data.image_format)
+        return f
+
 
 class CompanyForm(forms.ModelForm):
     class Meta:
         model = Company
         exclude = ['created_by', 'updated_by']  # These will be set automatically
+        field_classes = {'logo': LogoImageField}
 
  
 
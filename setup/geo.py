@@ -0,0 +1,213 @@
+# geo.py
+"""
+Nearest-location search over active company locations.
+
+Locations with coordinates are kept in an in-process k-d tree of 3D unit
+vectors on the sphere. Straight-line (chord) distance between unit vectors
+grows monotonically with great-circle distance, so nearest-neighbour and
+radius searches on the tree are exact, also across the poles and the
+antimeridian. Distances are reported as great-circle kilometres.
+
+The tree is built on first use and rebuilt when the generation of the
+location status or position topics on the invalidation bus (``bus.py``)
+changes, and a rebuild is a single query.
+"""
+import heapq
+import math
+import threading
+
+from . import bus
+from .models import CompanyLocation, Service
+
+EARTH_RADIUS_KM = 6371.0088
+TOPICS = (bus.LOCATION_STATUS, bus.LOCATION_POSITION)
+# Below this many candidate locations a plain scan beats walking the tree
+SCAN_THRESHOLD = 64
+
+
+def to_vector(latitude, longitude):
+    lat, lon = math.radians(float(latitude)), math.radians(float(longitude))
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def _chord2(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+
+class _Node:
+    __slots__ = ('vector', 'location_id', 'company_id', 'axis', 'left', 'right')
+
+    def __init__(self, vector, location_id, company_id, axis, left, right):
+        self.vector = vector
+        self.location_id = location_id
+        self.company_id = company_id
+        self.axis = axis
+        self.left = left
+        self.right = right
+
+
+class LocationIndex:
+    """An immutable k-d tree; ``points`` maps location id -> (vector, company id)"""
+
+    def __init__(self, rows):
+        self.points = {
+            location_id: (to_vector(latitude, longitude), company_id)
+            for location_id, company_id, latitude, longitude in rows
+        }
+        self.root = self._build([(vector, pk, company) for pk, (vector, company) in self.points.items()], 0)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, items, depth):
+        if not items:
+            return None
+        axis = depth % 3
+        items.sort(key=lambda item: item[0][axis])
+        middle = len(items) // 2
+        vector, location_id, company_id = items[middle]
+        return _Node(
+            vector, location_id, company_id, axis,
+            self._build(items[:middle], depth + 1),
+            self._build(items[middle + 1:], depth + 1),
+        )
+
+    def nearest(self, target, k, accept=None, max_chord=None):
+        """``[(chord, location_id)]`` of the ``k`` closest accepted points"""
+        heap = []  # (-chord², location_id), worst on top
+        limit = max_chord * max_chord if max_chord is not None else math.inf
+
+        def visit(node):
+            if node is None:
+                return
+            distance = _chord2(target, node.vector)
+            if distance <= limit and (accept is None or accept(node.location_id, node.company_id)):
+                if len(heap) < k:
+                    heapq.heappush(heap, (-distance, node.location_id))
+                elif distance < -heap[0][0]:
+                    heapq.heapreplace(heap, (-distance, node.location_id))
+            delta = target[node.axis] - node.vector[node.axis]
+            near, far = (node.left, node.right) if delta < 0 else (node.right, node.left)
+            visit(near)
+            worst = -heap[0][0] if len(heap) == k else limit
+            if delta * delta <= worst:
+                visit(far)
+
+        visit(self.root)
+        return sorted((math.sqrt(-distance), pk) for distance, pk in heap)
+
+    def within(self, target, max_chord, accept=None):
+        """``[(chord, location_id)]`` of accepted points within ``max_chord``, closest first"""
+        limit = max_chord * max_chord
+        found = []
+
+        def visit(node):
+            if node is None:
+                return
+            distance = _chord2(target, node.vector)
+            if distance <= limit and (accept is None or accept(node.location_id, node.company_id)):
+                found.append((math.sqrt(distance), node.location_id))
+            delta = target[node.axis] - node.vector[node.axis]
+            if delta < 0 or delta * delta <= limit:
+                visit(node.left)
+            if delta >= 0 or delta * delta <= limit:
+                visit(node.right)
+
+        visit(self.root)
+        return sorted(found)
+
+    def scan(self, target, location_ids, accept=None):
+        """``[(chord, location_id)]`` for a small candidate set, closest first"""
+        found = []
+        for pk in location_ids:
+            point = self.points.get(pk)
+            if point is not None and (accept is None or accept(pk, point[1])):
+                found.append((math.sqrt(_chord2(target, point[0])), pk))
+        return sorted(found)
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def build_index():
+    rows = (
+        CompanyLocation.objects
+        .filter(status=CompanyLocation.LocationStatus.ACTIVE, latitude__isnull=False, longitude__isnull=False)
+        .values_list('pk', 'company_id', 'latitude', 'longitude')
+    )
+    return LocationIndex(rows)
+
+
+def get_index():
+    global _index, _index_version
+    version = bus.generation(*TOPICS)
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index, _index_version = build_index(), version
+    return _index
+
+
+def invalidate():
+    bus.publish(bus.LOCATION_POSITION)
+
+
+def service_location_ids(service_id):
+    through = Service.locations.through
+    return set(through.objects.filter(service_id=service_id).values_list('companylocation_id', flat=True))
+
+
+def _accept(company_id, scope):
+    def accept(location_id, location_company_id):
+        if company_id is not None and location_company_id != company_id:
+            return False
+        if scope is not None and not scope.unrestricted:
+            return location_id in scope.location_ids or location_company_id in scope.full_company_ids
+        return True
+    return accept
+
+
+def _offering(allowed, accept):
+    def offering(location_id, location_company_id):
+        return location_id in allowed and accept(location_id, location_company_id)
+    return offering
+
+
+def search(latitude, longitude, k=5, radius_km=None, service_id=None, company_id=None, scope=None):
+    """
+    Active locations nearest to a point as ``[(location_id, km)]``.
+
+    ``k=None`` returns everything within ``radius_km``. ``service_id`` keeps
+    locations that offer the service (``Service.locations``), ``company_id``
+    one company's locations and ``scope`` (a ``UserScope``) what the user
+    may see.
+    """
+    index = get_index()
+    target = to_vector(latitude, longitude)
+    max_chord = km_to_chord(radius_km) if radius_km is not None else None
+    accept = _accept(company_id, scope)
+    if service_id is not None:
+        allowed = service_location_ids(service_id)
+        if len(allowed) <= SCAN_THRESHOLD:
+            found = [hit for hit in index.scan(target, allowed, accept) if max_chord is None or hit[0] <= max_chord]
+            found = found[:k] if k is not None else found
+            return [(pk, chord_to_km(chord)) for chord, pk in found]
+        accept = _offering(allowed, accept)
+    if k is None:
+        if max_chord is None:
+            raise ValueError('Either k or radius_km is required')
+        found = index.within(target, max_chord, accept)
+    else:
+        found = index.nearest(target, k, accept, max_chord)
+    return [(pk, chord_to_km(chord)) for chord, pk in found]
@@ -0,0 +1,149 @@
+# hierarchy.py
+"""
+One JSON document with everything a terminal needs about a company.
+
+The document has the company plus flat lists of its locations,
+departments, laboratory departments, tax codes and services. Relations are
+ids: many-to-many links are lists of ids on the owning row
+(``departments[].locations``, ``services[].tax_codes`` ...). It is built
+with a fixed number of ``values()`` queries (one per table and one per
+many-to-many table), however large the company is.
+
+The serialized bytes are cached per company under a version counter.
+The counter is bumped by a subscriber of the company and catalog topics of
+the invalidation bus (``bus.py``), which ``signals.py`` publishes to when
+any row in the tree changes. Queryset ``update()`` bypasses signals and has
+to call ``invalidate_company()`` itself.
+"""
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import bus, caching
+from .models import Company, CompanyLocation, Department, LaboratoryDepartment, Service, TaxCode
+
+EXCLUDED_FIELDS = {'created_by_id', 'updated_by_id', 'logo_derivatives'}
+CHUNK_ROWS = 200
+
+# (document key, model, {document key: m2m field name})
+SECTIONS = [
+    ('locations', CompanyLocation, {}),
+    ('departments', Department, {'locations': 'locations'}),
+    ('laboratory_departments', LaboratoryDepartment, {'locations': 'locations'}),
+    ('tax_codes', TaxCode, {'locations': 'locations'}),
+    ('services', Service, {'locations': 'locations', 'tax_codes': 'tax_code'}),
+]
+
+
+def version_name(company_id):
+    return f'company-hierarchy:{company_id}'
+
+
+def cache_timeout():
+    return getattr(settings, 'HIERARCHY_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def current_version(company_id):
+    """
+    Version of the company's document, or ``None`` if the company does not
+    exist. A counter is only created for a company that exists, so unknown
+    ids cannot fill the cache with counters.
+    """
+    version = caching.peek_version(version_name(company_id))
+    if version is None:
+        if not Company.objects.filter(pk=company_id).exists():
+            return None
+        version = caching.get_version(version_name(company_id))
+    return version
+
+
+def invalidate_company(company_id):
+    """Drop the company's document once the current transaction commits"""
+    bus.publish(bus.CATALOG, company_id)
+
+
+@bus.subscribe(bus.COMPANY, bus.CATALOG)
+def _bump_versions(company_ids):
+    for company_id in company_ids:
+        caching.bump_version(version_name(company_id))
+
+
+def _fields(model):
+    return [f.attname for f in model._meta.concrete_fields if f.attname not in EXCLUDED_FIELDS]
+
+
+def _links(model, field_name, company_id):
+    """``{owner id: [target ids]}`` for one many-to-many field, in one query"""
+    field = model._meta.get_field(field_name)
+    through = field.remote_field.through
+    source = field.m2m_column_name()
+    target = field.m2m_reverse_name()
+    links = defaultdict(list)
+    rows = (
+        through.objects
+        .filter(**{f'{field.m2m_field_name()}__company_id': company_id})
+        .order_by(source, target).values_list(source, target)
+    )
+    for owner_id, target_id in rows:
+        links[owner_id].append(target_id)
+    return links
+
+
+def _dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+def _section(model, m2m, company_id):
+    links = {key: _links(model, field_name, company_id) for key, field_name in m2m.items()}
+    rows = model.objects.filter(company_id=company_id).order_by('pk').values(*_fields(model))
+    chunk = []
+    first = True
+    for row in rows.iterator(chunk_size=CHUNK_ROWS):
+        for key, by_owner in links.items():
+            row[key] = by_owner.get(row['id'], [])
+        chunk.append(_dumps(row))
+        if len(chunk) >= CHUNK_ROWS:
+            yield ('' if first else ',') + ','.join(chunk)
+            first, chunk = False, []
+    if chunk:
+        yield ('' if first else ',') + ','.join(chunk)
+
+
+def _serialize(company, version):
+    yield '{"version":%d,"company":%s' % (version, _dumps(company))
+    for key, model, m2m in SECTIONS:
+        yield ',"%s":[' % key
+        yield from _section(model, m2m, company['id'])
+        yield ']'
+    yield '}'
+
+
+def _encode_and_cache(key, chunks):
+    parts = []
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        parts.append(data)
+        yield data
+    cache.set(key, b''.join(parts), cache_timeout())
+
+
+def hierarchy_document(company_id):
+    """
+    The document of ``company_id`` as an iterator of bytes, or ``None`` if
+    the company does not exist. A cached document costs no queries; a new
+    one is built while it is being streamed and cached when complete.
+    """
+    version = current_version(company_id)
+    if version is None:
+        return None
+    key = f'hierarchy:{company_id}:v{version}'
+    cached = cache.get(key)
+    if cached is not None:
+        return iter([cached])
+    company = Company.objects.filter(pk=company_id).values(*_fields(Company)).first()
+    if company is None:
+        return None
+    return _encode_and_cache(key, _serialize(company, version))
@@ -0,0 +1,243 @@
+# hours.py
+"""
+Operating hours as sorted week intervals.
+
+``CompanyLocation.operating_hours`` is free-form JSON keyed by weekday::
+
+    {"monday": "08:00-12:00, 13:00-17:00", "friday": ["08:00", "16:30"],
+     "saturday": {"open": "22:00", "close": "02:00"}, "sunday": "closed"}
+
+``compile_operating_hours()`` turns it into ``CompanyLocation.operating_intervals``:
+merged, sorted ``[start, end)`` pairs of minutes since Monday 00:00, so
+overnight hours just cross midnight, and Sunday night wraps to Monday.
+Times are local (``TIME_ZONE``). Missing days are closed.
+
+``OpeningIndex`` answers "which locations are open at T" for all active
+locations with one bisect: the week is cut at every opening and closing
+minute, and each slice stores the set of locations open throughout it.
+It is rebuilt per process when a location's status or hours change.
+``open_windows()``/``slots()`` expand one location's intervals into
+datetimes for appointment scheduling.
+"""
+import bisect
+import re
+import threading
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from . import bus
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+CLOSED_VALUES = {'', 'closed', 'off', 'none', '-'}
+ALL_DAY_VALUES = {'24h', '24 hours', 'open 24 hours', 'all day'}
+TIME_RE = re.compile(r'^(\d{1,2})(?::?(\d{2}))?\s*([ap]m)?$', re.IGNORECASE)
+TOPICS = (bus.LOCATION_STATUS, bus.LOCATION_HOURS)
+
+
+def _weekday(key):
+    key = str(key).strip().lower()
+    for index, name in enumerate(WEEKDAYS):
+        if key == name or key == name[:3]:
+            return index
+    raise ValueError(f'Unknown weekday {key!r}')
+
+
+def parse_time(value):
+    """Minutes since midnight of ``'9'``, ``'09:30'``, ``'0930'``, ``'5pm'`` or ``'24:00'``"""
+    match = TIME_RE.match(str(value).strip())
+    if not match:
+        raise ValueError(f'Invalid time {value!r}')
+    hours, minutes, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hours <= 12:
+            raise ValueError(f'Invalid time {value!r}')
+        hours = hours % 12 + (12 if meridiem.lower() == 'pm' else 0)
+    if minutes > 59 or hours > 24 or (hours == 24 and minutes):
+        raise ValueError(f'Invalid time {value!r}')
+    return hours * 60 + minutes
+
+
+def _day_ranges(value):
+    """``[(open, close)]`` minutes for one weekday value"""
+    if value is None or value is False:
+        return []
+    if isinstance(value, dict):
+        if value.get('closed'):
+            return []
+        return [(parse_time(value['open']), parse_time(value['close']))]
+    if isinstance(value, (list, tuple)):
+        if len(value) == 2 and all(isinstance(part, str) and '-' not in part for part in value):
+            return [(parse_time(value[0]), parse_time(value[1]))]
+        return [pair for part in value for pair in _day_ranges(part)]
+    text = str(value).strip().lower()
+    if text in CLOSED_VALUES:
+        return []
+    if text in ALL_DAY_VALUES:
+        return [(0, MINUTES_PER_DAY)]
+    ranges = []
+    for part in re.split(r'[,;]', text):
+        start, sep, end = part.partition('-')
+        if not sep:
+            raise ValueError(f'Invalid hours {part.strip()!r}, expected HH:MM-HH:MM')
+        ranges.append((parse_time(start), parse_time(end)))
+    return ranges
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def compile_operating_hours(hours, strict=True):
+    """
+    Week intervals of an ``operating_hours`` blob. ``strict=False`` skips
+    days that cannot be parsed instead of raising ``ValueError``.
+    """
+    if not hours:
+        return []
+    if not isinstance(hours, dict):
+        raise ValueError('Operating hours must be an object keyed by weekday')
+    intervals = []
+    for key, value in hours.items():
+        try:
+            day = _weekday(key)
+            ranges = _day_ranges(value)
+        except (ValueError, KeyError, TypeError) as exc:
+            if strict:
+                raise ValueError(f'{key}: {exc}') from exc
+            continue
+        for opens, closes in ranges:
+            if closes == opens:
+                continue
+            start = day * MINUTES_PER_DAY + opens
+            # Closing earlier than opening means the next morning
+            end = day * MINUTES_PER_DAY + closes + (MINUTES_PER_DAY if closes < opens else 0)
+            if end > MINUTES_PER_WEEK:
+                intervals.append((start, MINUTES_PER_WEEK))
+                intervals.append((0, end - MINUTES_PER_WEEK))
+            else:
+                intervals.append((start, end))
+    return merge_intervals(intervals)
+
+
+def minute_of_week(when):
+    when = timezone.localtime(when) if timezone.is_aware(when) else when
+    return when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+
+
+def is_open(intervals, when):
+    minute = minute_of_week(when)
+    position = bisect.bisect_right(intervals, [minute, MINUTES_PER_WEEK + 1]) - 1
+    return position >= 0 and intervals[position][0] <= minute < intervals[position][1]
+
+
+def open_windows(intervals, start, end):
+    """``(opens, closes)`` datetimes of the intervals overlapping ``[start, end)``"""
+    pending = None
+    for window in _week_windows(intervals, start, end):
+        if pending and window[0] <= pending[1]:
+            # Sunday night running into Monday morning
+            pending = (pending[0], max(pending[1], window[1]))
+            continue
+        if pending:
+            yield pending
+        pending = window
+    if pending:
+        yield pending
+
+
+def _week_windows(intervals, start, end):
+    if not intervals or start >= end:
+        return
+    tz = timezone.get_current_timezone()
+    local_start = timezone.localtime(start) if timezone.is_aware(start) else start
+    monday = datetime.combine(local_start.date() - timedelta(days=local_start.weekday()), time())
+    while True:
+        week_start = timezone.make_aware(monday, tz) if timezone.is_aware(start) else monday
+        if week_start >= end:
+            return
+        for opens, closes in intervals:
+            # Whole-minute offsets; daylight saving shifts are resolved per datetime
+            window_start = week_start + timedelta(minutes=opens)
+            window_end = week_start + timedelta(minutes=closes)
+            if window_end <= start or window_start >= end:
+                continue
+            yield max(window_start, start), min(window_end, end)
+        monday += timedelta(days=7)
+
+
+def slots(intervals, start, end, length, step=None):
+    """Appointment slots of ``length`` (a timedelta) inside the open windows"""
+    step = step or length
+    for opens, closes in open_windows(intervals, start, end):
+        slot = opens
+        while slot + length <= closes:
+            yield slot, slot + length
+            slot += step
+
+
+class OpeningIndex:
+    """Locations open in each slice of the week"""
+
+    def __init__(self, rows):
+        boundaries = {0, MINUTES_PER_WEEK}
+        for _, intervals in rows:
+            for start, end in intervals:
+                boundaries.update((start, end))
+        self.boundaries = sorted(boundaries)
+        slices = [set() for _ in self.boundaries]
+        for location_id, intervals in rows:
+            for start, end in intervals:
+                first = bisect.bisect_left(self.boundaries, start)
+                last = bisect.bisect_left(self.boundaries, end)
+                for position in range(first, last):
+                    slices[position].add(location_id)
+        self.slices = [frozenset(open_ids) for open_ids in slices]
+
+    def open_at(self, when):
+        position = bisect.bisect_right(self.boundaries, minute_of_week(when)) - 1
+        return self.slices[position]
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def build_index():
+    from .models import CompanyLocation
+
+    rows = (
+        CompanyLocation.objects
+        .filter(status=CompanyLocation.LocationStatus.ACTIVE)
+        .exclude(operating_intervals=[])
+        .values_list('pk', 'operating_intervals')
+    )
+    return OpeningIndex([(pk, intervals) for pk, intervals in rows if intervals])
+
+
+def get_index():
+    global _index, _index_version
+    version = bus.generation(*TOPICS)
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index, _index_version = build_index(), version
+    return _index
+
+
+def invalidate():
+    bus.publish(bus.LOCATION_HOURS)
+
+
+def open_location_ids(when=None):
+    """Ids of active locations open at ``when`` (default: now)"""
+    return get_index().open_at(when or timezone.now())
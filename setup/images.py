@@ -0,0 +1,195 @@
+# images.py
+"""
+Derived images for company logos.
+
+An uploaded logo is decoded once and rendered into small fixed-size
+variants, each in a fallback format (PNG when the logo has transparency,
+JPEG otherwise) and as WebP. Files are named after the SHA-256 of the
+uploaded bytes::
+
+    company_logos/derived/3f2a9c1d0b7e4a55-thumb.webp
+
+so a name never changes content and can be cached forever; re-uploading
+the same file reuses the existing derivatives. ``Company.logo_derivatives``
+records the names.
+"""
+import atexit
+import hashlib
+import io
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import bus
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = 'company_logos/derived'
+# Upload limits, enforced while streaming by uploads.LogoUploadHandler
+LOGO_MAX_BYTES = 5 * 1024 * 1024
+LOGO_MAX_SIDE = 4096
+LOGO_MAX_PIXELS = 16 * 1024 * 1024
+LOGO_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP'}
+# Twice the CSS size of the admin previews, for high-DPI screens
+LOGO_VARIANTS = {
+    'thumb': (60, 60),
+    'preview': (400, 400),
+}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+DERIVED_NAME_RE = re.compile(r'^[0-9a-f]{16}-[a-z]+\.(png|jpg|webp)$')
+
+
+def content_hash(fh):
+    digest = hashlib.sha256()
+    fh.seek(0)
+    for chunk in iter(lambda: fh.read(64 * 1024), b''):
+        digest.update(chunk)
+    fh.seek(0)
+    return digest.hexdigest()[:16]
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    elif fmt == 'png':
+        image.save(buffer, 'PNG', optimize=True)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _store(name, data):
+    path = f'{DERIVED_DIR}/{name}'
+    if not default_storage.exists(path):
+        default_storage.save(path, ContentFile(data))
+    return name
+
+
+def render_derivatives(image, digest):
+    """Write every variant of an opened image; returns the ``logo_derivatives`` value"""
+    image = ImageOps.exif_transpose(image)
+    fallback = 'png' if _has_alpha(image) else 'jpg'
+    image = image.convert('RGBA' if fallback == 'png' else 'RGB')
+    variants = {}
+    for variant, size in LOGO_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.Resampling.LANCZOS)
+        variants[variant] = {
+            'width': resized.width,
+            'height': resized.height,
+            'fallback': _store(f'{digest}-{variant}.{fallback}', _encode(resized, fallback)),
+            'webp': _store(f'{digest}-{variant}.webp', _encode(resized, 'webp')),
+        }
+    return {'hash': digest, 'variants': variants}
+
+
+def build_logo_derivatives(fieldfile):
+    fieldfile.open('rb')
+    try:
+        digest = content_hash(fieldfile)
+        with Image.open(fieldfile) as image:
+            image.load()
+            return render_derivatives(image, digest)
+    finally:
+        # Uncommitted uploads still have to be saved to storage afterwards
+        fieldfile.seek(0)
+
+
+def logo_needs_refresh(company):
+    if not company.logo:
+        return bool(company.logo_derivatives)
+    if not company.logo._committed:
+        return True
+    snapshot = getattr(company, '_audit_snapshot', None)
+    if snapshot is not None and snapshot.get('logo') != company.logo.name:
+        return True
+    return not company.logo_derivatives
+
+
+def refresh_logo_derivatives(company):
+    """Rebuild ``company.logo_derivatives`` now if the logo changed; returns whether it did"""
+    if not logo_needs_refresh(company):
+        return False
+    company.logo_derivatives = build_logo_derivatives(company.logo) if company.logo else {}
+    return True
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'LOGO_DERIVATIVE_WORKERS', 2),
+                thread_name_prefix='logo-derivatives',
+            )
+        return _executor
+
+
+def _build_in_background(company_model, pk, logo_name):
+    try:
+        company = company_model(pk=pk, logo=logo_name)
+        derivatives = build_logo_derivatives(company.logo)
+        # A newer upload may have replaced the logo meanwhile. updated_at
+        # moves too, so the page's ETag/Last-Modified pick up the new URLs.
+        if company_model.objects.filter(pk=pk, logo=logo_name).update(
+            logo_derivatives=derivatives, updated_at=timezone.now(),
+        ):
+            bus.publish(bus.COMPANY, pk)
+    except Exception:
+        logger.exception('Could not build logo derivatives for company %s', pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_logo_derivatives(company):
+    """Build derivatives of the saved logo on the worker pool once the transaction commits"""
+    args = (type(company), company.pk, company.logo.name)
+    if not getattr(settings, 'LOGO_DERIVATIVE_WORKERS', 2):
+        transaction.on_commit(lambda: _build_in_background(*args))
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_build_in_background, *args))
+
+
+@atexit.register
+def shutdown():
+    """Finish queued derivative jobs on clean interpreter shutdown"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def derivative_url(derivatives, variant, fmt='fallback'):
+    name = (derivatives or {}).get('variants', {}).get(variant, {}).get(fmt)
+    return reverse('company_logo_derivative', args=[name]) if name else None
+
+
+def open_derivative(name):
+    """Open a derived file by its bare name; ``None`` for anything else"""
+    if not DERIVED_NAME_RE.match(name or ''):
+        return None
+    path = f'{DERIVED_DIR}/{name}'
+    if not default_storage.exists(path):
+        return None
+    return default_storage.open(path, 'rb')
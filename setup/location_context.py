@@ -0,0 +1,127 @@
+# location_context.py
+"""
+The branch a request is operating at.
+
+A terminal names its location by ``CompanyLocation.code`` in the
+``X-Location-Code`` header, by subdomain (``col01.<LOCATION_SUBDOMAIN_BASE>``),
+or by the ``location_code`` session value set with ``activate()``.
+``LocationContextMiddleware`` resolves it to ``request.location`` and
+``request.company``.
+
+Each worker process loads the codes of all operational locations with one
+query, so an unknown code is answered without touching the database, and
+loads a location (with its company) the first time its code is used. Both
+are kept until a location or company change is published on the
+invalidation bus, and only valid codes are ever cached. The objects are
+shared between requests and must be treated as read-only.
+"""
+import threading
+
+from django.conf import settings
+
+from . import bus
+from .models import CompanyLocation
+
+SESSION_KEY = 'location_code'
+HEADER = 'HTTP_X_LOCATION_CODE'
+TOPICS = (bus.COMPANY, bus.LOCATION)
+OPERATIONAL_STATUSES = (
+    CompanyLocation.LocationStatus.ACTIVE,
+    CompanyLocation.LocationStatus.TEMPORARY,
+)
+
+_codes = {}
+# Lowercased code -> pk; None when codes differ only in case
+_folded_codes = {}
+_locations = {}
+_version = None
+_lock = threading.Lock()
+
+
+def invalidate():
+    bus.publish(bus.LOCATION)
+
+
+def _load_codes():
+    """Code maps for the current bus generation, reloaded when it moves"""
+    global _codes, _folded_codes, _locations, _version
+    version = bus.generation(*TOPICS)
+    with _lock:
+        if _version == version:
+            return version, _codes, _folded_codes
+    codes = dict(
+        CompanyLocation.objects.filter(status__in=OPERATIONAL_STATUSES).values_list('code', 'pk')
+    )
+    folded_codes = {}
+    for code, pk in codes.items():
+        folded = code.lower()
+        folded_codes[folded] = None if folded in folded_codes else pk
+    with _lock:
+        _codes, _folded_codes, _locations, _version = codes, folded_codes, {}, version
+    return version, codes, folded_codes
+
+
+def get_location(code, ignore_case=False):
+    """The operational location with ``code``, or ``None``; cached per worker"""
+    version, codes, folded_codes = _load_codes()
+    # Codes that differ only in case cannot be told apart by subdomain
+    pk = folded_codes.get(code.lower()) if ignore_case else codes.get(code)
+    if pk is None:
+        return None
+    with _lock:
+        location = _locations.get(pk) if _version == version else None
+    if location is None:
+        location = (
+            CompanyLocation.objects.select_related('company')
+            .filter(pk=pk, status__in=OPERATIONAL_STATUSES).first()
+        )
+        if location is not None:
+            with _lock:
+                if _version == version:
+                    _locations[pk] = location
+    return location
+
+
+def requested_code(request):
+    """``(code, source)`` named by the request, or ``(None, None)``"""
+    code = request.META.get(HEADER, '').strip()
+    if code:
+        return code, 'header'
+    base = getattr(settings, 'LOCATION_SUBDOMAIN_BASE', None)
+    if base:
+        host = request.get_host().split(':')[0].lower()
+        if host.endswith('.' + base.lower()):
+            subdomain = host[:-len(base) - 1]
+            if subdomain and '.' not in subdomain:
+                return subdomain, 'subdomain'
+    session = getattr(request, 'session', None)
+    if session is not None and session.get(SESSION_KEY):
+        return session[SESSION_KEY], 'session'
+    return None, None
+
+
+def resolve(request):
+    """
+    ``(location, source)`` for ``request``. ``location`` is ``None`` when no
+    location was named, or when it is unknown, not operational or outside
+    the user's scope.
+    """
+    code, source = requested_code(request)
+    if code is None:
+        return None, None
+    # Host names are case-insensitive
+    location = get_location(code, ignore_case=source == 'subdomain')
+    if location is None or not request.scope.has_location(location):
+        return None, source
+    return location, source
+
+
+def activate(request, location):
+    """Remember ``location`` for the rest of the session"""
+    request.session[SESSION_KEY] = location.code
+    request.location, request.company = location, location.company
+
+
+def deactivate(request):
+    request.session.pop(SESSION_KEY, None)
+    request.location = request.company = None
@@ -0,0 +1,160 @@
+# location_history.py
+"""
+Point-in-time reconstruction of company locations.
+
+A ``LocationSnapshot`` stores every field of a location with its type
+preserved. To see a location as it was at time T we start from the latest
+snapshot taken at or before T and replay only the ``LocationAuditLog``
+rows recorded between that snapshot and T.
+
+Snapshots are taken when a location is created, after every
+``LOCATION_SNAPSHOT_INTERVAL`` audited changes, and by
+``manage.py snapshot_locations``. The interval bounds how many audit rows
+a reconstruction has to replay. Rows that ``manage.py archive_audit`` has
+moved to cold storage are read back from the archive files.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.utils.dateparse import parse_datetime
+
+from . import audit, audit_archive
+from .models import CompanyLocation, LocationAuditLog, LocationSnapshot
+
+_MISSING = object()
+
+
+def snapshot_interval():
+    return getattr(settings, 'LOCATION_SNAPSHOT_INTERVAL', 50)
+
+
+def serialize(location):
+    return {
+        field.attname: field.value_from_object(location)
+        for field in CompanyLocation._meta.concrete_fields
+    }
+
+
+def snapshot_for(location, taken_at=None):
+    """An unsaved snapshot of the location's current state"""
+    snapshot = LocationSnapshot(location=location, data=serialize(location))
+    if taken_at:
+        snapshot.taken_at = taken_at
+    return snapshot
+
+
+def take_snapshot(location):
+    """Queue a snapshot; it is written with the audit rows on commit"""
+    audit.record(snapshot_for(location))
+
+
+def maybe_snapshot(location, created=False):
+    """Snapshot new locations and locations with enough changes since the last snapshot"""
+    if not created:
+        last_taken = (
+            LocationSnapshot.objects.filter(location=location)
+            .order_by('-taken_at').values_list('taken_at', flat=True).first()
+        )
+        changes = LocationAuditLog.objects.filter(location=location)
+        if last_taken:
+            changes = changes.filter(timestamp__gt=last_taken)
+        if changes.values('pk')[:snapshot_interval()].count() < snapshot_interval():
+            return False
+    take_snapshot(location)
+    return True
+
+
+def _typed_state(data):
+    state = {}
+    for field in CompanyLocation._meta.concrete_fields:
+        if field.attname in data:
+            value = data[field.attname]
+            state[field.attname] = None if value is None else field.to_python(value)
+    return state
+
+
+def _typed_value(field, json_value, text_value):
+    """Typed value of one side of an audit row, or ``_MISSING`` if it cannot be recovered"""
+    if json_value is not None:
+        return field.to_python(json_value)
+    if text_value is None or text_value == 'None':
+        return None
+    # Rows written before typed values were stored only have str(value)
+    try:
+        return field.to_python(text_value)
+    except ValidationError:
+        return _MISSING
+
+
+def _apply(state, log, use_old):
+    try:
+        field = CompanyLocation._meta.get_field(log.field_name)
+    except FieldDoesNotExist:
+        return
+    if not field.concrete:
+        return
+    if use_old:
+        value = _typed_value(field, log.old_value_json, log.old_value)
+    else:
+        value = _typed_value(field, log.new_value_json, log.new_value)
+    if value is not _MISSING:
+        state[field.attname] = value
+
+
+def _archived_changes(location_id, after, until):
+    """Archived update rows with ``after < timestamp <= until``"""
+    attnames = {field.attname for field in LocationAuditLog._meta.concrete_fields}
+    rows = audit_archive.iter_archive(
+        'location_audit_log', after, until + timedelta(microseconds=1),
+        location_id=location_id, action='update',
+    )
+    return [
+        LocationAuditLog(**{name: value for name, value in row.items() if name in attnames})
+        for row in rows
+        if row['timestamp'] > after
+    ]
+
+
+def _changes(location_id, after, until, newest_first=False):
+    """Update rows of the location with ``after < timestamp <= until``, hot and archived"""
+    logs = list(LocationAuditLog.objects.filter(
+        location_id=location_id, action='update', timestamp__gt=after, timestamp__lte=until,
+    ))
+    logs.extend(_archived_changes(location_id, after, until))
+    return sorted(logs, key=lambda log: (log.timestamp, log.pk), reverse=newest_first)
+
+
+def location_as_of(location, when):
+    """
+    Rebuild ``location`` (instance or pk) as it was at ``when``.
+
+    Returns an unsaved ``CompanyLocation`` or ``None`` if the location did
+    not exist yet (or no snapshot is available).
+    """
+    location_id = getattr(location, 'pk', location)
+
+    snapshot = (
+        LocationSnapshot.objects.filter(location_id=location_id, taken_at__lte=when)
+        .order_by('-taken_at', '-id').first()
+    )
+    if snapshot is not None:
+        state = _typed_state(snapshot.data)
+        for log in _changes(location_id, snapshot.taken_at, when):
+            _apply(state, log, use_old=False)
+        return CompanyLocation(**state)
+
+    # Nothing that old: walk back from the oldest later snapshot
+    snapshot = (
+        LocationSnapshot.objects.filter(location_id=location_id, taken_at__gt=when)
+        .order_by('taken_at', 'id').first()
+    )
+    if snapshot is None:
+        return None
+    created_at = snapshot.data.get('created_at')
+    if created_at and parse_datetime(created_at) > when:
+        return None
+    state = _typed_state(snapshot.data)
+    for log in _changes(location_id, when, snapshot.taken_at, newest_first=True):
+        _apply(state, log, use_old=True)
+    return CompanyLocation(**state)
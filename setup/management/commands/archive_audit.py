@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from setup import audit_archive
+
+
+class Command(BaseCommand):
+    help = 'Move old audit rows into monthly compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int,
+                            default=getattr(settings, 'AUDIT_ARCHIVE_AFTER_DAYS', 365),
+                            help='Archive rows older than this many days')
+        parser.add_argument('--source', action='append', dest='sources',
+                            choices=sorted(audit_archive.SOURCES),
+                            help='Audit table to archive (default: all)')
+        parser.add_argument('--compression', choices=sorted(audit_archive.EXTENSIONS),
+                            default=getattr(settings, 'AUDIT_ARCHIVE_COMPRESSION', 'gzip'))
+        parser.add_argument('--chunk-size', type=int, default=audit_archive.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        for source in options['sources'] or sorted(audit_archive.SOURCES):
+            try:
+                count = audit_archive.archive(source, before, options['compression'], options['chunk_size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f'{source}: archived {count} row(s) older than {before:%Y-%m-%d}'
+            ))
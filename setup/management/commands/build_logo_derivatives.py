@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from setup import images
+from setup.models import Company
+
+
+class Command(BaseCommand):
+    help = 'Create thumbnails and WebP variants for company logos uploaded before derivatives existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild logos that already have derivatives')
+
+    def handle(self, *args, **options):
+        companies = Company.objects.exclude(logo='').exclude(logo__isnull=True)
+        if not options['all']:
+            companies = companies.filter(logo_derivatives={})
+        built = failed = 0
+        for company in companies.only('pk', 'logo').iterator():
+            try:
+                derivatives = images.build_logo_derivatives(company.logo)
+            except (OSError, ValueError) as exc:
+                failed += 1
+                self.stderr.write(f'{company.pk}: {exc}')
+                continue
+            # Not a user edit: leave updated_at and the audit trail alone
+            Company.objects.filter(pk=company.pk).update(logo_derivatives=derivatives)
+            built += 1
+        self.stdout.write(self.style.SUCCESS(f'Built derivatives for {built} logo(s), {failed} failed.'))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from setup import sequences
+
+
+class Command(BaseCommand):
+    help = 'Fold old daily sequence counters into monthly archive rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=None,
+                            help='Keep this many recent days (default: SEQUENCE_DAILY_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        keep_days = options['keep_days']
+        if keep_days is None:
+            keep_days = sequences.retention_days()
+        if keep_days < sequences.retention_days():
+            raise CommandError(
+                'Cannot keep fewer days than SEQUENCE_DAILY_RETENTION_DAYS '
+                f'({sequences.retention_days()}); those days can still issue numbers.'
+            )
+        before = timezone.localdate() - timedelta(days=keep_days)
+        folded, touched = sequences.compact_daily_counters(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Folded {folded} daily counter(s) before {before} into {touched} archive row(s)'
+        ))
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from setup import sms
+
+
+class Command(BaseCommand):
+    help = 'Send queued SMS messages in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateway', action='append', dest='gateways',
+                            help='Only drain this gateway (may be repeated)')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the queue once and exit instead of polling')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            total = 0
+            while True:
+                handled = sms.dispatch_pending(options['gateways'])
+                if not handled:
+                    break
+                total += handled
+            self.stdout.write(self.style.SUCCESS(f'Handled {total} message(s)'))
+            return
+
+        worker = sms.SMSWorker(options['gateways'], options['interval'])
+        worker.start()
+        try:
+            while worker.is_alive():
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping SMS worker...')
+            worker.stop()
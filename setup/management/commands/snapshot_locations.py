@@ -0,0 +1,31 @@
+from django.db.models import F, Max, Q
+from django.core.management.base import BaseCommand
+
+from setup import location_history
+from setup.models import CompanyLocation, LocationSnapshot
+
+
+class Command(BaseCommand):
+    help = 'Snapshot company locations that changed since their last snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Snapshot every location, changed or not')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        locations = CompanyLocation.objects.all()
+        if not options['all']:
+            locations = locations.annotate(last_snapshot=Max('snapshots__taken_at')).filter(
+                Q(last_snapshot__isnull=True) | Q(updated_at__gt=F('last_snapshot'))
+            )
+        batch, total = [], 0
+        for location in locations.order_by('pk').iterator(chunk_size=options['batch_size']):
+            batch.append(location_history.snapshot_for(location))
+            if len(batch) >= options['batch_size']:
+                LocationSnapshot.objects.bulk_create(batch)
+                total += len(batch)
+                batch = []
+        LocationSnapshot.objects.bulk_create(batch)
+        total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Took {total} location snapshot(s)'))
@@ -0,0 +1,52 @@
+# middleware.py
+from django.http import HttpResponseForbidden
+from django.utils.functional import SimpleLazyObject
+
+from . import audit, location_context
+from .scope import get_user_scope
+
+
+class ScopeMiddleware:
+    """Attach the user's company/location scope as ``request.scope`` (loaded on first use)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.scope = SimpleLazyObject(lambda: get_user_scope(request.user))
+        return self.get_response(request)
+
+
+class LocationContextMiddleware:
+    """
+    Attach ``request.location``/``request.company`` for the branch named by
+    header, subdomain or session (see ``setup.location_context``). A header
+    or subdomain naming a location the user cannot use is refused. A stale
+    session value is dropped.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.location = request.company = None
+        if request.user.is_authenticated:
+            location, source = location_context.resolve(request)
+            if location is not None:
+                request.location, request.company = location, location.company
+            elif source == 'session':
+                request.session.pop(location_context.SESSION_KEY, None)
+            elif source is not None:
+                return HttpResponseForbidden('Unknown or unavailable location.')
+        return self.get_response(request)
+
+
+class AuditUserMiddleware:
+    """Credit audit rows written while handling a request to ``request.user``"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with audit.acting_as(request.user):
+            return self.get_response(request)
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:26
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0046_supplierreferralfeedetails'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient_name', models.CharField(blank=True, default='', max_length=200, verbose_name='Recipient Name')),
+                ('phone', models.CharField(max_length=17, verbose_name='Phone Number')),
+                ('body', models.TextField(verbose_name='Message')),
+                ('gateway', models.CharField(default='default', max_length=50, verbose_name='Gateway')),
+                ('status', models.CharField(choices=[('PE', 'Pending'), ('SE', 'Sending'), ('SN', 'Sent'), ('DL', 'Delivered'), ('FA', 'Failed')], default='PE', max_length=2, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next Attempt At')),
+                ('claim_token', models.CharField(blank=True, default='', editable=False, max_length=32)),
+                ('claimed_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('provider_message_id', models.CharField(blank=True, db_index=True, default='', max_length=100, verbose_name='Provider Message ID')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last Error')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent At')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='Delivered At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_messages_created', to=settings.AUTH_USER_MODEL, verbose_name='Created By')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sms_messages', to='setup.supplierregistration', verbose_name='Supplier')),
+            ],
+            options={
+                'verbose_name': 'SMS Message',
+                'verbose_name_plural': 'SMS Messages',
+                'db_table': 'sms_message',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['gateway', 'status', 'next_attempt_at'], name='sms_message_gateway_7263fc_idx'), models.Index(fields=['claim_token'], name='sms_message_claim_t_330c80_idx')],
+            },
+        ),
+    ]
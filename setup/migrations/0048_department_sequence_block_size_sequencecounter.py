@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0047_smsmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='sequence_block_size',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Numbers reserved per worker at a time. Keep at 1 for gap-free numbering; raise only for very busy departments.', verbose_name='Sequence Block Size'),
+        ),
+        migrations.CreateModel(
+            name='SequenceCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=150, unique=True)),
+                ('day', models.DateField(blank=True, null=True)),
+                ('last_value', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_counters', to='setup.company')),
+                ('department', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_counters', to='setup.department')),
+                ('location', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_counters', to='setup.companylocation')),
+            ],
+            options={
+                'verbose_name': 'Sequence Counter',
+                'verbose_name_plural': 'Sequence Counters',
+                'db_table': 'sequence_counter',
+            },
+        ),
+    ]
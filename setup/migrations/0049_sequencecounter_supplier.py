@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0048_department_sequence_block_size_sequencecounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sequencecounter',
+            name='supplier',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_counters', to='setup.supplierregistration'),
+        ),
+    ]
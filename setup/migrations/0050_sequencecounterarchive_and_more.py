@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0049_sequencecounter_supplier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequenceCounterArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope_key', models.CharField(max_length=150)),
+                ('month', models.DateField(help_text='First day of the month')),
+                ('days', models.PositiveIntegerField(default=0)),
+                ('total_issued', models.PositiveBigIntegerField(default=0)),
+                ('max_daily', models.PositiveBigIntegerField(default=0)),
+                ('first_day', models.DateField()),
+                ('last_day', models.DateField()),
+            ],
+            options={
+                'verbose_name': 'Sequence Counter Archive',
+                'verbose_name_plural': 'Sequence Counter Archives',
+                'db_table': 'sequence_counter_archive',
+                'ordering': ['scope_key', 'month'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='sequencecounter',
+            index=models.Index(fields=['day'], name='sequence_co_day_ca9703_idx'),
+        ),
+        migrations.AddField(
+            model_name='sequencecounterarchive',
+            name='company',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_archives', to='setup.company'),
+        ),
+        migrations.AddField(
+            model_name='sequencecounterarchive',
+            name='department',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_archives', to='setup.department'),
+        ),
+        migrations.AddField(
+            model_name='sequencecounterarchive',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_archives', to='setup.companylocation'),
+        ),
+        migrations.AddField(
+            model_name='sequencecounterarchive',
+            name='supplier',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sequence_archives', to='setup.supplierregistration'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sequencecounterarchive',
+            unique_together={('scope_key', 'month')},
+        ),
+    ]
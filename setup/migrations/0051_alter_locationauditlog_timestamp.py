@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0050_sequencecounterarchive_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='locationauditlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:32
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('setup', '0051_alter_locationauditlog_timestamp'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.BigIntegerField(verbose_name='Object ID')),
+                ('object_repr', models.CharField(max_length=200, verbose_name='Object')),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10, verbose_name='Action')),
+                ('changes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Changes')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, editable=False)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.contenttype', verbose_name='Model')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='audit_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Audit Entry',
+                'verbose_name_plural': 'Audit Entries',
+                'db_table': 'audit_entry',
+                'ordering': ['-timestamp', '-id'],
+                'indexes': [models.Index(fields=['content_type', 'object_id', 'timestamp'], name='audit_entry_content_d860b6_idx'), models.Index(fields=['user', 'timestamp'], name='audit_entry_user_id_e66804_idx')],
+            },
+        ),
+    ]
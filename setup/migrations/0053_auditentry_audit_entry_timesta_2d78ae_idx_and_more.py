@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('setup', '0052_auditentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditentry',
+            index=models.Index(fields=['timestamp'], name='audit_entry_timesta_2d78ae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='locationauditlog',
+            index=models.Index(fields=['location', 'timestamp', 'id'], name='setup_locat_locatio_1c97f6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='locationauditlog',
+            index=models.Index(fields=['timestamp'], name='setup_locat_timesta_3e11e8_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:35
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0053_auditentry_audit_entry_timesta_2d78ae_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='locationauditlog',
+            name='new_value_json',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.AddField(
+            model_name='locationauditlog',
+            name='old_value_json',
+            field=models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True),
+        ),
+        migrations.CreateModel(
+            name='LocationSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='setup.companylocation')),
+            ],
+            options={
+                'ordering': ['-taken_at'],
+                'indexes': [models.Index(fields=['location', 'taken_at'], name='setup_locat_locatio_2a0aae_idx')],
+            },
+        ),
+    ]
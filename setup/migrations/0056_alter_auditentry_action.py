@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0055_locationauditlog_new_value_json_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditentry',
+            name='action',
+            field=models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete'), ('m2m', 'Membership change')], max_length=10, verbose_name='Action'),
+        ),
+    ]
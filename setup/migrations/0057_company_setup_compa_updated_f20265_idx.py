@@ -0,0 +1,19 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0056_alter_auditentry_action'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['updated_at'], name='setup_compa_updated_f20265_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0057_company_setup_compa_updated_f20265_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='logo_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Resized copies of the logo, see setup.images', verbose_name='Logo Derivatives'),
+        ),
+    ]
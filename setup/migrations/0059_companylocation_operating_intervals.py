@@ -0,0 +1,120 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:53
+
+import re
+
+from django.db import migrations, models
+
+# A copy of setup.hours as of this migration, so later changes to the
+# parser cannot change what this migration does
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+CLOSED_VALUES = {'', 'closed', 'off', 'none', '-'}
+ALL_DAY_VALUES = {'24h', '24 hours', 'open 24 hours', 'all day'}
+TIME_RE = re.compile(r'^(\d{1,2})(?::?(\d{2}))?\s*([ap]m)?$', re.IGNORECASE)
+
+
+def _weekday(key):
+    key = str(key).strip().lower()
+    for index, name in enumerate(WEEKDAYS):
+        if key == name or key == name[:3]:
+            return index
+    raise ValueError(f'Unknown weekday {key!r}')
+
+
+def parse_time(value):
+    match = TIME_RE.match(str(value).strip())
+    if not match:
+        raise ValueError(f'Invalid time {value!r}')
+    hours, minutes, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hours <= 12:
+            raise ValueError(f'Invalid time {value!r}')
+        hours = hours % 12 + (12 if meridiem.lower() == 'pm' else 0)
+    if minutes > 59 or hours > 24 or (hours == 24 and minutes):
+        raise ValueError(f'Invalid time {value!r}')
+    return hours * 60 + minutes
+
+
+def _day_ranges(value):
+    if value is None or value is False:
+        return []
+    if isinstance(value, dict):
+        if value.get('closed'):
+            return []
+        return [(parse_time(value['open']), parse_time(value['close']))]
+    if isinstance(value, (list, tuple)):
+        if len(value) == 2 and all(isinstance(part, str) and '-' not in part for part in value):
+            return [(parse_time(value[0]), parse_time(value[1]))]
+        return [pair for part in value for pair in _day_ranges(part)]
+    text = str(value).strip().lower()
+    if text in CLOSED_VALUES:
+        return []
+    if text in ALL_DAY_VALUES:
+        return [(0, MINUTES_PER_DAY)]
+    ranges = []
+    for part in re.split(r'[,;]', text):
+        start, sep, end = part.partition('-')
+        if not sep:
+            raise ValueError(f'Invalid hours {part.strip()!r}, expected HH:MM-HH:MM')
+        ranges.append((parse_time(start), parse_time(end)))
+    return ranges
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def compile_operating_hours(hours):
+    """Week intervals of an ``operating_hours`` blob; unparsable days are skipped"""
+    if not hours or not isinstance(hours, dict):
+        return []
+    intervals = []
+    for key, value in hours.items():
+        try:
+            day = _weekday(key)
+            ranges = _day_ranges(value)
+        except (ValueError, KeyError, TypeError):
+            continue
+        for opens, closes in ranges:
+            if closes == opens:
+                continue
+            start = day * MINUTES_PER_DAY + opens
+            end = day * MINUTES_PER_DAY + closes + (MINUTES_PER_DAY if closes < opens else 0)
+            if end > MINUTES_PER_WEEK:
+                intervals.append((start, MINUTES_PER_WEEK))
+                intervals.append((0, end - MINUTES_PER_WEEK))
+            else:
+                intervals.append((start, end))
+    return merge_intervals(intervals)
+
+
+def compile_existing_hours(apps, schema_editor):
+    CompanyLocation = apps.get_model('setup', 'CompanyLocation')
+    locations = list(CompanyLocation.objects.exclude(operating_hours=None).only('pk', 'operating_hours'))
+    for location in locations:
+        location.operating_intervals = compile_operating_hours(location.operating_hours)
+    CompanyLocation.objects.bulk_update(locations, ['operating_intervals'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0058_company_logo_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companylocation',
+            name='operating_intervals',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='Operating hours compiled to minutes since Monday 00:00, see setup.hours', verbose_name='Operating Intervals'),
+        ),
+        migrations.RunPython(compile_existing_hours, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.3 on 2026-10-19 19:55
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def demote_duplicate_headquarters(apps, schema_editor):
+    """Keep the oldest headquarters of each company"""
+    CompanyLocation = apps.get_model('setup', 'CompanyLocation')
+    headquarters = CompanyLocation.objects.filter(is_headquarters=True)
+    keep = headquarters.values('company_id').annotate(first=Min('pk')).values('first')
+    headquarters.exclude(pk__in=keep).update(is_headquarters=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0059_companylocation_operating_intervals'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(demote_duplicate_headquarters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='companylocation',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_headquarters', True)), fields=('company',), name='unique_headquarters_per_company', violation_error_code='headquarters_conflict', violation_error_message='This company already has a headquarters location.'),
+        ),
+    ]
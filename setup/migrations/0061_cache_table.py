@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-19 12:00
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # The shared cache (settings.CACHES) is a database table unless REDIS_URL is set
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('setup', '0060_companylocation_unique_headquarters_per_company'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -1,12 +1,21 @@
 # models.py
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.core.validators import RegexValidator, MinLengthValidator, EmailValidator
 from django.utils.translation import gettext_lazy as _
-from django.core.exceptions import ValidationError
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
 from django.utils import timezone
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db.models import UniqueConstraint
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.fields.files import FieldFile
+
+from . import audit
+from . import bus
+from . import hours
+from . import images
+from . import numbering
 
  
 
@@ -31,13 +40,243 @@ class TimeStampedUserModel(models.Model):
     class Meta:
         abstract = True
 
+class AuditedModelMixin:
+    """
+    Records every save and delete as one ``AuditEntry`` row holding a JSON
+    diff of the changed fields.
+
+    The diff is computed against the values the row was loaded with
+    (captured in ``from_db``), so no extra SELECT is needed. Entries are
+    buffered and written on commit by ``setup.audit``. Queryset ``update()``
+    and bulk operations bypass this.
+    """
+    audit_exclude = ('created_at', 'updated_at', 'created_by', 'updated_by')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._audit_snapshot = instance._audit_values(field_names)
+        return instance
+
+    def _audit_values(self, attnames=None):
+        values = {}
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.name in self.audit_exclude:
+                continue
+            if attnames is not None and field.attname not in attnames:
+                continue
+            value = getattr(self, field.attname)
+            if isinstance(value, FieldFile):
+                value = value.name or None
+            values[field.attname] = value
+        return values
+
+    def _audit_user_id(self, action):
+        user_id = audit.acting_user_id()
+        if user_id is not None or action == AuditEntry.Action.DELETE:
+            # Never credit a delete to whoever last edited the row
+            return user_id
+        # __dict__, so a deferred column is not loaded just for the audit row
+        return self.__dict__.get('updated_by_id') or self.__dict__.get('created_by_id')
+
+    def _audit_repr(self):
+        if self.get_deferred_fields():
+            # __str__ may need a deferred column
+            return f'{self._meta.verbose_name} #{self.pk}'
+        return str(self)[:200]
+
+    def _record_audit(self, action, changes):
+        audit.record(AuditEntry(
+            content_type=ContentType.objects.get_for_model(self, for_concrete_model=False),
+            object_id=self.pk,
+            object_repr=self._audit_repr(),
+            action=action,
+            changes=changes,
+            user_id=self._audit_user_id(action),
+        ), using=self._state.db)
+
+    def _saved_attnames(self, update_fields=None):
+        """Attnames written by a save; deferred fields are neither written nor loaded"""
+        deferred = self.get_deferred_fields()
+        attnames = {field.attname for field in self._meta.concrete_fields if field.attname not in deferred}
+        if update_fields is not None:
+            attnames &= {self._meta.get_field(name).attname for name in update_fields}
+        return attnames
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        snapshot = getattr(self, '_audit_snapshot', None)
+        current = self._audit_values(None if adding else self._saved_attnames(kwargs.get('update_fields')))
+        if adding:
+            action = AuditEntry.Action.CREATE
+            changes = {name: [None, value] for name, value in current.items() if value not in (None, '')}
+        else:
+            action = AuditEntry.Action.UPDATE
+            if snapshot is None:
+                # Not loaded from the database; old values are unknown
+                changes = {name: [None, value] for name, value in current.items()}
+            else:
+                changes = {
+                    name: [snapshot[name], value]
+                    for name, value in current.items()
+                    if name in snapshot and snapshot[name] != value
+                }
+            if not changes:
+                return
+        self._audit_snapshot = {**(snapshot or {}), **current}
+        self._record_audit(action, changes)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        self.pk = pk
+        self._record_audit(AuditEntry.Action.DELETE, {})
+        self.pk = None
+        return result
+
+
 def validate_file_size(value):
     """Validate file size (limit to 5MB)"""
     filesize = value.size
     if filesize > 5 * 1024 * 1024:  # 5MB
         raise ValidationError("Maximum file size is 5MB")
 
-class Company(TimeStampedUserModel):
+class CompanyQuerySet(models.QuerySet):
+    """
+    ``validated_bulk_create``/``validated_bulk_update`` give a batch the same
+    validation as ``Company.save()`` without its per-row queries: fields and
+    ``clean()`` are checked in memory, foreign keys with one query per
+    field, and uniqueness with one ``IN`` query per unique field plus a
+    check for duplicates inside the batch. Errors are reported per row as
+    ``ValidationError({row_index: ['field: message', ...]})``.
+    """
+
+    def _unique_fields(self):
+        return [f for f in self.model._meta.concrete_fields if f.unique and not f.primary_key]
+
+    def _validate_batch(self, objs):
+        errors = {}
+
+        def add(index, field, message):
+            prefix = '' if field == NON_FIELD_ERRORS else f'{field}: '
+            errors.setdefault(index, []).append(f'{prefix}{message}')
+
+        foreign_keys = [f for f in self.model._meta.concrete_fields if f.is_relation]
+        exclude = {f.name for f in foreign_keys}
+        for index, obj in enumerate(objs):
+            try:
+                obj.full_clean(exclude=exclude, validate_unique=False)
+            except ValidationError as e:
+                for field, messages in e.message_dict.items():
+                    for message in messages:
+                        add(index, field, message)
+
+        for field in foreign_keys:
+            ids = {getattr(obj, field.attname) for obj in objs}
+            ids.discard(None)
+            target = field.remote_field.model._base_manager.using(self.db)
+            known = set(target.filter(**{f'{field.target_field.attname}__in': ids})
+                        .values_list(field.target_field.attname, flat=True)) if ids else set()
+            for index, obj in enumerate(objs):
+                value = getattr(obj, field.attname)
+                if value is None:
+                    if not field.null:
+                        add(index, field.name, field.error_messages['null'])
+                elif value not in known:
+                    add(index, field.name, field.error_messages['invalid'] % {
+                        'model': field.remote_field.model._meta.verbose_name,
+                        'pk': value, 'field': field.target_field.name, 'value': value,
+                    })
+
+        for field in self._unique_fields():
+            values = {}
+            for index, obj in enumerate(objs):
+                value = getattr(obj, field.attname)
+                if value is None:
+                    continue
+                if value in values:
+                    add(index, field.name, _('Duplicate %(field)s in this batch (row %(row)d).') % {
+                        'field': field.verbose_name, 'row': values[value],
+                    })
+                else:
+                    values[value] = index
+            existing = dict(
+                self.model._base_manager.using(self.db)
+                .filter(**{f'{field.attname}__in': list(values)})
+                .values_list(field.attname, 'pk')
+            ) if values else {}
+            for value, index in values.items():
+                if value in existing and existing[value] != objs[index].pk:
+                    add(index, field.name, objs[index].unique_error_message(self.model, [field.name]).messages[0])
+
+        if errors:
+            raise ValidationError(dict(sorted(errors.items())))
+
+    def validated_bulk_create(self, objs, user=None, batch_size=500):
+        """Validate and insert new companies; ``user`` fills created_by/updated_by"""
+        objs = list(objs)
+        for obj in objs:
+            if user is not None:
+                obj.created_by_id = obj.created_by_id or user.pk
+                obj.updated_by_id = user.pk
+            obj.logo_derivatives = {}
+        self._validate_batch(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = self.bulk_create(objs, batch_size=batch_size)
+            for obj in created:
+                obj._record_audit(AuditEntry.Action.CREATE, {
+                    name: [None, value] for name, value in obj._audit_values().items() if value not in (None, '')
+                })
+                obj._audit_snapshot = obj._audit_values()
+                if obj.logo:
+                    images.schedule_logo_derivatives(obj)
+            # bulk_create() sends no post_save; delivered on commit
+            bus.publish(bus.COMPANY, *(obj.pk for obj in created if obj.pk is not None), using=self.db)
+        return created
+
+    def validated_bulk_update(self, objs, fields, user=None, batch_size=500):
+        """
+        Validate and write ``fields`` of existing companies. ``updated_at``
+        (and ``updated_by`` when ``user`` is given) are set here because
+        ``bulk_update()`` skips ``auto_now``. Audit entries hold the diff
+        against the values the objects were loaded with.
+        """
+        objs = list(objs)
+        fields = set(fields)
+        if 'logo' in fields:
+            raise ValueError('Logos must be changed through save()')
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+            if user is not None:
+                obj.updated_by_id = user.pk
+        fields.add('updated_at')
+        if user is not None:
+            fields.add('updated_by')
+        self._validate_batch(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            updated = self.bulk_update(objs, fields, batch_size=batch_size)
+            attnames = {self.model._meta.get_field(name).attname for name in fields}
+            for obj in objs:
+                snapshot = getattr(obj, '_audit_snapshot', None) or {}
+                current = obj._audit_values()
+                changes = {
+                    name: [snapshot.get(name), value]
+                    for name, value in current.items()
+                    if name in attnames and snapshot.get(name) != value
+                }
+                if changes:
+                    obj._record_audit(AuditEntry.Action.UPDATE, changes)
+                    obj._audit_snapshot = current
+            # bulk_update() sends no post_save; delivered on commit
+            bus.publish(bus.COMPANY, *(obj.pk for obj in objs), using=self.db)
+        return updated
+
+
+class Company(AuditedModelMixin, TimeStampedUserModel):
+    audit_exclude = AuditedModelMixin.audit_exclude + ('logo_derivatives',)
+
     # Basic Information
     name = models.CharField(
         _('Company Name'),
@@ -133,6 +372,13 @@ class Company(TimeStampedUserModel):
         null=True,
         help_text=_('Company logo (max 5MB)')
     )
+    logo_derivatives = models.JSONField(
+        _('Logo Derivatives'),
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text=_('Resized copies of the logo, see setup.images')
+    )
     description = models.TextField(
         _('Description'),
         blank=True,
@@ -151,6 +397,8 @@ class Company(TimeStampedUserModel):
         default=True,
         help_text=_('Whether the company is currently active')
     )
+
+    objects = CompanyQuerySet.as_manager()
     
     class Meta:
         verbose_name = _('Company')
@@ -159,6 +407,7 @@ class Company(TimeStampedUserModel):
         indexes = [
             models.Index(fields=['name']),
             models.Index(fields=['registration_number']),
+            models.Index(fields=['updated_at']),
         ]
         permissions = [
             ("view_company_details", "Can view company details"),
@@ -177,12 +426,27 @@ class Company(TimeStampedUserModel):
 
     def save(self, *args, **kwargs):
         self.full_clean()
+        logo_changed = images.logo_needs_refresh(self)
+        if logo_changed:
+            # Serve the original until the worker pool has built the new derivatives
+            self.logo_derivatives = {}
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'logo_derivatives'}
         super().save(*args, **kwargs)
+        if logo_changed and self.logo:
+            images.schedule_logo_derivatives(self)
+
+    def logo_url(self, variant='thumb', fmt='fallback'):
+        """URL of a logo derivative, falling back to the original upload"""
+        url = images.derivative_url(self.logo_derivatives, variant, fmt)
+        if url is None and self.logo:
+            url = self.logo.url
+        return url
 
  
 
 
-class LocationType(models.Model):
+class LocationType(AuditedModelMixin, models.Model):
     """Model to store different types of locations"""
     name = models.CharField(_('Type Name'), max_length=100, unique=True)
     is_internal = models.BooleanField(
@@ -213,6 +477,9 @@ class LocationType(models.Model):
     def __str__(self):
         return f"{self.name} ({'Internal' if self.is_internal else 'External'})"
 
+HEADQUARTERS_CONFLICT_MESSAGE = _('This company already has a headquarters location.')
+
+
 class CompanyLocation(models.Model):
     """Model to store company location details"""
     
@@ -288,6 +555,13 @@ class CompanyLocation(models.Model):
         blank=True,
         help_text=_('Store opening hours in JSON format')
     )
+    operating_intervals = models.JSONField(
+        _('Operating Intervals'),
+        default=list,
+        blank=True,
+        editable=False,
+        help_text=_('Operating hours compiled to minutes since Monday 00:00, see setup.hours')
+    )
     
     # Status and Metadata
     status = models.CharField(
@@ -325,6 +599,15 @@ class CompanyLocation(models.Model):
             models.Index(fields=['company', 'status']),
             models.Index(fields=['code']),
         ]
+        constraints = [
+            UniqueConstraint(
+                fields=['company'],
+                condition=models.Q(is_headquarters=True),
+                name='unique_headquarters_per_company',
+                violation_error_message=HEADQUARTERS_CONFLICT_MESSAGE,
+                violation_error_code='headquarters_conflict',
+            ),
+        ]
         permissions = [
             ("can_change_status", "Can change location status"),
             ("can_mark_headquarters", "Can mark location as headquarters"),
@@ -333,19 +616,27 @@ class CompanyLocation(models.Model):
     def __str__(self):
         return f"{self.company.name} - {self.name} ({self.get_status_display()})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def changed_fields(self):
+        """
+        Attnames whose value differs from what was loaded or last saved, or
+        ``None`` if the instance was not loaded from the database.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return None
+        return {name for name, value in loaded.items() if getattr(self, name) != value}
+
     def clean(self):
         """Custom validation"""
-        # Check if another headquarters exists when setting is_headquarters
-        if self.is_headquarters:
-            exists = CompanyLocation.objects.filter(
-                company=self.company,
-                is_headquarters=True
-            ).exclude(pk=self.pk).exists()
-            if exists:
-                raise ValidationError({
-                    'is_headquarters': _('This company already has a headquarters location.')
-                })
-        
+        # One headquarters per company is enforced by the
+        # unique_headquarters_per_company constraint, see save()
+
         # Validate operating hours format if provided
         if self.operating_hours:
             required_keys = {'monday', 'tuesday', 'wednesday', 'thursday', 'friday'}
@@ -353,6 +644,69 @@ class CompanyLocation(models.Model):
                 raise ValidationError({
                     'operating_hours': _('Operating hours must include all weekdays.')
                 })
+            try:
+                hours.compile_operating_hours(self.operating_hours)
+            except ValueError as e:
+                raise ValidationError({'operating_hours': str(e)})
+
+    def save(self, *args, **kwargs):
+        # Lenient here: rows saved before validation existed may hold unparsable days
+        self.operating_intervals = hours.compile_operating_hours(self.operating_hours, strict=False)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'operating_hours' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'operating_intervals'}
+        if not self.is_headquarters:
+            # The partial constraint only covers headquarters rows
+            super().save(*args, **kwargs)
+        else:
+            self._save_headquarters(*args, **kwargs)
+        # post_save handlers have compared against the previous values by now
+        self._loaded_values = {field.attname: field.value_from_object(self) for field in self._meta.concrete_fields}
+
+    def _save_headquarters(self, *args, **kwargs):
+        try:
+            # Savepoint, so the conflict can still be looked up after the error
+            with transaction.atomic(using=kwargs.get('using')):
+                super().save(*args, **kwargs)
+        except IntegrityError as e:
+            if self._other_headquarters().exists():
+                raise ValidationError({'is_headquarters': HEADQUARTERS_CONFLICT_MESSAGE}) from e
+            raise
+
+    def validate_constraints(self, exclude=None):
+        try:
+            super().validate_constraints(exclude=exclude)
+        except ValidationError as e:
+            # Report the headquarters conflict on its field, as clean() used to
+            errors = e.update_error_dict({})
+            general = errors.pop(NON_FIELD_ERRORS, [])
+            conflict = [error for error in general if error.code == 'headquarters_conflict']
+            if general := [error for error in general if error.code != 'headquarters_conflict']:
+                errors[NON_FIELD_ERRORS] = general
+            if conflict:
+                errors.setdefault('is_headquarters', []).extend(conflict)
+            raise ValidationError(errors)
+
+    def _other_headquarters(self):
+        others = CompanyLocation.objects.filter(company_id=self.company_id, is_headquarters=True)
+        return others.exclude(pk=self.pk) if self.pk else others
+
+class LocationAuditLogQuerySet(models.QuerySet):
+    def timeline(self, location, before=None):
+        """
+        Audit rows of ``location``, newest first.
+
+        ``before`` is a ``(timestamp, id)`` keyset cursor; only rows older
+        than it are returned. Served by the (location, timestamp, id) index.
+        """
+        queryset = self.filter(location=location).order_by('-timestamp', '-id')
+        if before:
+            timestamp, pk = before
+            queryset = queryset.filter(
+                models.Q(timestamp__lt=timestamp) | models.Q(timestamp=timestamp, id__lt=pk)
+            )
+        return queryset
+
 
 class LocationAuditLog(models.Model):
     """Model to track all changes to locations"""
@@ -365,7 +719,11 @@ class LocationAuditLog(models.Model):
     field_name = models.CharField(max_length=100, blank=True)
     old_value = models.TextField(blank=True, null=True)
     new_value = models.TextField(blank=True, null=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Typed copies of old_value/new_value used for point-in-time reconstruction
+    old_value_json = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    new_value_json = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    # Set when the change is recorded, not when the buffered row is written
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.PROTECT,
@@ -374,14 +732,41 @@ class LocationAuditLog(models.Model):
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.CharField(max_length=255, blank=True)
 
+    objects = LocationAuditLogQuerySet.as_manager()
+
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['location', 'timestamp', 'id']),
+            models.Index(fields=['timestamp']),
+        ]
 
     def __str__(self):
         return f"{self.location} - {self.action} by {self.user} at {self.timestamp}"
     
 
-class Department(models.Model):
+class LocationSnapshot(models.Model):
+    """Full typed copy of a CompanyLocation, the base for point-in-time reconstruction"""
+    location = models.ForeignKey(
+        CompanyLocation,
+        on_delete=models.CASCADE,
+        related_name='snapshots'
+    )
+    taken_at = models.DateTimeField(default=timezone.now)
+    # {attname: value} for every concrete field
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ['-taken_at']
+        indexes = [
+            models.Index(fields=['location', 'taken_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.location_id} @ {self.taken_at}"
+
+
+class Department(AuditedModelMixin, models.Model):
     # Basic Information
     Code =models.CharField(max_length=15,null=False,default="DEF")
     name = models.CharField(max_length=255)
@@ -419,6 +804,12 @@ class Department(models.Model):
     issue_sequence_auto = models.BooleanField(default=True, verbose_name=_("Auto Sequence"))
     department_wise_sequence = models.BooleanField(default=False, verbose_name=_("Department Wise Sequence"))
     department_sequence_per_day = models.BooleanField(default=False, verbose_name=_("Department Sequence Per Day"))
+    sequence_block_size = models.PositiveSmallIntegerField(
+        default=1,
+        verbose_name=_("Sequence Block Size"),
+        help_text=_('Numbers reserved per worker at a time. Keep at 1 for gap-free numbering; '
+                    'raise only for very busy departments.')
+    )
     
     # Audit Fields
     is_active = models.BooleanField(default=True)
@@ -430,10 +821,22 @@ class Department(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        """Custom validation"""
+        try:
+            numbering.validate_number_format(self.modify_invoice_number)
+        except ValidationError as e:
+            raise ValidationError({'modify_invoice_number': e.messages})
+
+    def save(self, *args, **kwargs):
+        numbering.validate_number_format(self.modify_invoice_number)
+        super().save(*args, **kwargs)
+        numbering.invalidate_department(self.pk)
+
  
 
 
-class ClassDetail(models.Model):
+class ClassDetail(AuditedModelMixin, models.Model):
     # Basic Information
     class_code = models.CharField(max_length=20, unique=True, verbose_name=_("Class Code"))
     name = models.CharField(max_length=255, verbose_name=_("Class Name"))
@@ -466,7 +869,7 @@ class ClassDetail(models.Model):
         verbose_name_plural = _("Class Details")
 
 
-class ClarificationDetail(models.Model):
+class ClarificationDetail(AuditedModelMixin, models.Model):
     # Basic Information
     code = models.CharField(max_length=20, unique=True, verbose_name=_("Clarification Code"))
     name = models.CharField(max_length=255, verbose_name=_("Clarification Name"))
@@ -502,7 +905,24 @@ class ClarificationDetail(models.Model):
 
 
 
-class UserCompany(models.Model):
+class UserGrantMixin:
+    """
+    Remembers the user a grant row was loaded for (``loaded_user_id``), so
+    moving the row to another user can invalidate both users' scopes.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_user_id = instance.__dict__.get('user_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.loaded_user_id = self.user_id
+
+
+class UserCompany(UserGrantMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='companies')
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='users')
     
@@ -513,7 +933,7 @@ class UserCompany(models.Model):
         return f"{self.user.username} - {self.company.name}"
 
     
-class UserLocation(models.Model):
+class UserLocation(UserGrantMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='locations')
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='userscompany')
     location = models.ForeignKey(CompanyLocation, on_delete=models.CASCADE, related_name='users')
@@ -525,7 +945,7 @@ class UserLocation(models.Model):
         return f"{self.user.username} - {self.company.name} - {self.location.name}"
 
 
-class LaboratoryDepartment(models.Model):
+class LaboratoryDepartment(AuditedModelMixin, models.Model):
     # Basic Information
     Code =models.CharField(max_length=15,null=False,default="DEF")
     name = models.CharField(max_length=255)
@@ -556,7 +976,7 @@ class LaboratoryDepartment(models.Model):
         return self.name
 
 
-class TaxCode(models.Model):
+class TaxCode(AuditedModelMixin, models.Model):
     code = models.CharField(max_length=50, null=False)
     rate = models.DecimalField(max_digits=5, decimal_places=2,default=0)
     name = models.CharField(max_length=100)
@@ -586,7 +1006,7 @@ class TaxCode(models.Model):
 
  
 
-class Service(models.Model):
+class Service(AuditedModelMixin, models.Model):
     company = models.ForeignKey('Company', on_delete=models.CASCADE, related_name='service_company')
     locations = models.ManyToManyField('CompanyLocation', related_name='service_locations')
     departments = models.ForeignKey('Department', on_delete=models.CASCADE, related_name='service_departments', verbose_name="Associated Departments")
@@ -631,7 +1051,7 @@ class Service(models.Model):
     def __str__(self):
         return self.service_name
 
-class ServiceLocationPrice(models.Model):
+class ServiceLocationPrice(AuditedModelMixin, models.Model):
     # Company and Location Information
     company = models.ForeignKey(
         'Company', 
@@ -746,7 +1166,7 @@ class ServiceLocationPrice(models.Model):
     def __str__(self):
         return f"{self.service_code} - {self.locations}"
 
-class ServiceTax(models.Model):
+class ServiceTax(AuditedModelMixin, models.Model):
     # Company and Location Information
     company = models.ForeignKey(
         'Company',
@@ -825,7 +1245,7 @@ class ServiceTax(models.Model):
 
 
 
-class ConsultationSupplierType(models.Model):
+class ConsultationSupplierType(AuditedModelMixin, models.Model):
     Code = models.CharField(max_length=10, null=False)
     Description = models.CharField(max_length=100, null=False)
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='SupplierTypecompany')
@@ -851,7 +1271,7 @@ class ConsultationSupplierType(models.Model):
  
 
 
-class SupplierRegistration(models.Model):
+class SupplierRegistration(AuditedModelMixin, models.Model):
     # Company and Location Details
 
     company = models.ForeignKey(
@@ -1126,7 +1546,7 @@ class SupplierRegistration(models.Model):
 
  
 
-class SupplierDepartmentDetails(models.Model):
+class SupplierDepartmentDetails(AuditedModelMixin, models.Model):
     # Company and Location Details
     company = models.ForeignKey(
         'Company',
@@ -1252,7 +1672,7 @@ class SupplierDepartmentDetails(models.Model):
         return f"{self.supplier} - {self.departments} - {self.services_code}"
 
 
-class SupplierReferralFeeDetails(models.Model):
+class SupplierReferralFeeDetails(AuditedModelMixin, models.Model):
     # Company and Location Details
     company = models.ForeignKey(
         'Company',
@@ -1350,3 +1770,244 @@ class SupplierReferralFeeDetails(models.Model):
     def __str__(self):
         return f"{self.supplier} - {self.departments} - {self.services_code}"
 
+
+
+class SMSMessage(models.Model):
+    """Outbound SMS queued for background delivery"""
+
+    class Status(models.TextChoices):
+        PENDING = 'PE', _('Pending')
+        SENDING = 'SE', _('Sending')
+        SENT = 'SN', _('Sent')
+        DELIVERED = 'DL', _('Delivered')
+        FAILED = 'FA', _('Failed')
+
+    # Recipient
+    supplier = models.ForeignKey(
+        'SupplierRegistration',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sms_messages',
+        verbose_name="Supplier",
+    )
+    recipient_name = models.CharField(
+        max_length=200,
+        blank=True,
+        default="",
+        verbose_name="Recipient Name",
+    )
+    phone = models.CharField(
+        max_length=17,
+        verbose_name="Phone Number",
+    )
+    body = models.TextField(verbose_name="Message")
+
+    # Delivery
+    gateway = models.CharField(
+        max_length=50,
+        default='default',
+        verbose_name="Gateway",
+    )
+    status = models.CharField(
+        max_length=2,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name="Status",
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name="Attempts")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Next Attempt At")
+    claim_token = models.CharField(max_length=32, blank=True, default="", editable=False)
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    provider_message_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default="",
+        db_index=True,
+        verbose_name="Provider Message ID",
+    )
+    last_error = models.TextField(blank=True, default="", verbose_name="Last Error")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Sent At")
+    delivered_at = models.DateTimeField(null=True, blank=True, verbose_name="Delivered At")
+
+    # Audit Fields
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sms_messages_created',
+        verbose_name="Created By",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
+
+    class Meta:
+        db_table = 'sms_message'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['gateway', 'status', 'next_attempt_at']),
+            models.Index(fields=['claim_token']),
+        ]
+        verbose_name = "SMS Message"
+        verbose_name_plural = "SMS Messages"
+
+    def __str__(self):
+        return f"{self.phone} - {self.get_status_display()}"
+
+
+class SequenceCounter(models.Model):
+    """Last number issued for one numbering scope (see setup/sequences.py)"""
+    key = models.CharField(max_length=150, unique=True)
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_counters'
+    )
+    location = models.ForeignKey(
+        CompanyLocation,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_counters'
+    )
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_counters'
+    )
+    supplier = models.ForeignKey(
+        'SupplierRegistration',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_counters'
+    )
+    day = models.DateField(null=True, blank=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'sequence_counter'
+        verbose_name = _('Sequence Counter')
+        verbose_name_plural = _('Sequence Counters')
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f"{self.key} = {self.last_value}"
+
+
+class SequenceCounterArchive(models.Model):
+    """Monthly summary of compacted daily sequence counters"""
+    scope_key = models.CharField(max_length=150)
+    month = models.DateField(help_text=_('First day of the month'))
+    company = models.ForeignKey(
+        Company,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_archives'
+    )
+    location = models.ForeignKey(
+        CompanyLocation,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_archives'
+    )
+    department = models.ForeignKey(
+        Department,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_archives'
+    )
+    supplier = models.ForeignKey(
+        'SupplierRegistration',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='sequence_archives'
+    )
+    days = models.PositiveIntegerField(default=0)
+    total_issued = models.PositiveBigIntegerField(default=0)
+    max_daily = models.PositiveBigIntegerField(default=0)
+    first_day = models.DateField()
+    last_day = models.DateField()
+
+    class Meta:
+        db_table = 'sequence_counter_archive'
+        ordering = ['scope_key', 'month']
+        unique_together = ('scope_key', 'month')
+        verbose_name = _('Sequence Counter Archive')
+        verbose_name_plural = _('Sequence Counter Archives')
+
+    def __str__(self):
+        return f"{self.scope_key} {self.month:%Y-%m}: {self.total_issued}"
+
+
+class AuditEntryQuerySet(models.QuerySet):
+    def for_object(self, obj):
+        """History of one object, newest first"""
+        return self.filter(
+            content_type=ContentType.objects.get_for_model(obj, for_concrete_model=False),
+            object_id=obj.pk,
+        ).order_by('-timestamp', '-id')
+
+    def for_model(self, model):
+        return self.filter(content_type=ContentType.objects.get_for_model(model, for_concrete_model=False))
+
+    def by_user(self, user):
+        """Changes made by one user, newest first"""
+        return self.filter(user=user).order_by('-timestamp', '-id')
+
+
+class AuditEntry(models.Model):
+    """One row per save of an audited model with a JSON diff of changed fields"""
+
+    class Action(models.TextChoices):
+        CREATE = 'create', _('Create')
+        UPDATE = 'update', _('Update')
+        DELETE = 'delete', _('Delete')
+        M2M = 'm2m', _('Membership change')
+
+    content_type = models.ForeignKey(
+        ContentType,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name=_('Model')
+    )
+    object_id = models.BigIntegerField(_('Object ID'))
+    object_repr = models.CharField(_('Object'), max_length=200)
+    action = models.CharField(_('Action'), max_length=10, choices=Action.choices)
+    # {"field": [old, new], ...}, or {"field": {"added": [ids], "removed": [ids]}} for M2M
+    changes = models.JSONField(_('Changes'), default=dict, encoder=DjangoJSONEncoder)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='audit_entries'
+    )
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = AuditEntryQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'audit_entry'
+        ordering = ['-timestamp', '-id']
+        indexes = [
+            models.Index(fields=['content_type', 'object_id', 'timestamp']),
+            models.Index(fields=['user', 'timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
+        verbose_name = _('Audit Entry')
+        verbose_name_plural = _('Audit Entries')
+
+    def __str__(self):
+        return f"{self.object_repr} - {self.action} by {self.user} at {self.timestamp}"
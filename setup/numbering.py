@@ -0,0 +1,163 @@
+# numbering.py
+"""
+Invoice number format templates (``Department.modify_invoice_number``).
+
+A pattern mixes literal text with tokens::
+
+    OPD-{YYYY}{MM}{DD}-{SEQ:5}    ->  OPD-20261019-00042
+    {LOC}/{DEPT}/{YY}/{SEQ}       ->  COL01/OPD/26/42
+
+Tokens: ``{YYYY}`` ``{YY}`` ``{MM}`` ``{DD}`` (document date), ``{LOC}``
+(location code), ``{DEPT}`` (department code) and ``{SEQ}`` or ``{SEQ:n}``
+(sequence number zero-padded to ``n`` digits). ``{{`` and ``}}`` are
+literal braces. A pattern without any token is a plain prefix and gets
+``{SEQ}`` appended.
+
+Patterns are parsed once; identical patterns share one ``NumberFormat``.
+"""
+import re
+import threading
+from functools import lru_cache
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+TOKEN_RE = re.compile(r'\{\{|\}\}|\{([A-Z]+)(?::(\d+))?\}|[{}]')
+
+DATE_TOKENS = {
+    'YYYY': '%Y',
+    'YY': '%y',
+    'MM': '%m',
+    'DD': '%d',
+}
+CONTEXT_TOKENS = {'LOC', 'DEPT'}
+MAX_PADDING = 20
+
+
+class NumberFormat:
+    """A compiled pattern"""
+
+    def __init__(self, pattern, head, padding, tail):
+        self.pattern = pattern
+        # head/tail are tuples of literal strings and ('date', fmt) / ('ctx', name) parts
+        self.head = head
+        self.padding = padding
+        self.tail = tail
+
+    def __repr__(self):
+        return f"<NumberFormat {self.pattern!r}>"
+
+    @staticmethod
+    def _render(parts, on, context):
+        out = []
+        for part in parts:
+            if isinstance(part, str):
+                out.append(part)
+            elif part[0] == 'date':
+                out.append(on.strftime(part[1]))
+            else:
+                out.append(context.get(part[1], ''))
+        return ''.join(out)
+
+    def affixes(self, on=None, location_code='', department_code=''):
+        """Render the parts around the sequence number once"""
+        on = on or timezone.localdate()
+        context = {'LOC': location_code or '', 'DEPT': department_code or ''}
+        return self._render(self.head, on, context), self._render(self.tail, on, context)
+
+    def format(self, number, on=None, location_code='', department_code=''):
+        prefix, suffix = self.affixes(on, location_code, department_code)
+        return f"{prefix}{number:0{self.padding}d}{suffix}"
+
+    def format_many(self, numbers, on=None, location_code='', department_code=''):
+        """Format many numbers that share a date and location"""
+        prefix, suffix = self.affixes(on, location_code, department_code)
+        padding = self.padding
+        return [f"{prefix}{number:0{padding}d}{suffix}" for number in numbers]
+
+
+def _parse(pattern):
+    head, tail = [], []
+    current = head
+    literal = []
+    padding = None
+
+    def flush():
+        if literal:
+            current.append(''.join(literal))
+            literal.clear()
+
+    position = 0
+    for match in TOKEN_RE.finditer(pattern):
+        literal.append(pattern[position:match.start()])
+        position = match.end()
+        text = match.group(0)
+        if text in ('{{', '}}'):
+            literal.append(text[0])
+            continue
+        name, width = match.group(1), match.group(2)
+        if name is None:
+            raise ValidationError(_('Unbalanced brace in invoice number format.'))
+        if name == 'SEQ':
+            if padding is not None:
+                raise ValidationError(_('Invoice number format may contain {SEQ} only once.'))
+            padding = int(width) if width else 1
+            if not 1 <= padding <= MAX_PADDING:
+                raise ValidationError(_('Sequence padding must be between 1 and %(max)d.'),
+                                      params={'max': MAX_PADDING})
+            flush()
+            current = tail
+            continue
+        if width:
+            raise ValidationError(_('Only {SEQ} accepts a width.'))
+        flush()
+        if name in DATE_TOKENS:
+            current.append(('date', DATE_TOKENS[name]))
+        elif name in CONTEXT_TOKENS:
+            current.append(('ctx', name))
+        else:
+            raise ValidationError(_('Unknown token {%(token)s} in invoice number format.'),
+                                  params={'token': name})
+    literal.append(pattern[position:])
+    flush()
+
+    if padding is None:
+        if tail or any(not isinstance(part, str) for part in head):
+            raise ValidationError(_('Invoice number format must contain {SEQ}.'))
+        padding = 1
+    return head, padding, tail
+
+
+@lru_cache(maxsize=512)
+def compile_format(pattern):
+    """Parse ``pattern`` once; raises ``ValidationError`` if it is invalid"""
+    head, padding, tail = _parse(pattern or '')
+    return NumberFormat(pattern or '', tuple(head), padding, tuple(tail))
+
+
+def validate_number_format(pattern):
+    if pattern:
+        compile_format(pattern)
+
+
+_department_formats = {}
+_department_lock = threading.Lock()
+
+
+def department_format(department):
+    """The compiled format for ``department``, cached by department id"""
+    pattern = department.modify_invoice_number or ''
+    cached = _department_formats.get(department.pk)
+    if cached is not None and cached.pattern == pattern:
+        return cached
+    number_format = compile_format(pattern)
+    with _department_lock:
+        _department_formats[department.pk] = number_format
+    return number_format
+
+
+def invalidate_department(department_id):
+    """Drop the cached format after ``modify_invoice_number`` changed"""
+    with _department_lock:
+        _department_formats.pop(department_id, None)
@@ -0,0 +1,71 @@
+# pagination.py
+"""
+Keyset ("seek") pagination helpers.
+
+Instead of ``OFFSET n`` a page is fetched with ``WHERE (key) < (cursor)``
+on an indexed ordering, so every page costs the same however deep it is.
+Cursors are opaque url-safe strings holding the sort key of the last row.
+Datetimes keep their microseconds: a cursor that rounds the key no longer
+matches the stored value and silently skips rows.
+"""
+import base64
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """``DjangoJSONEncoder`` without its truncation of times to milliseconds"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the cursor values as a list, or ``None`` for a missing/invalid cursor"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, UnicodeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def decode_timestamp_cursor(cursor):
+    """A ``(timestamp, id)`` cursor as ``(datetime, int)``, or ``None`` if it is missing or invalid"""
+    values = decode_cursor(cursor)
+    if not values or len(values) != 2:
+        return None
+    timestamp, pk = values
+    try:
+        timestamp = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+    except ValueError:
+        return None
+    if timestamp is None or type(pk) is not int:
+        return None
+    return timestamp, pk
+
+
+def keyset_page(queryset, limit, cursor_values):
+    """
+    Evaluate one page of an already filtered and ordered ``queryset``.
+
+    ``cursor_values(row)`` returns the sort key of a row. Returns
+    ``(rows, next_cursor)``; ``next_cursor`` is ``None`` on the last page.
+    """
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*cursor_values(rows[-1]))
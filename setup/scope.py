@@ -0,0 +1,165 @@
+# scope.py
+"""
+Which companies and locations a user may act on.
+
+``UserCompany`` grants a company and all of its locations;
+``UserLocation`` grants a single location (and read access to its
+company). Superusers are unrestricted. A user's scope is loaded with two
+queries, cached under a per-user version that is bumped (through the
+invalidation bus) whenever one of their ``UserCompany``/``UserLocation``
+rows changes, and exposed on every request as ``request.scope`` by
+``ScopeMiddleware``.
+
+``scope_filter()`` applies the same rules inside SQL, as subqueries on the
+``(user, ...)`` unique indexes of the two grant tables, for querysets that
+are too large to filter against a list of ids (admin changelists).
+"""
+from dataclasses import dataclass
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import bus, caching
+from .models import UserCompany, UserLocation
+
+SCOPE_CACHE_TIMEOUT = 60 * 60
+
+
+def scope_version_name(user_id):
+    return f'user-scope:{user_id}'
+
+
+@dataclass(frozen=True)
+class UserScope:
+    user_id: int = None
+    company_ids: frozenset = frozenset()
+    location_ids: frozenset = frozenset()
+    # Companies granted as a whole through UserCompany
+    full_company_ids: frozenset = frozenset()
+    unrestricted: bool = False
+
+    def has_company(self, company):
+        return self.unrestricted or getattr(company, 'pk', company) in self.company_ids
+
+    def has_location(self, location):
+        """``location`` is an instance or pk; only instances can match a whole-company grant"""
+        if self.unrestricted or getattr(location, 'pk', location) in self.location_ids:
+            return True
+        return getattr(location, 'company_id', None) in self.full_company_ids
+
+    def filter_companies(self, queryset, field='pk'):
+        """Limit ``queryset`` to rows whose ``field`` is an allowed company id"""
+        if self.unrestricted:
+            return queryset
+        return queryset.filter(**{f'{field}__in': self.company_ids})
+
+    def filter_locations(self, queryset, field='pk'):
+        """Limit ``queryset`` to rows whose ``field`` is an allowed location id"""
+        if self.unrestricted:
+            return queryset
+        company_field = f'{field}__company' if field != 'pk' else 'company'
+        return queryset.filter(
+            Q(**{f'{field}__in': self.location_ids}) | Q(**{f'{company_field}__in': self.full_company_ids})
+        )
+
+    def filter_queryset(self, queryset, company_field='company', location_field=None):
+        queryset = self.filter_companies(queryset, company_field)
+        if location_field:
+            queryset = self.filter_locations(queryset, location_field)
+        return queryset
+
+
+EMPTY_SCOPE = UserScope()
+
+
+def load_user_scope(user_id):
+    full_company_ids = frozenset(UserCompany.objects.filter(user_id=user_id).values_list('company_id', flat=True))
+    company_ids = set(full_company_ids)
+    location_ids = set()
+    for company_id, location_id in UserLocation.objects.filter(user_id=user_id).values_list('company_id', 'location_id'):
+        company_ids.add(company_id)
+        location_ids.add(location_id)
+    return UserScope(user_id, frozenset(company_ids), frozenset(location_ids), full_company_ids)
+
+
+def get_user_scope(user):
+    """The cached scope of ``user``"""
+    if user is None or not user.is_authenticated or not user.is_active:
+        return EMPTY_SCOPE
+    if user.is_superuser:
+        return UserScope(user.pk, unrestricted=True)
+    key = caching.versioned_key('scope', scope_version_name(user.pk), user.pk)
+    scope = cache.get(key)
+    if scope is None:
+        scope = load_user_scope(user.pk)
+        cache.set(key, scope, SCOPE_CACHE_TIMEOUT)
+    return scope
+
+
+def invalidate_user_scope(user_id):
+    caching.bump_version(scope_version_name(user_id))
+
+
+@bus.subscribe(bus.USER_SCOPE)
+def _invalidate_scopes(user_ids):
+    for user_id in user_ids:
+        invalidate_user_scope(user_id)
+
+
+def _is_multivalued(model, path):
+    """Whether the lookup ``path`` from ``model`` crosses a to-many relation"""
+    for name in path.split('__'):
+        if name == 'pk':
+            return False
+        field = model._meta.get_field(name)
+        if field.many_to_many or field.one_to_many:
+            return True
+        model = field.related_model
+    return False
+
+
+def _in(model, path, subquery):
+    if _is_multivalued(model, path):
+        # Keep one row per object instead of one per matching relation
+        return Q(pk__in=model._default_manager.filter(**{f'{path}__in': subquery}).values('pk'))
+    return Q(**{f'{path}__in': subquery})
+
+
+def scope_q(model, user, company_field=None, location_field=None):
+    """
+    ``Q`` limiting ``model`` rows to the grants of ``user``.
+
+    ``company_field`` is the lookup path from ``model`` to a company
+    (``'pk'`` for ``Company`` itself) and ``location_field`` the path to a
+    location. Rows with a location are visible through a grant on that
+    location or on its whole company; rows without one through any grant
+    on their company. Rows reaching companies through a to-many relation
+    that links them to none yet (a class detail without departments, say)
+    are visible too, as rows without a location are.
+    """
+    full_companies = UserCompany.objects.filter(user=user).values('company_id')
+    granted_locations = UserLocation.objects.filter(user=user)
+    q = Q()
+    if company_field:
+        company_q = (_in(model, company_field, full_companies)
+                     | _in(model, company_field, granted_locations.values('company_id')))
+        if _is_multivalued(model, company_field):
+            company_q |= ~Q(pk__in=model._default_manager.filter(**{f'{company_field}__isnull': False}).values('pk'))
+        q &= company_q
+    if location_field:
+        location_company = 'company' if location_field == 'pk' else f'{location_field}__company'
+        location_q = (_in(model, location_field, granted_locations.values('location_id'))
+                      | _in(model, location_company, full_companies))
+        if location_field != 'pk' and model._meta.get_field(location_field.split('__')[0]).null:
+            location_q |= Q(**{f'{location_field}__isnull': True})
+        q &= location_q
+    return q
+
+
+def scope_filter(queryset, user, company_field=None, location_field=None):
+    """Limit ``queryset`` to what ``user`` may see; superusers see everything"""
+    if user.is_superuser or not (company_field or location_field):
+        return queryset
+    if not user.is_active:
+        return queryset.none()
+    return queryset.filter(scope_q(queryset.model, user, company_field, location_field))
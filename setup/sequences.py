@@ -0,0 +1,348 @@
+# sequences.py
+"""
+Sequence number allocation.
+
+Every numbering scope (company, location, department, supplier, day) owns one
+``SequenceCounter`` row. A number is issued with a single upsert::
+
+    INSERT ... ON CONFLICT (key) DO UPDATE SET last_value = last_value + n
+    RETURNING last_value
+
+so the counter row is created lazily, the increment is atomic and the
+write lock is held for one statement only. There is never a
+``MAX() + 1`` over issued documents.
+
+Daily scopes get a new counter row on the first allocation of each day,
+so "today's next number" never looks at earlier days. Old day rows are
+folded into ``SequenceCounterArchive`` by ``manage.py compact_sequences``;
+allocations older than ``SEQUENCE_DAILY_RETENTION_DAYS`` are refused so a
+compacted day can never restart at 1.
+
+Very busy departments can reserve a block of numbers per worker process
+(``Department.sequence_block_size``). Numbers stay unique, but a worker
+that exits leaves the rest of its block unused, and numbers from
+different workers interleave. A block size of 1 is strict, gap-free mode.
+A block is reserved inside the caller's transaction and only shared with
+later callers once that transaction commits; if it rolls back, the
+reservation and the block are discarded together.
+"""
+import threading
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import numbering
+from .models import SequenceCounter, SequenceCounterArchive
+
+
+@dataclass(frozen=True)
+class SequenceScope:
+    """Identifies one counter. Unused parts are left as ``None``."""
+    company_id: int = None
+    location_id: int = None
+    department_id: int = None
+    supplier_id: int = None
+    day: date = None
+    namespace: str = 'dept'
+
+    @property
+    def key(self):
+        return ':'.join([
+            self.namespace,
+            str(self.company_id or '-'),
+            str(self.location_id or '-'),
+            str(self.department_id or '-'),
+            str(self.supplier_id or '-'),
+            self.day.strftime('%Y%m%d') if self.day else '-',
+        ])
+
+
+def retention_days():
+    return getattr(settings, 'SEQUENCE_DAILY_RETENTION_DAYS', 7)
+
+
+def daily_cutoff(today=None):
+    """Day counters before this date may be compacted"""
+    return (today or timezone.localdate()) - timedelta(days=retention_days())
+
+
+def sequence_day(on=None):
+    """The counter day for a document dated ``on`` (default today)"""
+    day = on or timezone.localdate()
+    if day < daily_cutoff():
+        raise ValueError(f'Cannot issue daily sequence numbers for {day}; '
+                         f'counters older than {retention_days()} days are archived')
+    return day
+
+
+def _upsert_sql():
+    table = connection.ops.quote_name(SequenceCounter._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(column) for column in (
+        'key', 'company_id', 'location_id', 'department_id', 'supplier_id', 'day',
+        'last_value', 'updated_at',
+    ))
+    key = connection.ops.quote_name('key')
+    last_value = connection.ops.quote_name('last_value')
+    updated_at = connection.ops.quote_name('updated_at')
+    return (
+        f"INSERT INTO {table} ({columns}) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+        f"ON CONFLICT ({key}) DO UPDATE SET "
+        f"{last_value} = {table}.{last_value} + excluded.{last_value}, "
+        f"{updated_at} = excluded.{updated_at} "
+        f"RETURNING {last_value}"
+    )
+
+
+def allocate(scope, count=1):
+    """
+    Reserve ``count`` consecutive numbers for ``scope``.
+
+    Returns the last number of the reserved range, i.e. the range is
+    ``result - count + 1 .. result``.
+    """
+    if count < 1:
+        raise ValueError('count must be at least 1')
+    now = timezone.now()
+
+    if connection.vendor in ('sqlite', 'postgresql'):
+        params = [
+            scope.key,
+            scope.company_id,
+            scope.location_id,
+            scope.department_id,
+            scope.supplier_id,
+            connection.ops.adapt_datefield_value(scope.day),
+            count,
+            connection.ops.adapt_datetimefield_value(now),
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql(), params)
+            return cursor.fetchone()[0]
+
+    # Backends without INSERT ... ON CONFLICT ... RETURNING
+    with transaction.atomic():
+        counter, _ = SequenceCounter.objects.select_for_update().get_or_create(
+            key=scope.key,
+            defaults={
+                'company_id': scope.company_id,
+                'location_id': scope.location_id,
+                'department_id': scope.department_id,
+                'supplier_id': scope.supplier_id,
+                'day': scope.day,
+            },
+        )
+        SequenceCounter.objects.filter(pk=counter.pk).update(last_value=F('last_value') + count)
+        counter.refresh_from_db(fields=['last_value'])
+        return counter.last_value
+
+
+def current_value(scope):
+    """Last number issued for ``scope`` (0 if none yet)"""
+    return (
+        SequenceCounter.objects.filter(key=scope.key).values_list('last_value', flat=True).first()
+        or 0
+    )
+
+
+class BlockAllocator:
+    """Hands out numbers from blocks reserved once per worker process"""
+
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def next_value(self, scope, block_size):
+        with self._lock:
+            next_value, last_value = self._blocks.get(scope.key, (1, 0))
+            if next_value <= last_value:
+                self._blocks[scope.key] = (next_value + 1, last_value)
+                return next_value
+        last_value = allocate(scope, block_size)
+        next_value = last_value - block_size + 1
+        # A rollback would hand the range out again, so keep the rest of the
+        # block to ourselves until the reservation has committed
+        transaction.on_commit(lambda: self._adopt(scope.key, next_value + 1, last_value))
+        return next_value
+
+    def _adopt(self, key, next_value, last_value):
+        with self._lock:
+            current_next, current_last = self._blocks.get(key, (1, 0))
+            if current_next > current_last:
+                self._blocks[key] = (next_value, last_value)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+block_allocator = BlockAllocator()
+
+
+def next_value(scope, block_size=1):
+    """Issue the next number for ``scope``"""
+    if block_size > 1:
+        return block_allocator.next_value(scope, block_size)
+    return allocate(scope)
+
+
+def department_scope(department, location=None, on=None):
+    """Build the counter scope from the department's sequence options"""
+    return SequenceScope(
+        company_id=department.company_id,
+        location_id=getattr(location, 'pk', location),
+        department_id=department.pk if department.department_wise_sequence else None,
+        day=sequence_day(on) if department.department_sequence_per_day else None,
+    )
+
+
+def next_department_number(department, location=None, on=None):
+    """
+    Issue the next sequence number for a document raised in ``department``.
+
+    Returns ``None`` when the department does not issue sequence numbers
+    automatically (``issue_sequence_number``/``issue_sequence_auto`` off).
+    """
+    if not (department.issue_sequence_number and department.issue_sequence_auto):
+        return None
+    return next_value(
+        department_scope(department, location, on),
+        block_size=department.sequence_block_size,
+    )
+
+
+def department_invoice_numbers(department, count=1, location=None, on=None):
+    """
+    Issue ``count`` numbers for ``department`` formatted with its
+    ``modify_invoice_number`` pattern.
+    """
+    on = on or timezone.localdate()
+    scope = department_scope(department, location, on)
+    if count == 1:
+        numbers = [next_value(scope, block_size=department.sequence_block_size)]
+    else:
+        last = allocate(scope, count)
+        numbers = range(last - count + 1, last + 1)
+    return numbering.department_format(department).format_many(
+        numbers,
+        on=on,
+        location_code=getattr(location, 'code', ''),
+        department_code=department.Code,
+    )
+
+
+def next_department_invoice_number(department, location=None, on=None):
+    """Issue the next formatted invoice number for ``department``"""
+    return department_invoice_numbers(department, 1, location, on)[0]
+
+
+INVOICE_NUMBER_WIDTH = 6
+DAILY_INVOICE_NUMBER_WIDTH = 4
+
+
+def supplier_invoice_scope(supplier, department=None, on=None):
+    """
+    Build the invoice counter scope from the supplier's invoice settings.
+
+    * ``inv_no_sup_wise`` - numbers run per supplier
+    * ``dep_wise_sequence_no_yes`` - numbers run per department and restart daily
+    * neither - one company-wide sequence
+    """
+    per_day = supplier.dep_wise_sequence_no_yes
+    return SequenceScope(
+        namespace='inv',
+        company_id=supplier.company_id,
+        supplier_id=supplier.pk if supplier.inv_no_sup_wise else None,
+        department_id=(getattr(department, 'pk', department) or supplier.departments_id) if per_day else None,
+        day=sequence_day(on) if per_day else None,
+    )
+
+
+def format_supplier_invoice_number(supplier, number, day=None):
+    """``invoice_code`` + padded number; daily sequences include the date"""
+    if day:
+        return f"{supplier.invoice_code}{day:%y%m%d}{number:0{DAILY_INVOICE_NUMBER_WIDTH}d}"
+    return f"{supplier.invoice_code}{number:0{INVOICE_NUMBER_WIDTH}d}"
+
+
+def supplier_invoice_numbers(supplier, count=1, department=None, on=None):
+    """Reserve ``count`` consecutive invoice numbers with one counter update"""
+    scope = supplier_invoice_scope(supplier, department, on)
+    last = allocate(scope, count)
+    return [
+        format_supplier_invoice_number(supplier, number, scope.day)
+        for number in range(last - count + 1, last + 1)
+    ]
+
+
+def next_supplier_invoice_number(supplier, department=None, on=None):
+    """Issue the next formatted invoice number for ``supplier``"""
+    return supplier_invoice_numbers(supplier, 1, department, on)[0]
+
+
+def compact_daily_counters(before=None, batch_size=1000):
+    """
+    Fold day counters older than ``before`` into monthly archive rows and
+    delete them. Returns ``(counters_folded, archive_rows_touched)``.
+    """
+    before = before or daily_cutoff()
+    folded = touched = 0
+    while True:
+        with transaction.atomic():
+            counters = list(
+                SequenceCounter.objects
+                .filter(day__isnull=False, day__lt=before)
+                .order_by('pk')[:batch_size]
+            )
+            if not counters:
+                return folded, touched
+
+            summaries = {}
+            for counter in counters:
+                scope_key = counter.key.rsplit(':', 1)[0]
+                month = counter.day.replace(day=1)
+                summary = summaries.get((scope_key, month))
+                if summary is None:
+                    summary = summaries[(scope_key, month)] = SequenceCounterArchive(
+                        scope_key=scope_key,
+                        month=month,
+                        company_id=counter.company_id,
+                        location_id=counter.location_id,
+                        department_id=counter.department_id,
+                        supplier_id=counter.supplier_id,
+                        first_day=counter.day,
+                        last_day=counter.day,
+                    )
+                summary.days += 1
+                summary.total_issued += counter.last_value
+                summary.max_daily = max(summary.max_daily, counter.last_value)
+                summary.first_day = min(summary.first_day, counter.day)
+                summary.last_day = max(summary.last_day, counter.day)
+
+            existing = SequenceCounterArchive.objects.filter(
+                scope_key__in={key for key, _ in summaries},
+                month__in={month for _, month in summaries},
+            )
+            to_update = []
+            for archive in existing:
+                summary = summaries.pop((archive.scope_key, archive.month), None)
+                if summary is None:
+                    continue
+                archive.days += summary.days
+                archive.total_issued += summary.total_issued
+                archive.max_daily = max(archive.max_daily, summary.max_daily)
+                archive.first_day = min(archive.first_day, summary.first_day)
+                archive.last_day = max(archive.last_day, summary.last_day)
+                to_update.append(archive)
+
+            SequenceCounterArchive.objects.bulk_update(
+                to_update, ['days', 'total_issued', 'max_daily', 'first_day', 'last_day'],
+            )
+            SequenceCounterArchive.objects.bulk_create(summaries.values())
+            SequenceCounter.objects.filter(pk__in=[counter.pk for counter in counters]).delete()
+
+        folded += len(counters)
+        touched += len(to_update) + len(summaries)
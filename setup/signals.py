@@ -0,0 +1,222 @@
+# signals.py
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import access, audit, bus
+from .models import (
+    AuditEntry, ClassDetail, Company, CompanyLocation, Department, LaboratoryDepartment,
+    Service, ServiceTax, TaxCode, UserCompany, UserLocation,
+)
+
+# Membership changes that alter prices and taxes
+AUDITED_M2M_FIELDS = [
+    (Department, 'locations'),
+    (Service, 'locations'),
+    (Service, 'tax_code'),
+    (TaxCode, 'locations'),
+    (ServiceTax, 'locations'),
+    (ServiceTax, 'tax_code'),
+    (ClassDetail, 'departments'),
+]
+
+_audited_through = {
+    model._meta.get_field(name).remote_field.through: (model, model._meta.get_field(name))
+    for model, name in AUDITED_M2M_FIELDS
+}
+
+
+class M2MChangeSet:
+    """Net added/removed ids per (object, field) within one transaction"""
+
+    def __init__(self):
+        self.changes = {}
+
+    def add(self, model, pk, field_name, added=(), removed=(), instance=None):
+        key = (model, pk, field_name)
+        change = self.changes.get(key)
+        if change is None:
+            change = self.changes[key] = {
+                'added': set(), 'removed': set(), 'instance': instance, 'user_id': audit.acting_user_id(),
+            }
+        for target in added:
+            if target in change['removed']:
+                change['removed'].discard(target)
+            else:
+                change['added'].add(target)
+        for target in removed:
+            if target in change['added']:
+                change['added'].discard(target)
+            else:
+                change['removed'].add(target)
+
+    def entries(self):
+        for (model, pk, field_name), change in self.changes.items():
+            if not change['added'] and not change['removed']:
+                continue
+            instance = change['instance']
+            yield AuditEntry(
+                content_type=ContentType.objects.get_for_model(model),
+                object_id=pk,
+                object_repr=str(instance)[:200] if instance is not None else f'{model._meta.verbose_name} #{pk}',
+                action=AuditEntry.Action.M2M,
+                changes={field_name: {
+                    'added': sorted(change['added']),
+                    'removed': sorted(change['removed']),
+                }},
+                user_id=change['user_id'],
+            )
+
+
+@receiver(m2m_changed)
+def capture_m2m_changes(sender, instance, action, reverse, model, pk_set, using, **kwargs):
+    """Coalesce add/remove/clear on audited relations into one AuditEntry per relation at commit"""
+    if sender not in _audited_through or action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    owner, field = _audited_through[sender]
+
+    if action == 'pre_clear':
+        # The ids are gone after the clear, so read them now (one query)
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+        if reverse:
+            source, target = target, source
+        pk_set = set(
+            sender.objects.using(using)
+            .filter(**{f'{source}_id': instance.pk})
+            .values_list(f'{target}_id', flat=True)
+        )
+    if not pk_set:
+        return
+
+    changes = audit.collector('m2m', M2MChangeSet, using=using)
+    immediate = changes is None
+    if immediate:
+        changes = M2MChangeSet()
+
+    key = 'added' if action == 'post_add' else 'removed'
+    if reverse:
+        # e.g. location.departments.add(...): record on each owning object
+        for owner_pk in pk_set:
+            changes.add(owner, owner_pk, field.name, **{key: [instance.pk]})
+    else:
+        changes.add(owner, instance.pk, field.name, instance=instance, **{key: pk_set})
+
+    if immediate:
+        audit.record(*changes.entries(), using=using)
+
+
+@receiver(post_save, sender=UserCompany)
+@receiver(post_delete, sender=UserCompany)
+@receiver(post_save, sender=UserLocation)
+@receiver(post_delete, sender=UserLocation)
+def publish_user_scope(sender, instance, **kwargs):
+    # A grant moved to another user is revoked from the one it was loaded for
+    previous = getattr(instance, 'loaded_user_id', None)
+    bus.publish(bus.USER_SCOPE, *{instance.user_id, previous} - {None})
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_access(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    access.invalidate_user_permissions(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            access.invalidate_user_permissions(instance.pk)
+        return
+    if action == 'pre_clear':
+        # A permission or group is being removed from all of its users
+        user_ids = sender.objects.filter(**{instance._meta.model_name: instance}).values_list('user_id', flat=True)
+    elif action in ('post_add', 'post_remove'):
+        user_ids = pk_set
+    else:
+        return
+    for user_id in user_ids:
+        access.invalidate_user_permissions(user_id)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+@receiver(post_delete, sender=Permission)
+@receiver(post_delete, sender=Group)
+def invalidate_all_permissions(sender, action=None, **kwargs):
+    if action is None or action in ('post_add', 'post_remove', 'post_clear'):
+        access.invalidate_all_permissions()
+
+
+@receiver(post_migrate)
+def invalidate_permissions_after_migrate(sender, **kwargs):
+    # Permissions are bulk created by migrate, without post_save
+    access.invalidate_all_permissions()
+
+
+@receiver(user_logged_in)
+def warm_user_access(sender, request, user, **kwargs):
+    access.get_user_access(user, rebuild=True)
+
+
+# Rows listed in a company's catalog (see hierarchy.SECTIONS)
+CATALOG_MODELS = [CompanyLocation, Department, LaboratoryDepartment, Service, TaxCode]
+
+# Fields the per-process location indexes are built from
+LOCATION_TOPIC_FIELDS = [
+    (bus.LOCATION_STATUS, {'status'}),
+    (bus.LOCATION_POSITION, {'latitude', 'longitude', 'company_id'}),
+    (bus.LOCATION_HOURS, {'operating_intervals'}),
+]
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def publish_company(sender, instance, **kwargs):
+    bus.publish(bus.COMPANY, instance.pk)
+
+
+def publish_catalog_row(sender, instance, **kwargs):
+    bus.publish(bus.CATALOG, instance.company_id)
+
+
+def publish_catalog_links(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        bus.publish(bus.CATALOG, instance.company_id)
+        return
+    # instance is the location or tax code; model holds the many-to-many field
+    if action == 'pre_clear':
+        field = next(f for f in model._meta.many_to_many if f.remote_field.through is sender)
+        owners = model._default_manager.filter(**{field.name: instance})
+    else:
+        owners = model._default_manager.filter(pk__in=pk_set)
+    bus.publish(bus.CATALOG, *set(owners.values_list('company_id', flat=True)))
+
+
+for _model in CATALOG_MODELS:
+    post_save.connect(publish_catalog_row, sender=_model, dispatch_uid=f'catalog-{_model.__name__}-save')
+    post_delete.connect(publish_catalog_row, sender=_model, dispatch_uid=f'catalog-{_model.__name__}-delete')
+    for _field in _model._meta.many_to_many:
+        m2m_changed.connect(publish_catalog_links, sender=_field.remote_field.through,
+                            dispatch_uid=f'catalog-{_model.__name__}-{_field.name}')
+
+
+@receiver(post_save, sender=CompanyLocation)
+def publish_location_saved(sender, instance, created, **kwargs):
+    """A status flip (e.g. to inactive) drops the location from every index at once"""
+    bus.publish(bus.LOCATION, instance.pk)
+    changed = None if created else instance.changed_fields()
+    for topic, fields in LOCATION_TOPIC_FIELDS:
+        if changed is None or changed & fields:
+            bus.publish(topic, instance.pk)
+
+
+@receiver(post_delete, sender=CompanyLocation)
+def publish_location_deleted(sender, instance, **kwargs):
+    bus.publish(bus.LOCATION, instance.pk)
+    bus.publish(bus.LOCATION_STATUS, instance.pk)
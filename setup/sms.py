@@ -0,0 +1,323 @@
+# sms.py
+"""
+Outbound SMS queue for supplier notifications.
+
+Web requests only queue ``SMSMessage`` rows (one ``bulk_create`` per call).
+Delivery happens in batches from a background worker, either the
+``send_sms`` management command or an in-process ``SMSWorker`` thread.
+
+Gateways are configured in ``settings.SMS_GATEWAYS``::
+
+    SMS_GATEWAYS = {
+        'default': {
+            'BACKEND': 'setup.sms.FileGateway',
+            'OPTIONS': {'path': BASE_DIR / 'sms_outbox.log'},
+            'RATE_LIMIT': 10,      # messages per second
+            'BATCH_SIZE': 50,
+            'MAX_ATTEMPTS': 5,
+        },
+    }
+
+Every gateway needs a ``BACKEND``; there is no fallback, so a missing
+``'default'`` entry is reported by the ``setup.E002`` system check instead
+of silently keeping messages in memory. Tests configure
+``setup.sms.LocMemGateway`` with ``override_settings``.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import SMSMessage
+
+logger = logging.getLogger(__name__)
+
+# Settings a gateway may leave out; BACKEND is required
+GATEWAY_DEFAULTS = {
+    'OPTIONS': {},
+    'RATE_LIMIT': 10,
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+}
+
+# Messages stuck in SENDING longer than this are assumed to belong to a dead worker
+STALE_CLAIM_AFTER = timedelta(minutes=10)
+RETRY_BASE_DELAY = 30  # seconds, doubled on every attempt
+RETRY_MAX_DELAY = 60 * 60
+
+
+@dataclass
+class SendResult:
+    """Outcome of handing one message to a gateway"""
+    message_id: int
+    ok: bool
+    provider_message_id: str = ''
+    error: str = ''
+
+
+class BaseGateway:
+    """Interface every SMS gateway implements"""
+
+    def __init__(self, **options):
+        self.options = options
+
+    def send_batch(self, messages):
+        """Send ``messages`` and return one ``SendResult`` per message"""
+        raise NotImplementedError('SMS gateways must implement send_batch()')
+
+
+class LocMemGateway(BaseGateway):
+    """Keeps sent messages in ``LocMemGateway.outbox``; used for testing"""
+    outbox = []
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            self.outbox.append({'phone': message.phone, 'body': message.body})
+            results.append(SendResult(message.pk, True, f'locmem-{message.pk}'))
+        return results
+
+
+class FileGateway(BaseGateway):
+    """Appends each message as a JSON line to ``OPTIONS['path']``"""
+
+    def send_batch(self, messages):
+        lines = [
+            json.dumps({
+                'id': message.pk,
+                'phone': message.phone,
+                'name': message.recipient_name,
+                'body': message.body,
+                'sent_at': timezone.now().isoformat(),
+            })
+            for message in messages
+        ]
+        with open(self.options['path'], 'a', encoding='utf-8') as outbox:
+            outbox.write('\n'.join(lines) + '\n')
+        return [SendResult(message.pk, True, f'file-{message.pk}') for message in messages]
+
+
+class RateLimiter:
+    """Token bucket shared by every worker thread using the same gateway"""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, count=1):
+        """Block until ``count`` messages may be sent"""
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+
+def gateway_config(name):
+    configured = getattr(settings, 'SMS_GATEWAYS', {})
+    if name not in configured:
+        raise ImproperlyConfigured(f"SMS gateway '{name}' is not configured in SMS_GATEWAYS")
+    if not configured[name].get('BACKEND'):
+        raise ImproperlyConfigured(f"SMS gateway '{name}' has no BACKEND")
+    return {**GATEWAY_DEFAULTS, **configured[name]}
+
+
+def get_gateway(name='default'):
+    """Return ``(gateway, limiter, config)`` for ``name``, built once per process"""
+    with _gateways_lock:
+        if name not in _gateways:
+            config = gateway_config(name)
+            backend = import_string(config['BACKEND'])
+            _gateways[name] = (
+                backend(**config['OPTIONS']),
+                RateLimiter(config['RATE_LIMIT']),
+                config,
+            )
+        return _gateways[name]
+
+
+@receiver(setting_changed)
+def _reset_gateways(setting, **kwargs):
+    if setting == 'SMS_GATEWAYS':
+        with _gateways_lock:
+            _gateways.clear()
+
+
+def queue_sms(phone, body, recipient_name='', supplier=None, user=None, gateway='default'):
+    """Queue a single message"""
+    return SMSMessage.objects.create(
+        supplier=supplier,
+        recipient_name=recipient_name,
+        phone=phone,
+        body=body,
+        gateway=gateway,
+        created_by=user,
+    )
+
+
+def queue_supplier_sms(suppliers, body, user=None, gateway='default'):
+    """
+    Queue ``body`` for every supplier that has a phone number.
+
+    ``{name}`` in the body is replaced with the supplier's ``sms_name``
+    (falling back to ``sup_name``). Returns the queued messages.
+    """
+    messages = []
+    for supplier in suppliers:
+        phone = supplier.tel1 or supplier.tel2 or supplier.tele3
+        if not phone:
+            continue
+        name = supplier.sms_name or supplier.sup_name or ''
+        messages.append(SMSMessage(
+            supplier=supplier,
+            recipient_name=name,
+            phone=phone,
+            body=body.replace('{name}', name),
+            gateway=gateway,
+            created_by=user,
+        ))
+    return SMSMessage.objects.bulk_create(messages, batch_size=500)
+
+
+def record_delivery_report(provider_message_id, delivered, error=''):
+    """Update delivery status from a gateway delivery report"""
+    if delivered:
+        return SMSMessage.objects.filter(provider_message_id=provider_message_id).update(
+            status=SMSMessage.Status.DELIVERED,
+            delivered_at=timezone.now(),
+        )
+    return SMSMessage.objects.filter(provider_message_id=provider_message_id).update(
+        status=SMSMessage.Status.FAILED,
+        last_error=error,
+    )
+
+
+def release_stale_claims(now=None):
+    """Return messages claimed by a worker that died mid-batch to the queue"""
+    now = now or timezone.now()
+    return SMSMessage.objects.filter(
+        status=SMSMessage.Status.SENDING,
+        claimed_at__lt=now - STALE_CLAIM_AFTER,
+    ).update(status=SMSMessage.Status.PENDING, claim_token='', claimed_at=None)
+
+
+def claim_batch(gateway, size):
+    """Atomically mark up to ``size`` due messages as SENDING for this worker"""
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        due = (
+            SMSMessage.objects
+            .filter(gateway=gateway, status=SMSMessage.Status.PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:size]
+        )
+        SMSMessage.objects.filter(
+            pk__in=list(due),
+            status=SMSMessage.Status.PENDING,
+        ).update(
+            status=SMSMessage.Status.SENDING,
+            claim_token=token,
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+    return list(SMSMessage.objects.filter(claim_token=token, status=SMSMessage.Status.SENDING))
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY))
+
+
+def send_batch(gateway_name='default'):
+    """Claim and send one batch for ``gateway_name``. Returns the number of messages handled."""
+    gateway, limiter, config = get_gateway(gateway_name)
+    messages = claim_batch(gateway_name, config['BATCH_SIZE'])
+    if not messages:
+        return 0
+
+    limiter.acquire(len(messages))
+    try:
+        results = {result.message_id: result for result in gateway.send_batch(messages)}
+    except Exception as exc:
+        logger.exception('SMS gateway %s failed', gateway_name)
+        results = {message.pk: SendResult(message.pk, False, error=str(exc)) for message in messages}
+
+    now = timezone.now()
+    for message in messages:
+        result = results.get(message.pk) or SendResult(message.pk, False, error='No result from gateway')
+        message.claim_token = ''
+        message.claimed_at = None
+        if result.ok:
+            message.status = SMSMessage.Status.SENT
+            message.sent_at = now
+            message.provider_message_id = result.provider_message_id
+            message.last_error = ''
+        elif message.attempts >= config['MAX_ATTEMPTS']:
+            message.status = SMSMessage.Status.FAILED
+            message.last_error = result.error
+        else:
+            message.status = SMSMessage.Status.PENDING
+            message.next_attempt_at = now + retry_delay(message.attempts)
+            message.last_error = result.error
+
+    SMSMessage.objects.bulk_update(messages, [
+        'status', 'sent_at', 'provider_message_id', 'last_error',
+        'next_attempt_at', 'claim_token', 'claimed_at',
+    ])
+    return len(messages)
+
+
+def dispatch_pending(gateways=None):
+    """Send one batch for every gateway; returns the total handled"""
+    release_stale_claims()
+    names = gateways or list(getattr(settings, 'SMS_GATEWAYS', {}) or ['default'])
+    return sum(send_batch(name) for name in names)
+
+
+class SMSWorker(threading.Thread):
+    """Background thread that drains the queue until ``stop()`` is called"""
+
+    def __init__(self, gateways=None, poll_interval=2.0):
+        super().__init__(name='sms-worker', daemon=True)
+        self.gateways = gateways
+        self.poll_interval = poll_interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            close_old_connections()
+            try:
+                handled = dispatch_pending(self.gateways)
+            except Exception:
+                logger.exception('SMS dispatch failed')
+                handled = 0
+            if not handled:
+                self._stopped.wait(self.poll_interval)
+        close_old_connections()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.join(timeout)
@@ -0,0 +1,32 @@
+// Loads older audit rows on the CompanyLocation change page (keyset paginated)
+document.addEventListener('click', function (event) {
+    var button = event.target.closest('.audit-timeline-more');
+    if (!button) {
+        return;
+    }
+    var table = button.previousElementSibling;
+    var url = button.dataset.url + '?before=' + encodeURIComponent(button.dataset.cursor);
+    button.disabled = true;
+    fetch(url, {credentials: 'same-origin', headers: {'Accept': 'application/json'}})
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+            var body = table.querySelector('tbody');
+            data.results.forEach(function (log) {
+                var row = document.createElement('tr');
+                [log.timestamp, log.user, log.action, log.field_name, log.old_value, log.new_value]
+                    .forEach(function (value) {
+                        var cell = document.createElement('td');
+                        cell.textContent = value === null ? '' : value;
+                        row.appendChild(cell);
+                    });
+                body.appendChild(row);
+            });
+            if (data.next) {
+                button.dataset.cursor = data.next;
+                button.disabled = false;
+            } else {
+                button.remove();
+            }
+        })
+        .catch(function () { button.disabled = false; });
+});
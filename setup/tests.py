@@ -1,3 +1,784 @@
-from django.test import TestCase
+import gzip
+import io
+import math
+import os
+import random
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, Permission, User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import (
+    access, audit, audit_archive, bus, caching, checks, geo, hierarchy, hours, images, location_context, sms,
+)
+from .forms import LogoImageField
+from .middleware import LocationContextMiddleware
+from .models import (
+    AuditEntry, ClassDetail, Company, CompanyLocation, Department, LocationAuditLog, LocationType, SMSMessage,
+    UserCompany, UserLocation,
+)
+from .pagination import decode_timestamp_cursor, keyset_page
+from .scope import get_user_scope, scope_filter
+from .views import prefix_q
+from . import sequences
+
+
+def make_company(user, name='Acme', registration_number=None, **kwargs):
+    company = new_company(user, name, registration_number, **kwargs)
+    company.save()
+    return company
+
+
+def new_company(user, name='Acme', registration_number=None, **kwargs):
+    return Company(**{
+        'name': name, 'registration_number': registration_number or f'REG-{name}', 'phone': '+94112345678',
+        'email': 'info@example.com', 'address_line1': '1 Main St', 'city': 'Colombo', 'state': 'Western',
+        'country': 'Sri Lanka', 'postal_code': '00100', 'created_by': user, 'updated_by': user, **kwargs,
+    })
+
+
+def make_location(company, code, location_type=None, **kwargs):
+    user = company.created_by
+    if location_type is None:
+        location_type, _ = LocationType.objects.get_or_create(
+            name='Branch', defaults={'created_by': user, 'updated_by': user},
+        )
+    return CompanyLocation.objects.create(
+        company=company, location_type=location_type, name=code, code=code,
+        contact_person='A', contact_email='branch@example.com', contact_phone='+94112345678',
+        address_line1='1 Main St', city='Colombo', state='Western', country='Sri Lanka',
+        postal_code='00100', created_by=user, updated_by=user, **kwargs,
+    )
+
+
+def capture_render():
+    """Patch views.render to return the template context as ``response.view_context``"""
+    def render(request, template_name, context=None, *args, **kwargs):
+        response = HttpResponse(template_name)
+        response.view_context = context
+        return response
+    return mock.patch('setup.views.render', side_effect=render)
+
+
+class SequenceAllocatorConcurrencyTests(TransactionTestCase):
+    workers = 8
+    numbers_per_worker = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Needs a test database that allows several connections')
+        user = User.objects.create(username='seq')
+        company = Company.objects.create(
+            name='Sequence Test', registration_number='SEQ-1', phone='+94112345678',
+            email='seq@example.com', address_line1='1 Main St', city='Colombo',
+            state='Western', country='Sri Lanka', postal_code='00100',
+            created_by=user, updated_by=user,
+        )
+        self.department = Department.objects.create(
+            Code='OPD', name='OPD', company=company,
+            issue_sequence_number=True, department_wise_sequence=True,
+        )
+
+    def allocate_concurrently(self):
+        issued, errors = [], []
+        barrier = threading.Barrier(self.workers)
+
+        def work():
+            try:
+                barrier.wait()
+                for _ in range(self.numbers_per_worker):
+                    issued.append(sequences.next_department_number(self.department))
+            except Exception as exc:  # pragma: no cover - reported below
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return issued
+
+    def test_strict_mode_has_no_gaps_or_duplicates(self):
+        issued = self.allocate_concurrently()
+        total = self.workers * self.numbers_per_worker
+        self.assertEqual(sorted(issued), list(range(1, total + 1)))
+
+    def test_block_mode_has_no_duplicates(self):
+        self.department.sequence_block_size = 10
+        sequences.block_allocator.clear()
+        issued = self.allocate_concurrently()
+        self.assertEqual(len(issued), len(set(issued)))
+
+    def test_block_rolled_back_with_transaction_is_not_reused(self):
+        self.department.sequence_block_size = 10
+        sequences.block_allocator.clear()
+        try:
+            with transaction.atomic():
+                self.assertEqual(sequences.next_department_number(self.department), 1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        issued = [sequences.next_department_number(self.department) for _ in range(3)]
+        self.assertEqual(issued, [1, 2, 3])
+        self.assertEqual(sequences.current_value(sequences.department_scope(self.department)), 10)
+
+
+class AuditTimelinePaginationTests(TestCase):
+    def setUp(self):
+        user = self.user = User.objects.create(username='timeline')
+        company = Company.objects.create(
+            name='Timeline Test', registration_number='TL-1', phone='+94112345678',
+            email='tl@example.com', address_line1='1 Main St', city='Colombo',
+            state='Western', country='Sri Lanka', postal_code='00100',
+            created_by=user, updated_by=user,
+        )
+        location_type = LocationType.objects.create(name='Branch', created_by=user, updated_by=user)
+        self.location = CompanyLocation.objects.create(
+            company=company, location_type=location_type, name='Main', code='TL01',
+            contact_person='A', contact_email='tl@example.com', contact_phone='+94112345678',
+            address_line1='1 Main St', city='Colombo', state='Western', country='Sri Lanka',
+            postal_code='00100', created_by=user, updated_by=user,
+        )
+
+    def test_rows_sharing_a_millisecond_are_not_skipped(self):
+        timestamp = timezone.now().replace(microsecond=123456)
+        LocationAuditLog.objects.bulk_create([
+            LocationAuditLog(location=self.location, action='update', field_name=f'f{i}',
+                             timestamp=timestamp, user=self.user)
+            for i in range(12)
+        ])
+        seen, before = [], None
+        while True:
+            rows, cursor = keyset_page(
+                LocationAuditLog.objects.timeline(self.location, before), 10,
+                lambda log: (log.timestamp, log.pk),
+            )
+            seen.extend(log.pk for log in rows)
+            if cursor is None:
+                break
+            before = decode_timestamp_cursor(cursor)
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(len(set(seen)), 12)
+
+    def test_invalid_cursor_is_ignored(self):
+        for cursor in ['garbage', 'WyJ4IiwxXQ', 'WyIyMDI2LTEzLTAxVDAwOjAwOjAwIiwxXQ', 'WyIyMDI2LTAxLTAxVDAwOjAwOjAwIiwieCJd']:
+            self.assertIsNone(decode_timestamp_cursor(cursor))
+
+
+def png_bytes(size=(40, 30), padding=0):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'PNG')
+    return buffer.getvalue() + b'\0' * padding
+
+
+class LogoUploadHandlerTests(SimpleTestCase):
+    def upload(self, content):
+        request = RequestFactory().post('/', {
+            'logo': SimpleUploadedFile('logo.png', content, 'image/png'),
+            'name': 'After the file',
+        })
+        return request.FILES['logo'], request.POST
+
+    def assertRejected(self, content, message):
+        logo, post = self.upload(content)
+        self.assertIn(message, logo.upload_error)
+        self.assertEqual(post['name'], 'After the file')
+        with self.assertRaisesMessage(ValidationError, message):
+            LogoImageField().clean(logo)
+
+    def test_valid_logo(self):
+        logo, _ = self.upload(png_bytes())
+        self.assertIsNone(logo.upload_error)
+        self.assertEqual((logo.image_format, logo.dimensions), ('PNG', (40, 30)))
+        self.assertEqual(LogoImageField().clean(logo).content_type, 'image/png')
+
+    def test_oversize_logo_is_reported_on_the_field(self):
+        self.assertRejected(png_bytes(padding=images.LOGO_MAX_BYTES), 'Maximum file size')
+
+    def test_unreadable_header(self):
+        self.assertRejected(b'not an image' * 100, 'not a readable image')
+
+    def test_too_many_pixels(self):
+        self.assertRejected(png_bytes((images.LOGO_MAX_SIDE + 1, 10)), 'the limit is')
+
+
+class CompanySearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='admin', is_superuser=True, is_staff=True)
+        for name, registration_number in [('Acme', 'R-100'), ('Acorn', 'R-200'), ('Beta', 'AC-300'), ('Gamma', 'R-400')]:
+            make_company(self.user, name, registration_number)
+        self.client.force_login(self.user)
+
+    def test_prefix_matches_name_or_registration_number(self):
+        with capture_render():
+            response = self.client.get('/company/company/', {'q': 'Ac'})
+        self.assertEqual([company.name for company in response.view_context['companies']], ['Acme', 'Acorn'])
+        with capture_render():
+            response = self.client.get('/company/company/', {'q': 'AC-'})
+        self.assertEqual([company.name for company in response.view_context['companies']], ['Beta'])
+
+    def test_prefix_search_seeks_the_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan format is SQLite specific')
+        plan = Company.objects.filter(prefix_q('name', 'Ac') | prefix_q('registration_number', 'Ac')).explain()
+        self.assertIn('SEARCH setup_company USING INDEX', plan)
+        self.assertNotIn('SCAN setup_company', plan)
+
+
+class AuditArchiveTests(TestCase):
+    def setUp(self):
+        user = self.user = User.objects.create(username='archiver')
+        self.location = make_location(make_company(user), 'AR01')
+        self.timestamp = timezone.now().replace(microsecond=123456) - timedelta(days=400)
+        LocationAuditLog.objects.bulk_create([
+            LocationAuditLog(location=self.location, action='update', field_name=f'f{i}',
+                             timestamp=self.timestamp + timedelta(microseconds=i), user=user)
+            for i in range(5)
+        ])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(AUDIT_ARCHIVE_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.before = timezone.now() - timedelta(days=1)
+
+    def archived(self):
+        return list(audit_archive.iter_archive('location_audit_log'))
+
+    def test_timestamps_keep_microseconds(self):
+        self.assertEqual(audit_archive.archive('location_audit_log', self.before), 5)
+        timestamps = [row['timestamp'] for row in self.archived()]
+        self.assertEqual(timestamps, [self.timestamp + timedelta(microseconds=i) for i in range(5)])
+        self.assertFalse(LocationAuditLog.objects.exists())
+
+    def test_crash_before_delete_does_not_archive_twice(self):
+        real_save_index = audit_archive.save_index
+
+        def save_then_crash(source, index):
+            real_save_index(source, index)
+            if any(entry.get('pending_ids') for entry in index.values()):
+                raise RuntimeError('crash')
+
+        with mock.patch.object(audit_archive, 'save_index', side_effect=save_then_crash):
+            with self.assertRaises(RuntimeError):
+                audit_archive.archive('location_audit_log', self.before)
+        self.assertEqual(LocationAuditLog.objects.count(), 5)
+
+        self.assertEqual(audit_archive.archive('location_audit_log', self.before), 0)
+        self.assertFalse(LocationAuditLog.objects.exists())
+        self.assertEqual(len(self.archived()), 5)
+
+    def test_unindexed_tail_is_ignored_and_cut(self):
+        audit_archive.archive('location_audit_log', self.before)
+        entry = next(iter(audit_archive.load_index('location_audit_log').values()))
+        path = os.path.join(audit_archive.source_dir('location_audit_log'), entry['file'])
+        with open(path, 'ab') as fh:
+            fh.write(gzip.compress(b'{"id": 999}\n'))
+        self.assertEqual(len(self.archived()), 5)
+
+        LocationAuditLog.objects.create(location=self.location, action='update', field_name='late',
+                                        timestamp=self.timestamp, user=self.user)
+        audit_archive.archive('location_audit_log', self.before)
+        self.assertEqual(sorted(row['field_name'] for row in self.archived()),
+                         ['f0', 'f1', 'f2', 'f3', 'f4', 'late'])
+
+
+class LocationContextTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='clerk')
+        with self.captureOnCommitCallbacks(execute=True):
+            company = make_company(self.user)
+            self.location = make_location(company, 'COL01')
+            self.other = make_location(make_company(self.user, 'Other'), 'OTH01')
+            UserCompany.objects.create(user=self.user, company=company)
+
+    def request(self, code):
+        request = RequestFactory().get('/', HTTP_X_LOCATION_CODE=code)
+        request.user, request.session = self.user, {}
+        request.scope = get_user_scope(self.user)
+        response = LocationContextMiddleware(lambda request: HttpResponse())(request)
+        return request, response
+
+    def test_header_names_the_location(self):
+        request, response = self.request('COL01')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((request.location.pk, request.company.pk), (self.location.pk, self.location.company_id))
+
+    def test_unknown_or_out_of_scope_code_is_refused(self):
+        self.assertEqual(self.request('NOPE')[1].status_code, 403)
+        self.assertEqual(self.request('OTH01')[1].status_code, 403)
+
+    def test_unknown_codes_are_not_cached_or_queried(self):
+        location_context.get_location('COL01')
+        cached = dict(location_context._locations)
+        with CaptureQueriesContext(connection) as queries:
+            for i in range(50):
+                self.assertIsNone(location_context.get_location(f'RANDOM{i}'))
+        # Only the generation check, which is a cache read
+        self.assertFalse([query for query in queries if 'setup_companylocation' in query['sql']])
+        self.assertEqual(location_context._locations, cached)
+
+
+class CompanyHierarchyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='clerk')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company = make_company(self.user)
+            make_location(self.company, 'COL01')
+            self.other = make_company(self.user, 'Other')
+            UserCompany.objects.create(user=self.user, company=self.company)
+        self.client.force_login(self.user)
+
+    def url(self, pk):
+        return f'/company/company/{pk}/hierarchy/'
+
+    def test_unchanged_document_is_not_modified(self):
+        response = self.client.get(self.url(self.company.pk))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url(self.company.pk), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_or_out_of_scope_company_is_not_found(self):
+        self.assertEqual(self.client.get(self.url(self.other.pk)).status_code, 404)
+        self.client.force_login(User.objects.create(username='admin', is_superuser=True))
+        self.assertEqual(self.client.get(self.url(999999)).status_code, 404)
+        self.assertIsNone(caching.peek_version(hierarchy.version_name(999999)))
+
+
+class ScopedManyToManyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='clerk', is_staff=True)
+        company, other = make_company(self.user), make_company(self.user, 'Other')
+        UserCompany.objects.create(user=self.user, company=company)
+        departments = [
+            Department.objects.create(name=name, company=owner, created_by=self.user, updated_by=self.user)
+            for name, owner in [('Lab', company), ('Ward', company), ('Other', other)]
+        ]
+        self.own, self.foreign, self.unattached = (
+            ClassDetail.objects.create(class_code=code, name=code, created_by=self.user, updated_by=self.user)
+            for code in ('OWN', 'FOREIGN', 'NEW')
+        )
+        self.own.departments.set(departments[:2])
+        self.foreign.departments.set(departments[2:])
+
+    def test_rows_without_departments_stay_visible_once(self):
+        visible = scope_filter(ClassDetail.objects.all(), self.user, 'departments__company')
+        self.assertEqual(sorted(detail.class_code for detail in visible), ['NEW', 'OWN'])
+
+
+class InvalidationBusTests(TestCase):
+    topic = 'test-topic'
+
+    def setUp(self):
+        self.calls = []
+        bus.subscribe(self.topic)(self.calls.append)
+        self.addCleanup(bus._subscribers.pop, self.topic)
+
+    def test_events_are_delivered_once_per_transaction(self):
+        before = bus.generation(self.topic)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                bus.publish(self.topic, 1)
+                bus.publish(self.topic, 2)
+                bus.publish(self.topic, 2)
+            self.assertEqual(self.calls, [])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self.calls, [{1, 2}])
+        self.assertNotEqual(bus.generation(self.topic), before)
+
+    def test_each_transaction_is_delivered(self):
+        for key in (1, 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                bus.publish(self.topic, key)
+        self.assertEqual(self.calls, [{1}, {2}])
+
+    def test_nothing_is_delivered_after_a_rollback(self):
+        before = bus.generation(self.topic)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                bus.publish(self.topic, 1)
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.calls, [])
+        self.assertEqual(bus.generation(self.topic), before)
+
+class UserScopeInvalidationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='clerk')
+        self.other = User.objects.create(username='other')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company = make_company(self.user)
+
+    def test_grants_refresh_the_cached_scope_on_commit(self):
+        self.assertFalse(get_user_scope(self.user).has_company(self.company))
+        with self.captureOnCommitCallbacks(execute=True):
+            grant = UserCompany.objects.create(user=self.user, company=self.company)
+        self.assertTrue(get_user_scope(self.user).has_company(self.company))
+
+        # A grant handed to another user is revoked from the first one
+        with self.captureOnCommitCallbacks(execute=True):
+            grant.user = self.other
+            grant.save()
+        self.assertFalse(get_user_scope(self.user).has_company(self.company))
+        self.assertTrue(get_user_scope(self.other).has_company(self.company))
+
+
+class BitsetModelBackendTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='clerk', is_staff=True)
+        self.change = Permission.objects.get(codename='change_company', content_type__app_label='setup')
+        self.delete = Permission.objects.get(codename='delete_company', content_type__app_label='setup')
+
+    def fresh(self):
+        # Permissions are memoised on the user object, like ModelBackend's cache
+        return User.objects.get(pk=self.user.pk)
+
+    def test_user_permissions(self):
+        self.assertFalse(self.fresh().has_perm('setup.change_company'))
+        self.user.user_permissions.add(self.change)
+        user = self.fresh()
+        self.assertTrue(user.has_perm('setup.change_company'))
+        self.assertTrue(user.has_module_perms('setup'))
+        self.assertFalse(user.has_module_perms('auth'))
+        self.assertEqual(user.get_all_permissions(), {'setup.change_company'})
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.fresh().has_perm('setup.change_company'))
+
+    def test_group_permissions(self):
+        group = Group.objects.create(name='Editors')
+        group.permissions.add(self.delete)
+        self.user.groups.add(group)
+        self.assertTrue(self.fresh().has_perm('setup.delete_company'))
+        group.permissions.remove(self.delete)
+        self.assertFalse(self.fresh().has_perm('setup.delete_company'))
+
+    def test_company_and_location_bits(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            company = make_company(self.user)
+            location = make_location(company, 'COL01')
+            other = make_location(make_company(self.user, 'Other'), 'OTH01')
+            UserLocation.objects.create(user=self.user, company=company, location=location)
+        user_access = access.get_user_access(self.fresh())
+        self.assertTrue(user_access.has_company(company))
+        self.assertTrue(user_access.has_location(location))
+        self.assertFalse(user_access.has_location(other))
+        self.assertEqual(list(user_access.filter_locations(CompanyLocation.objects.all())), [location])
+
+
+class AuditBufferTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='auditor')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.location = make_location(make_company(self.user), 'AU01')
+
+    def row(self, field_name):
+        return LocationAuditLog(location=self.location, action='update', field_name=field_name, user=self.user)
+
+    def logged(self):
+        return sorted(LocationAuditLog.objects.values_list('field_name', flat=True))
+
+    def test_rows_are_written_together_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            for name in ('a', 'b', 'c'):
+                audit.record(self.row(name))
+        self.assertEqual(self.logged(), [])
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(self.logged(), ['a', 'b', 'c'])
+
+    def test_rolled_back_savepoint_drops_its_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            audit.record(self.row('kept'))
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                audit.record(self.row('dropped'))
+                raise RuntimeError
+            with transaction.atomic():
+                audit.record(self.row('nested'))
+        self.assertEqual(self.logged(), ['kept', 'nested'])
+
+    def test_each_transaction_is_written(self):
+        for name in ('first', 'second'):
+            with self.captureOnCommitCallbacks(execute=True):
+                audit.record(self.row(name))
+        self.assertEqual(self.logged(), ['first', 'second'])
+
+
+class M2MAuditTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='auditor')
+        with self.captureOnCommitCallbacks(execute=True):
+            company = make_company(user)
+            self.departments = [
+                Department.objects.create(name=name, company=company, created_by=user, updated_by=user)
+                for name in ('Lab', 'Ward', 'Clinic')
+            ]
+            self.detail = ClassDetail.objects.create(class_code='C1', name='C1', created_by=user, updated_by=user)
+
+    def m2m_changes(self):
+        return list(AuditEntry.objects.filter(action=AuditEntry.Action.M2M).order_by('pk').values_list('object_id', 'changes'))
+
+    def test_changes_in_a_transaction_become_one_entry(self):
+        lab, ward, clinic = self.departments
+        with self.captureOnCommitCallbacks(execute=True):
+            self.detail.departments.add(lab, ward)
+            self.detail.departments.remove(ward)
+            clinic.classesDepartments.add(self.detail)
+        self.assertEqual(self.m2m_changes(), [
+            (self.detail.pk, {'departments': {'added': [lab.pk, clinic.pk], 'removed': []}}),
+        ])
+
+    def test_clear_records_the_removed_ids(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.detail.departments.set(self.departments[:2])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.detail.departments.clear()
+        self.assertEqual(self.m2m_changes()[-1][1], {
+            'departments': {'added': [], 'removed': sorted(department.pk for department in self.departments[:2])},
+        })
+
+
+class HeadquartersConstraintTests(TestCase):
+    def setUp(self):
+        self.company = make_company(User.objects.create(username='clerk'))
+        self.headquarters = make_location(self.company, 'HQ01', is_headquarters=True)
+
+    def test_second_headquarters_is_reported_on_the_field(self):
+        with self.assertRaises(ValidationError) as raised:
+            make_location(self.company, 'HQ02', is_headquarters=True)
+        self.assertEqual(list(raised.exception.message_dict), ['is_headquarters'])
+        # The conflict was confined to a savepoint; the transaction goes on
+        self.assertEqual(list(CompanyLocation.objects.filter(is_headquarters=True)), [self.headquarters])
+
+    def test_full_clean_reports_the_conflict_on_the_field(self):
+        location = CompanyLocation(company=self.company, is_headquarters=True)
+        with self.assertRaises(ValidationError) as raised:
+            location.validate_constraints()
+        self.assertEqual(list(raised.exception.message_dict), ['is_headquarters'])
+
+    def test_branches_and_other_companies_are_unaffected(self):
+        make_location(self.company, 'BR01')
+        make_location(self.company, 'BR02')
+        make_location(make_company(self.company.created_by, 'Other'), 'HQ03', is_headquarters=True)
+        self.headquarters.name = 'Head office'
+        self.headquarters.save()
+        self.assertEqual(CompanyLocation.objects.filter(is_headquarters=True).count(), 2)
+
+
+class ValidatedBulkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='importer')
+        self.existing = make_company(self.user, 'Existing', 'R-1')
+
+    def test_create_reports_errors_per_row_and_inserts_nothing(self):
+        rows = [
+            new_company(self.user, 'Fresh', 'R-2'),
+            new_company(self.user, 'Existing', 'R-3'),
+            new_company(self.user, 'Twin', 'R-2'),
+            new_company(self.user, 'Broken', 'R-4', email='not-an-email'),
+        ]
+        with self.assertRaises(ValidationError) as raised:
+            Company.objects.validated_bulk_create(rows, user=self.user)
+        errors = raised.exception.message_dict
+        self.assertEqual(list(errors), [1, 2, 3])
+        self.assertTrue(errors[1][0].startswith('name: '))
+        self.assertTrue(errors[2][0].startswith('registration_number: Duplicate'))
+        self.assertTrue(errors[3][0].startswith('email: '))
+        self.assertEqual(list(Company.objects.all()), [self.existing])
+
+    def test_create_inserts_valid_rows(self):
+        created = Company.objects.validated_bulk_create(
+            [new_company(self.user, name, f'R-{name}') for name in ('One', 'Two')], user=self.user,
+        )
+        self.assertEqual(Company.objects.filter(pk__in=[company.pk for company in created]).count(), 2)
+
+    def test_update_reports_conflicts_with_other_rows(self):
+        other = make_company(self.user, 'Other', 'R-9')
+        other.registration_number = 'R-1'
+        self.existing.phone = 'nope'
+        with self.assertRaises(ValidationError) as raised:
+            Company.objects.validated_bulk_update([self.existing, other], ['phone', 'registration_number'])
+        self.assertEqual(list(raised.exception.message_dict), [0, 1])
+        self.assertTrue(raised.exception.message_dict[1][0].startswith('registration_number: '))
+
+        # Keeping its own value is not a conflict
+        self.existing.phone = '+94119999999'
+        Company.objects.validated_bulk_update([self.existing], ['phone', 'registration_number'])
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.phone, '+94119999999')
+
+
+# A Monday
+MONDAY = datetime(2026, 10, 19)
+
+
+class OperatingHoursTests(SimpleTestCase):
+    def test_compile_merges_splits_and_wraps_the_week(self):
+        intervals = hours.compile_operating_hours({
+            'monday': '08:00-12:00, 11:00-17:00',
+            'sat': {'open': '22:00', 'close': '02:00'},
+            'sunday': '10pm-1am',
+            'tuesday': 'closed',
+        })
+        self.assertEqual(intervals, [[0, 60], [480, 1020], [8520, 8760], [9960, 10080]])
+
+    def test_invalid_days_raise_unless_lenient(self):
+        with self.assertRaisesMessage(ValueError, 'monday'):
+            hours.compile_operating_hours({'monday': '8-', 'friday': '9-17'})
+        self.assertEqual(hours.compile_operating_hours({'monday': '8-', 'friday': '9-17'}, strict=False),
+                         [[4 * 1440 + 540, 4 * 1440 + 1020]])
+
+    def test_is_open(self):
+        intervals = hours.compile_operating_hours({'monday': '08:00-17:00', 'sunday': '22:00-02:00'})
+        self.assertTrue(hours.is_open(intervals, MONDAY + timedelta(hours=1)))
+        self.assertTrue(hours.is_open(intervals, MONDAY + timedelta(hours=8)))
+        self.assertFalse(hours.is_open(intervals, MONDAY + timedelta(hours=17)))
+        self.assertFalse(hours.is_open(intervals, MONDAY + timedelta(days=1, hours=9)))
+
+
+class OpeningIndexTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='clerk')
+        with self.captureOnCommitCallbacks(execute=True):
+            company = make_company(user)
+            self.day = make_location(company, 'DAY01', operating_hours={'monday': '08:00-17:00'})
+            self.night = make_location(company, 'NGT01', operating_hours={'sunday': '22:00-06:00'})
+            make_location(company, 'OFF01', operating_hours={'monday': '08:00-17:00'},
+                          status=CompanyLocation.LocationStatus.INACTIVE)
+        self.at = timezone.make_aware(MONDAY)
+
+    def test_open_locations_and_refresh_on_change(self):
+        self.assertEqual(hours.open_location_ids(self.at + timedelta(hours=5)), {self.night.pk})
+        self.assertEqual(hours.open_location_ids(self.at + timedelta(hours=9)), {self.day.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.night.operating_hours = {'monday': '00:00-24:00'}
+            self.night.save()
+        self.assertEqual(hours.open_location_ids(self.at + timedelta(hours=9)), {self.day.pk, self.night.pk})
+
+
+class LocationIndexTests(SimpleTestCase):
+    def setUp(self):
+        generator = random.Random(7)
+        self.rows = [
+            (pk, pk % 3, generator.uniform(-90, 90), generator.uniform(-180, 180)) for pk in range(1, 301)
+        ]
+        self.index = geo.LocationIndex(self.rows)
+
+    def brute_force(self, target, accept=lambda pk, company: True):
+        return sorted(
+            (math.sqrt(geo._chord2(target, geo.to_vector(latitude, longitude))), pk)
+            for pk, company, latitude, longitude in self.rows if accept(pk, company)
+        )
+
+    def test_nearest_and_within_match_a_full_scan(self):
+        accept = lambda pk, company: company != 0  # noqa: E731
+        # Including the poles and both sides of the antimeridian
+        for latitude, longitude in [(0, 0), (89.9, 10), (-89.9, -170), (10, 179.9), (10, -179.9), (45, 90)]:
+            target = geo.to_vector(latitude, longitude)
+            self.assertEqual(self.index.nearest(target, 5), self.brute_force(target)[:5])
+            self.assertEqual(self.index.nearest(target, 5, accept), self.brute_force(target, accept)[:5])
+            chord = geo.km_to_chord(2000)
+            self.assertEqual(self.index.within(target, chord),
+                             [hit for hit in self.brute_force(target) if hit[0] <= chord])
+
+
+class NearestLocationsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='clerk')
+        with self.captureOnCommitCallbacks(execute=True):
+            company = make_company(self.user)
+            self.colombo = make_location(company, 'COL01', latitude=6.9271, longitude=79.8612)
+            self.kandy = make_location(company, 'KDY01', latitude=7.2906, longitude=80.6337)
+            self.galle = make_location(company, 'GAL01', latitude=6.0535, longitude=80.2210)
+            make_location(company, 'OFF01', latitude=6.93, longitude=79.86,
+                          status=CompanyLocation.LocationStatus.INACTIVE)
+            make_location(make_company(self.user, 'Other'), 'OTH01', latitude=6.92, longitude=79.86)
+            UserCompany.objects.create(user=self.user, company=company)
+        self.client.force_login(self.user)
+
+    def test_nearest_in_scope_by_distance(self):
+        response = self.client.get('/company/locations/nearest/', {'lat': 6.93, 'lon': 79.86, 'k': 10})
+        self.assertEqual([row['code'] for row in response.json()['results']], ['COL01', 'KDY01', 'GAL01'])
+
+    def test_radius_and_moves(self):
+        hits = geo.search(6.93, 79.86, k=None, radius_km=100, scope=get_user_scope(self.user))
+        self.assertEqual([pk for pk, _ in hits], [self.colombo.pk, self.kandy.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.galle.latitude, self.galle.longitude = 6.95, 79.9
+            self.galle.save()
+        hits = geo.search(6.93, 79.86, k=2, scope=get_user_scope(self.user))
+        self.assertEqual([pk for pk, _ in hits], [self.colombo.pk, self.galle.pk])
+
+    def test_missing_coordinates_are_rejected(self):
+        self.assertEqual(self.client.get('/company/locations/nearest/', {'lat': 6.93}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='admin', is_superuser=True)
+        self.company = make_company(self.user)
+        self.client.force_login(self.user)
+
+    def get(self, url, **headers):
+        with capture_render():
+            return self.client.get(url, **headers)
+
+    def test_company_list(self):
+        url = '/company/company/'
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get(url + '?q=Ac', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        make_company(self.user, 'Beta')
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_company_detail(self):
+        url = f'/company/company/{self.company.pk}/'
+        response = self.get(url)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.company.updated_at += timedelta(seconds=1)
+        Company.objects.filter(pk=self.company.pk).update(updated_at=self.company.updated_at)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_etag_is_per_user(self):
+        url = f'/company/company/{self.company.pk}/'
+        etag = self.get(url)['ETag']
+        self.client.force_login(User.objects.create(username='other', is_superuser=True))
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+@override_settings(SMS_GATEWAYS={'default': {'BACKEND': 'setup.sms.LocMemGateway'}})
+class SMSGatewayTests(TestCase):
+    def setUp(self):
+        sms.LocMemGateway.outbox.clear()
+
+    def test_queued_messages_are_sent_through_the_default_gateway(self):
+        sms.queue_sms('+94771234567', 'Your order is ready')
+        self.assertEqual(sms.dispatch_pending(), 1)
+        self.assertEqual(sms.LocMemGateway.outbox, [{'phone': '+94771234567', 'body': 'Your order is ready'}])
+        self.assertEqual(SMSMessage.objects.get().status, SMSMessage.Status.SENT)
+
+    def test_missing_default_gateway_fails_loudly(self):
+        with override_settings(SMS_GATEWAYS={'bulk': {'BACKEND': 'setup.sms.LocMemGateway'}}):
+            self.assertEqual([error.id for error in checks.check_sms_gateways(None)], ['setup.E002'])
+            with self.assertRaises(ImproperlyConfigured):
+                sms.get_gateway('default')
+        with override_settings(SMS_GATEWAYS={'default': {}}):
+            self.assertEqual([error.id for error in checks.check_sms_gateways(None)], ['setup.E003'])
+            with self.assertRaises(ImproperlyConfigured):
+                sms.get_gateway('default')
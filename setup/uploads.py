@@ -0,0 +1,131 @@
+# uploads.py
+"""
+Streaming checks for company logo uploads.
+
+``LogoUploadHandler`` takes over file fields named in ``LOGO_UPLOAD_FIELDS``
+while the request body is being parsed:
+
+* the image header is parsed incrementally from the first chunks, and
+  unknown formats or dimensions over ``images.LOGO_MAX_SIDE`` /
+  ``images.LOGO_MAX_PIXELS`` are rejected before anything is decoded;
+* bytes beyond ``images.LOGO_MAX_BYTES`` are discarded instead of being
+  spooled, and the upload is marked as rejected.
+
+A rejected logo still reaches the form as a ``LogoUpload`` with
+``upload_error`` set, so ``forms.LogoImageField`` can report it on the
+field instead of the logo silently disappearing, and the fields after it
+are parsed as usual. Logos are handled by this handler alone; other file
+fields are passed through to the next handler untouched. The body is still
+read to the end; hard limits on the total request size, which free the
+worker early, belong in the front-end proxy.
+"""
+import io
+import tempfile
+import warnings
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.utils.translation import gettext as _
+from PIL import Image
+
+from . import images
+
+LOGO_UPLOAD_FIELDS = {'logo'}
+# Give up on finding the header after this many bytes (JPEG EXIF/ICC blocks come first)
+HEADER_PROBE_BYTES = 256 * 1024
+
+
+class LogoUpload(UploadedFile):
+    """An uploaded logo with the header facts found while streaming"""
+
+    def __init__(self, file, name, content_type, size, charset, content_type_extra=None,
+                 image_format=None, dimensions=None, upload_error=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.image_format = image_format
+        self.dimensions = dimensions
+        self.upload_error = upload_error
+
+
+class LogoUploadHandler(FileUploadHandler):
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = field_name in LOGO_UPLOAD_FIELDS
+        if not self.active:
+            return
+        self.received = 0
+        self.error = None
+        self.head = b''
+        self.image_format = self.dimensions = None
+        self.file = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        # Otherwise the temporary file handler opens a file that is never written
+        raise StopFutureHandlers()
+
+    def _reject(self, message):
+        self.error = message
+        self.file.close()
+        self.file = tempfile.SpooledTemporaryFile()
+
+    def _open_head(self):
+        """Open the image from the bytes seen so far; ``None`` if that is not enough"""
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            try:
+                # Image.open() only reads the header; nothing is decoded or allocated
+                return Image.open(io.BytesIO(self.head))
+            except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+                raise
+            except Exception:
+                # Truncated headers fail in plugin-specific ways
+                return None
+
+    def _probe(self, chunk):
+        self.head += chunk[:HEADER_PROBE_BYTES - len(self.head)]
+        try:
+            image = self._open_head()
+        except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+            self._reject(_('Image dimensions are too large.'))
+            return
+        if image is None:
+            if len(self.head) >= HEADER_PROBE_BYTES:
+                self._reject(_('The file is not a readable image.'))
+            return
+        width, height = image.size
+        if image.format not in images.LOGO_FORMATS:
+            self._reject(_('Unsupported image format %(format)s.') % {'format': image.format})
+        elif max(width, height) > images.LOGO_MAX_SIDE or width * height > images.LOGO_MAX_PIXELS:
+            self._reject(_('Image is %(width)d×%(height)d pixels; the limit is %(side)d pixels per side.') % {
+                'width': width, 'height': height, 'side': images.LOGO_MAX_SIDE,
+            })
+        else:
+            self.image_format, self.dimensions = image.format, image.size
+        self.head = None
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.received += len(raw_data)
+        if self.error:
+            return None
+        if self.received > images.LOGO_MAX_BYTES:
+            self._reject(_('Maximum file size is %(size)dMB') % {'size': images.LOGO_MAX_BYTES // (1024 * 1024)})
+            return None
+        if self.head is not None:
+            self._probe(raw_data)
+            if self.error:
+                return None
+        self.file.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        if not self.error and self.dimensions is None:
+            self._reject(_('The file is not a readable image.'))
+        self.file.seek(0)
+        return LogoUpload(
+            self.file, self.file_name, self.content_type, self.received, self.charset,
+            self.content_type_extra, image_format=self.image_format, dimensions=self.dimensions,
+            upload_error=self.error,
+        )
@@ -7,4 +7,7 @@ urlpatterns = [
     path('company/create/', views.company_create, name='company_create'),
     path('company/<int:pk>/', views.company_detail, name='company_detail'),
     path('company/<int:pk>/edit/', views.company_edit, name='company_edit'),
+    path('company/<int:pk>/hierarchy/', views.company_hierarchy, name='company_hierarchy'),
+    path('locations/nearest/', views.nearest_locations, name='nearest_locations'),
+    path('company/logos/<str:name>', views.company_logo_derivative, name='company_logo_derivative'),
 ]
\ No newline at end of file
@@ -2,8 +2,22 @@
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.db.models import Q
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
+from . import geo, hierarchy, images
+from .conditional import conditional, queryset_state
 from .forms import CompanyForm
-from .models import Company
+from .models import Company, CompanyLocation
+from .pagination import decode_cursor, encode_cursor, keyset_page
+
+COMPANY_LIST_PAGE_SIZE = 25
+# Columns rendered by companies/company_list.html
+COMPANY_LIST_FIELDS = (
+    'name', 'registration_number', 'email', 'phone', 'logo', 'is_active', 'created_at',
+    'created_by__username',
+)
+# Sorts after any text that starts with the prefix
+PREFIX_UPPER_BOUND = '\U0010ffff'
 
 @login_required
 def company_create(request):
@@ -40,16 +54,143 @@ def company_edit(request, pk):
         'company': company
     })
 
+def prefix_q(field, prefix):
+    """
+    ``field`` starts with ``prefix``, as a range an index can seek. SQLite
+    never uses an index for ``startswith``, which compiles to ``LIKE ... ESCAPE``.
+    """
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + PREFIX_UPPER_BOUND})
+
+
+def _scoped_companies(request):
+    return request.scope.filter_companies(Company.objects.all())
+
+
+def _company_list_state(request):
+    # Latest change and row count across the user's companies; the query
+    # string tells pages and searches apart
+    return (*queryset_state(_scoped_companies(request)), request.GET.urlencode())
+
+
+def _company_detail_state(request, pk):
+    updated_at = _scoped_companies(request).filter(pk=pk).values_list('updated_at', flat=True).first()
+    return None if updated_at is None else (updated_at, pk)
+
+
 @login_required
+@conditional(_company_list_state, last_modified=False)
 def company_list(request):
-    companies = Company.objects.all()
-    return render(request, 'companies/company_list.html', {'companies': companies})
+    """
+    Companies in name order, one keyset page at a time.
+
+    ``?q=`` matches the start of the name or registration number
+    (case-sensitively, as index range scans on their unique indexes);
+    ``?after=``/``?before=`` are the cursors of the next and previous page.
+    """
+    query = request.GET.get('q', '').strip()
+    companies = _scoped_companies(request).select_related('created_by').only(*COMPANY_LIST_FIELDS)
+    if query:
+        companies = companies.filter(prefix_q('name', query) | prefix_q('registration_number', query))
+
+    after = decode_cursor(request.GET.get('after'))
+    before = decode_cursor(request.GET.get('before'))
+    next_cursor = prev_cursor = None
+    if before:
+        # Walk backwards from the cursor, then restore name order
+        rows, more = keyset_page(
+            companies.filter(name__lt=before[0]).order_by('-name'),
+            COMPANY_LIST_PAGE_SIZE, lambda company: (company.name,),
+        )
+        rows.reverse()
+        prev_cursor = more and encode_cursor(rows[0].name)
+        next_cursor = rows and encode_cursor(rows[-1].name)
+    else:
+        if after:
+            companies = companies.filter(name__gt=after[0])
+        rows, next_cursor = keyset_page(
+            companies.order_by('name'), COMPANY_LIST_PAGE_SIZE, lambda company: (company.name,),
+        )
+        prev_cursor = after and rows and encode_cursor(rows[0].name)
+
+    return render(request, 'companies/company_list.html', {
+        'companies': rows,
+        'query': query,
+        'next_cursor': next_cursor or None,
+        'prev_cursor': prev_cursor or None,
+    })
 
 @login_required
+@conditional(_company_detail_state)
 def company_detail(request, pk):
-    company = get_object_or_404(Company, pk=pk)
+    company = get_object_or_404(_scoped_companies(request), pk=pk)
     return render(request, 'companies/company_detail.html', {'company': company})
 
+@login_required
+def company_logo_derivative(request, name):
+    """Serve a content-hashed logo derivative; the name never changes content"""
+    fh = images.open_derivative(name)
+    if fh is None:
+        raise Http404
+    response = FileResponse(fh)
+    response['Cache-Control'] = images.CACHE_CONTROL
+    return response
+
+def _hierarchy_state(request, pk):
+    # Scope before the version: no counter is read or created for a
+    # company the user cannot see
+    if not request.scope.has_company(pk):
+        raise Http404
+    version = hierarchy.current_version(pk)
+    if version is None:
+        raise Http404
+    return (None, version)
+
+
+@login_required
+@conditional(_hierarchy_state, last_modified=False)
+def company_hierarchy(request, pk):
+    """The company's whole location/department/service tree as one JSON document"""
+    if not request.scope.has_company(pk):
+        raise Http404
+    document = hierarchy.hierarchy_document(pk)
+    if document is None:
+        raise Http404
+    return StreamingHttpResponse(document, content_type='application/json')
+
+NEAREST_MAX_RESULTS = 50
+
+
+@login_required
+def nearest_locations(request):
+    """
+    Active locations closest to ``?lat=&lon=``, optionally within
+    ``radius`` km and offering ``service`` (a Service id).
+    """
+    try:
+        latitude = float(request.GET['lat'])
+        longitude = float(request.GET['lon'])
+        k = min(int(request.GET.get('k', 5)), NEAREST_MAX_RESULTS)
+        radius = float(request.GET['radius']) if request.GET.get('radius') else None
+        service_id = int(request.GET['service']) if request.GET.get('service') else None
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'lat and lon are required; k, radius and service must be numbers'}, status=400)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or k < 1:
+        return JsonResponse({'error': 'Coordinates out of range'}, status=400)
+
+    hits = geo.search(latitude, longitude, k=k, radius_km=radius, service_id=service_id, scope=request.scope)
+    locations = CompanyLocation.objects.only('name', 'code', 'company_id', 'city').in_bulk([pk for pk, _ in hits])
+    return JsonResponse({'results': [
+        {
+            'id': pk,
+            'code': locations[pk].code,
+            'name': locations[pk].name,
+            'company': locations[pk].company_id,
+            'city': locations[pk].city,
+            'distance_km': round(distance, 3),
+        }
+        for pk, distance in hits if pk in locations
+    ]})
+
 # from rest_framework import serializers
 # from .models import SupplierReferralFeeDetails
 